@@ -3,6 +3,8 @@ import numpy as np
 import pyqtgraph as pg
 from PyQt5 import QtWidgets, QtCore
 
+from audio_capture import open_capture
+
 class AudioStreamVisualizer:
     """リアルタイムで音声データの振幅をグラフィカルに表示するクラスです。"""
 
@@ -12,14 +14,10 @@ class AudioStreamVisualizer:
         self.CHANNELS = channels
         self.RATE = rate
 
-        self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(
-            format=self.FORMAT,
-            channels=self.CHANNELS,
-            rate=self.RATE,
-            input=True,
-            frames_per_buffer=self.CHUNK
-        )
+        # 録音はPortAudioのスレッドで行い、GUIスレッドはキューから取り出すだけにする
+        # (環境変数 SESSION_RECORD / SESSION_REPLAY でセッションの録音・再生に切り替わる)
+        self.capture = open_capture(self.RATE, self.CHANNELS, frames_per_buffer=self.CHUNK)
+        self.display_data = np.zeros(self.CHUNK, dtype=np.int16)
 
         self.app = QtWidgets.QApplication([])
         self.win = pg.GraphicsLayoutWidget(title="リアルタイム音声振幅")
@@ -36,12 +34,25 @@ class AudioStreamVisualizer:
     def update(self):
         """ストリームからデータを読み込み、グラフを更新します。"""
         try:
-            data = self.stream.read(self.CHUNK, exception_on_overflow=False)
-            numpydata = np.frombuffer(data, dtype=np.int16)
-            self.curve.setData(numpydata)
+            self.report_drops()
+            samples = self.capture.drain()
+            if len(samples) == 0:
+                return
+            # 直近 CHUNK サンプルを表示する (描画が遅れた間に届いた分もまとめて反映)
+            if len(samples) >= self.CHUNK:
+                self.display_data[:] = samples[-self.CHUNK:]
+            else:
+                self.display_data[:-len(samples)] = self.display_data[len(samples):]
+                self.display_data[-len(samples):] = samples
+            self.curve.setData(self.display_data)
         except Exception as e:
             print(f"エラーが発生しました: {str(e)}")
 
+    def report_drops(self):
+        """取りこぼしが増えたらウィンドウのタイトルに表示"""
+        if self.capture.drops_changed():
+            self.win.setWindowTitle(f"リアルタイム音声振幅 ({self.capture.status_text()})")
+
     def start(self):
         """イベントループを開始します。"""
         if __name__ == '__main__':
@@ -49,9 +60,7 @@ class AudioStreamVisualizer:
 
     def close(self):
         """ストリームとPyAudioをクリーンアップします。"""
-        self.stream.stop_stream()
-        self.stream.close()
-        self.p.terminate()
+        self.capture.close()
 
 # メイン関数
 if __name__ == '__main__':
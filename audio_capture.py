@@ -0,0 +1,160 @@
+"""
+PyQtビジュアライザ用のバックグラウンド録音
+
+PyAudio のコールバックモードで録音し、PortAudio のスレッドから deque にブロックを積む。
+GUIスレッドは QTimer のたびに drain() で届いた分をまとめて取り出すだけなので、
+描画が遅れても録音は止まらず、取りこぼしは件数として確認できる。
+
+  - overflow_count: PortAudio が報告した入力オーバーフロー (デバイス側での取りこぼし) の回数
+  - dropped_frames: GUIが追いつかずキューの上限を超えたため捨てたサンプル数
+
+deque の append / popleft はスレッドセーフなので、コールバック側でロックを取らない。
+
+open_capture() は環境変数でセッションの録音・再生 (session_recorder.py) に切り替える。
+  - SESSION_RECORD=<path>: 録音しながら表示する (ファイルへの書き込みは drain() 時にGUIスレッドで行う)
+  - SESSION_REPLAY=<path>: マイクの代わりに録音を流す (SESSION_REPLAY_SPEED で速度を指定)
+
+使い方:
+    capture = AudioCapture(rate=16000, frames_per_buffer=1024)
+    capture.start()
+    samples = capture.drain()  # QTimer のスロットで呼ぶ (int16, 届いていなければ長さ0)
+"""
+import collections
+import os
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from session_recorder import ReplaySource, SessionRecorder, replay_speed_from_env
+
+
+class AudioCapture:
+    """コールバックモードでマイク入力をキューに積むクラス"""
+
+    def __init__(self, rate: int, channels: int = 1, frames_per_buffer: int = 1024,
+                 max_queued_seconds: float = 2.0, input_device_index: Optional[int] = None,
+                 record_path: Optional[str] = None):
+        """
+        :param rate: サンプリングレート
+        :param channels: チャンネル数 (1以外の場合、drain() はインターリーブされたまま返す)
+        :param frames_per_buffer: コールバック1回あたりのフレーム数
+        :param max_queued_seconds: GUIが取り出さずにためておける最大の長さ (秒)。超えた分は古い方から捨てる
+        :param input_device_index: 入力デバイスの番号 (None は既定のデバイス)
+        :param record_path: 指定した場合、取り出したブロックをセッションファイルに保存する
+        """
+        self.rate = rate
+        self.channels = channels
+        self.frames_per_buffer = frames_per_buffer
+        self.max_queued_blocks = max(1, int(max_queued_seconds * rate / frames_per_buffer))
+        self.input_device_index = input_device_index
+
+        self.queue = collections.deque()
+        self.received_frames = 0
+        self.dropped_frames = 0
+        self.overflow_count = 0
+        self._reported = (0, 0)
+
+        self.recorder = SessionRecorder(record_path, rate, channels) if record_path else None
+        self.start_time = time.perf_counter()
+
+        self.p = None
+        self.stream = None
+
+    def start(self) -> None:
+        """録音を開始する"""
+        import pyaudio
+
+        self._pyaudio = pyaudio
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(
+            format=pyaudio.paInt16,
+            channels=self.channels,
+            rate=self.rate,
+            input=True,
+            input_device_index=self.input_device_index,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=self._callback,
+        )
+        self.start_time = time.perf_counter()
+        self.stream.start_stream()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """PortAudio のスレッドから呼ばれる。重い処理はしない"""
+        if status & self._pyaudio.paInputOverflow:
+            self.overflow_count += 1
+        if len(self.queue) >= self.max_queued_blocks:
+            _, dropped = self.queue.popleft()
+            self.dropped_frames += len(dropped) // self.channels
+        # in_data は呼び出しごとに新しい bytes なので、コピーせずにそのまま配列として扱える
+        self.queue.append((time.perf_counter() - self.start_time, np.frombuffer(in_data, dtype=np.int16)))
+        self.received_frames += frame_count
+        return None, self._pyaudio.paContinue
+
+    def drain(self) -> np.ndarray:
+        """前回から届いたサンプルをまとめて返す"""
+        blocks = []
+        while True:
+            try:
+                timestamp, block = self.queue.popleft()
+            except IndexError:
+                break
+            if self.recorder is not None:
+                self.recorder.write(block, timestamp)
+            blocks.append(block)
+        if not blocks:
+            return np.zeros(0, dtype=np.int16)
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.concatenate(blocks)
+
+    def stats(self) -> Dict[str, int]:
+        """取りこぼしの統計"""
+        return {
+            "received_frames": self.received_frames,
+            "dropped_frames": self.dropped_frames,
+            "overflow_count": self.overflow_count,
+            "queued_blocks": len(self.queue),
+        }
+
+    def drops_changed(self) -> bool:
+        """前回の呼び出しから取りこぼしが増えたかどうか (GUIの表示更新用)"""
+        current = (self.dropped_frames, self.overflow_count)
+        changed = current != self._reported
+        self._reported = current
+        return changed
+
+    def status_text(self) -> str:
+        """取りこぼしの状況を1行で表す"""
+        return f"オーバーフロー {self.overflow_count} 回 / 破棄 {self.dropped_frames} サンプル"
+
+    def close(self) -> None:
+        """ストリームとPyAudioをクリーンアップ"""
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.p is not None:
+            self.p.terminate()
+            self.p = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+
+def open_capture(rate: int, channels: int = 1, frames_per_buffer: int = 1024):
+    """
+    マイク入力 (AudioCapture) またはセッションの再生 (ReplaySource) を開始して返す
+
+    どちらも drain() / stats() / drops_changed() / status_text() / close() を持つ。
+    """
+    replay_path = os.environ.get("SESSION_REPLAY")
+    if replay_path:
+        source = ReplaySource(replay_path, speed=replay_speed_from_env())
+        if source.rate != rate:
+            raise ValueError(f"録音のサンプリングレート ({source.rate}Hz) が表示の設定 ({rate}Hz) と異なります")
+        source.start()
+        return source
+    capture = AudioCapture(rate, channels, frames_per_buffer, record_path=os.environ.get("SESSION_RECORD"))
+    capture.start()
+    return capture
@@ -0,0 +1,224 @@
+"""
+長時間録音のスペクトログラムをまとめて計算し、メモリマップの .npy に保存する
+
+数時間分のWAVを重なりのある区間に分け、プロセスプールで並列にSTFT (stft_engine.STFTEngine.batch) を計算して、
+(フレーム数, ビン数) の .npy (numpy.lib.format.open_memmap) に直接書き込む。
+入力もメモリマップで読むので、録音全体をメモリに載せない。
+
+出力ディレクトリの構成:
+    spectrogram.json   メタデータ (サンプリングレート, hop, 周波数, 各レベルのファイル名と時間間隔)
+    level0.npy         全フレーム (時刻, 周波数)
+    level1.npy         時間方向に2フレームずつ最大値でまとめたもの
+    level2.npy         さらに2フレームずつまとめたもの ... (max_rows 行以下になるまで)
+
+ビューアは表示する時間幅に合わせてレベルを選べば、何時間分でも一定の行数だけを読み出せる。
+時間方向の縮小は最大値で行う (平均にすると短い音が薄くなって見えなくなるため)。
+
+使い方:
+    python batch_spectrogram.py field.wav --output field_spec --hop 512 --workers 8
+    python batch_spectrogram.py field.wav --output field_spec --dtype float32 --band 2000 7900
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from stft_engine import STFTEngine
+
+METADATA_FILE = "spectrogram.json"
+
+
+def read_samples(path: str) -> Tuple[int, np.ndarray]:
+    """WAVファイルをメモリマップで開き、(サンプリングレート, 1チャンネル目) を返す"""
+    from scipy.io import wavfile
+
+    rate, data = wavfile.read(path, mmap=True)
+    if data.ndim > 1:
+        data = data[:, 0]
+    return rate, data
+
+
+def count_frames(num_samples: int, frame_length: int, hop: int) -> int:
+    """num_samples サンプルから取れるフレーム数 (STFTEngine.batch と同じ数え方)"""
+    if num_samples < frame_length:
+        return 0
+    return (num_samples - frame_length) // hop + 1
+
+
+def _segment_worker(args: Tuple) -> Tuple[int, int]:
+    """
+    フレーム番号 [start, end) のスペクトルを計算して level0.npy に書き込む (子プロセスで実行)
+
+    大きな配列は受け渡さず、WAVと出力ファイルのパスだけを受け取ってそれぞれメモリマップで開く。
+    """
+    wav_path, output_path, start, end, engine_options = args
+    _, samples = read_samples(wav_path)
+    stft = STFTEngine(**engine_options)
+    segment = samples[start * stft.hop:(end - 1) * stft.hop + stft.frame_length]
+    if segment.dtype.kind == "f":
+        # float のWAVは -1〜1 なので int16 と同じ大きさ (dB) にそろえる
+        segment = segment * 32767
+    spectra = stft.batch(segment)
+
+    output = np.load(output_path, mmap_mode="r+")
+    output[start:end] = spectra
+    output.flush()
+    del output
+    return start, end
+
+
+def build_pyramid(directory: str, max_rows: int = 2048, chunk_rows: int = 1 << 16) -> List[Dict]:
+    """
+    level0.npy から時間方向に1/2ずつ縮小したレベルを作る
+
+    各レベルは1つ前のレベルを chunk_rows 行ずつ読み、2行ごとの最大値を書き込む。
+
+    Returns:
+        list: 各レベルの {"file", "frames", "frames_per_row"}
+    """
+    levels = []
+    level = 0
+    source = np.load(os.path.join(directory, "level0.npy"), mmap_mode="r")
+    levels.append({"file": "level0.npy", "frames": int(source.shape[0]), "frames_per_row": 1})
+    chunk_rows -= chunk_rows % 2
+    while source.shape[0] > max_rows:
+        level += 1
+        rows = -(-source.shape[0] // 2)  # 奇数の場合は最後の1行をそのまま残す
+        name = f"level{level}.npy"
+        target = np.lib.format.open_memmap(os.path.join(directory, name), mode="w+",
+                                           dtype=source.dtype, shape=(rows, source.shape[1]))
+        for start in range(0, source.shape[0], chunk_rows):
+            block = np.asarray(source[start:start + chunk_rows])
+            pairs = len(block) // 2
+            out = target[start // 2:start // 2 + pairs]
+            np.maximum(block[0:2 * pairs:2], block[1:2 * pairs:2], out=out)
+            if len(block) % 2:
+                target[start // 2 + pairs] = block[-1]
+        target.flush()
+        levels.append({"file": name, "frames": rows, "frames_per_row": 2 ** level})
+        del source
+        source = target
+    del source
+    return levels
+
+
+def compute_spectrogram(wav_path: str, directory: str, frame_length: int = 2048, hop: int = 512,
+                        nfft: Optional[int] = None, window: Optional[str] = "hann",
+                        band: Optional[Tuple[float, float]] = None, dtype: str = "float16",
+                        segment_seconds: float = 60.0, workers: Optional[int] = None,
+                        max_rows: int = 2048) -> Dict:
+    """
+    WAVファイル全体のスペクトログラム (dB) を計算し、directory に保存する
+
+    Args:
+        segment_seconds: 1つのタスクで計算する長さ (区間の境界では frame_length - hop サンプル重ねて読む)
+        workers: プロセス数 (None は CPU 数)
+        max_rows: ピラミッドの最上位レベルの最大行数
+
+    Returns:
+        dict: spectrogram.json に保存したメタデータ
+    """
+    rate, samples = read_samples(wav_path)
+    num_samples = len(samples)
+    del samples
+
+    engine_options = {"frame_length": frame_length, "sample_rate": rate, "nfft": nfft, "hop": hop,
+                      "window": window, "band": band}
+    stft = STFTEngine(**engine_options)
+    total_frames = count_frames(num_samples, frame_length, stft.hop)
+    if total_frames == 0:
+        raise ValueError(f"録音が短すぎます ({num_samples} サンプル < frame_length {frame_length})")
+
+    os.makedirs(directory, exist_ok=True)
+    output_path = os.path.join(directory, "level0.npy")
+    output = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.dtype(dtype),
+                                       shape=(total_frames, stft.num_bins))
+    del output  # ヘッダとファイルの大きさを確定させてから子プロセスで開く
+
+    frames_per_segment = max(1, int(segment_seconds * rate) // stft.hop)
+    tasks = [(wav_path, output_path, start, min(start + frames_per_segment, total_frames), engine_options)
+             for start in range(0, total_frames, frames_per_segment)]
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(_segment_worker, tasks):
+            pass
+    stft_seconds = time.perf_counter() - started
+
+    levels = build_pyramid(directory, max_rows)
+    metadata = {
+        "source": os.path.abspath(wav_path),
+        "sample_rate": rate,
+        "frame_length": frame_length,
+        "hop": stft.hop,
+        "nfft": stft.nfft,
+        "window": window,
+        "output": "db",
+        "dtype": np.dtype(dtype).name,
+        "duration": num_samples / rate,
+        "frame_seconds": stft.hop / rate,
+        "frequencies": stft.frequencies.tolist(),
+        "levels": levels,
+        "stft_seconds": stft_seconds,
+    }
+    with open(os.path.join(directory, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    return metadata
+
+
+def load_spectrogram(directory: str, level: int = 0) -> Tuple[np.ndarray, Dict]:
+    """
+    保存したスペクトログラムの1つのレベルを読み取り専用のメモリマップで開く
+
+    Returns:
+        (spectrogram, metadata): spectrogram は (行数, ビン数)。
+        行 i の時刻は i * frames_per_row * frame_seconds 秒
+    """
+    with open(os.path.join(directory, METADATA_FILE), encoding="utf-8") as f:
+        metadata = json.load(f)
+    info = metadata["levels"][level]
+    return np.load(os.path.join(directory, info["file"]), mmap_mode="r"), metadata
+
+
+def choose_level(metadata: Dict, seconds: float, rows: int) -> int:
+    """seconds 秒の範囲を rows 行以下で表示できる最も細かいレベルを選ぶ"""
+    frames = seconds / metadata["frame_seconds"]
+    for index, info in enumerate(metadata["levels"]):
+        if frames / info["frames_per_row"] <= rows:
+            return index
+    return len(metadata["levels"]) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="長時間録音のスペクトログラムを .npy に書き出す")
+    parser.add_argument("wav", help="入力のWAVファイル")
+    parser.add_argument("--output", required=True, help="出力ディレクトリ")
+    parser.add_argument("--frame-length", type=int, default=2048, help="1フレームのサンプル数")
+    parser.add_argument("--hop", type=int, default=512, help="フレームの移動量 (サンプル)")
+    parser.add_argument("--nfft", type=int, default=None, help="FFTのポイント数 (ゼロ詰め)")
+    parser.add_argument("--band", type=float, nargs=2, default=None, metavar=("LOW", "HIGH"),
+                        help="保存する周波数帯域 (Hz)")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16", help="保存する型")
+    parser.add_argument("--segment-seconds", type=float, default=60.0, help="1タスクあたりの長さ (秒)")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数 (既定: CPU数)")
+    parser.add_argument("--max-rows", type=int, default=2048, help="ピラミッドの最上位レベルの最大行数")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    metadata = compute_spectrogram(args.wav, args.output, args.frame_length, args.hop, args.nfft,
+                                   band=tuple(args.band) if args.band else None, dtype=args.dtype,
+                                   segment_seconds=args.segment_seconds, workers=args.workers,
+                                   max_rows=args.max_rows)
+    elapsed = time.perf_counter() - started
+    print(f"{metadata['duration']:.1f} 秒の音声を {metadata['levels'][0]['frames']} フレーム x "
+          f"{len(metadata['frequencies'])} ビンに変換しました ({elapsed:.2f} 秒、うちSTFT {metadata['stft_seconds']:.2f} 秒)")
+    for info in metadata["levels"]:
+        print(f"  {info['file']}: {info['frames']} 行 (1行 = {info['frames_per_row'] * metadata['frame_seconds']:.3f} 秒)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,144 @@
-import pyaudio
+import argparse
+import time
+
 import numpy as np
-import pyqtgraph as pg
-from PyQt5 import QtWidgets, QtCore
+
+# pyaudio / pyqtgraph / PyQt5 はマイク入力の表示 (AudioStreamVisualizer) でだけ読み込む。
+# --file の復号 (decode_recording) は numpy と scipy だけで動く
+from audio_capture import open_capture
+from spectrogram_history import SpectrogramHistory
+from stft_engine import STFTEngine
+
+# ピッチと文字の対応 (MIN〜MAX Hz を CODE の文字数で等分する)
+CODE_MIN_FREQ = 2000
+CODE_MAX_FREQ = 7900
+CODE = 'abcdefghijklmnopqrstuvwxyz1234567890'
+VARIANCE_LIMIT = 4  # log10(分散) がこれ未満なら1つの音とみなす
+
+
+def decide_frames(fft_frames, frequencies, variance_scale=1.0):
+    """
+    (フレーム数, ビン数) のスペクトル (dB) から、全フレームの文字をまとめて判定する
+
+    AudioStreamVisualizer.process_spectrum の 正規化 → 0.5未満を0 → ピッチ → 分散 → 文字 を配列演算で行う。
+    variance_scale は分散に掛ける係数 (ズームでビンの間隔が変わっても VARIANCE_LIMIT をそのまま使うため)。
+
+    Returns:
+        (codes, pitches, variances, valid): codes はフレームごとの文字 (範囲外は '')、
+        valid は分散の条件と周波数範囲を満たすかどうか
+    """
+    # 正規化 (負の値を0にしてフレームごとの最大値で割る) し、0.5未満を0にする
+    spectra = np.maximum(fft_frames, 0)
+    peak = spectra.max(axis=1, keepdims=True)
+    spectra = np.divide(spectra, peak, out=np.zeros_like(spectra), where=peak != 0)
+    spectra[spectra < 0.5] = 0
+
+    pitches = frequencies[np.argmax(spectra, axis=1)]
+
+    # sum((f - p)^2 * s) = sum(f^2 s) - 2p sum(f s) + p^2 sum(s) として行列積で計算する
+    frequencies = frequencies.astype(np.float64)
+    weighted = spectra @ (frequencies ** 2) - 2 * pitches * (spectra @ frequencies) + pitches ** 2 * spectra.sum(axis=1)
+    weighted = np.maximum(weighted, 0) * variance_scale
+    variances = np.zeros(len(weighted))
+    nonzero = weighted > 0
+    variances[nonzero] = np.log10(weighted[nonzero])
+
+    in_range = (CODE_MIN_FREQ <= pitches) & (pitches < CODE_MAX_FREQ)
+    indices = np.where(in_range, (pitches - CODE_MIN_FREQ) // ((CODE_MAX_FREQ - CODE_MIN_FREQ) / len(CODE)), 0).astype(int)
+    codes = np.where(in_range, np.array(list(CODE))[np.clip(indices, 0, len(CODE) - 1)], '')
+    valid = (0 < np.abs(variances)) & (np.abs(variances) < VARIANCE_LIMIT) & in_range
+    return codes, pitches, variances, valid
+
+
+def create_stft(chunk, rate, hop=None, zoom_bins=None):
+    """
+    文字の判定に使うSTFTと分散の係数を作る
+
+    zoom_bins を指定すると、CODE_MIN_FREQ〜CODE_MAX_FREQ だけをチャープZ変換で zoom_bins 点計算する。
+    分散 sum((f - pitch)^2 * s) はビンの数に比例するので、通常のFFTのビン間隔 (rate / chunk) に合わせる係数を返す。
+
+    Returns:
+        (stft, variance_scale)
+    """
+    if zoom_bins is None:
+        return STFTEngine(chunk, rate, hop=hop, window=None), 1.0
+    stft = STFTEngine(chunk, rate, hop=hop, window=None, band=(CODE_MIN_FREQ, CODE_MAX_FREQ), zoom_bins=zoom_bins)
+    variance_scale = (stft.frequencies[1] - stft.frequencies[0]) / (rate / chunk)
+    return stft, variance_scale
+
+
+def decode_recording(samples, rate=16000, chunk=1600, hop=None, block_seconds=600, zoom_bins=None):
+    """
+    録音全体を文字列に復号する (マイク入力時と同じ判定と previous_code の重複除去)
+
+    Args:
+        samples: int16 のモノラル音声
+        block_seconds: 一度にSTFTする長さ (メモリ使用量の上限)
+        zoom_bins: 文字の周波数範囲だけを何点で計算するか (None は通常のFFT)
+
+    Returns:
+        dict: text (復号結果), events [(フレーム番号, 時刻[秒], 文字)], frames (総フレーム数)
+    """
+    stft, variance_scale = create_stft(chunk, rate, hop, zoom_bins)
+    block_frames = max(1, int(block_seconds * rate) // stft.hop)
+
+    events = []
+    previous_code = ''
+    frame_offset = 0
+    while True:
+        start = frame_offset * stft.hop
+        block = samples[start:start + (block_frames - 1) * stft.hop + chunk]
+        fft_frames = stft.batch(block)
+        if len(fft_frames) == 0:
+            break
+        codes, _, _, valid = decide_frames(fft_frames, stft.frequencies, variance_scale)
+
+        # 有効なフレームのうち、直前の有効フレームと文字が変わったところだけを出力する
+        candidate_frames = np.flatnonzero(valid)
+        candidate_codes = codes[candidate_frames]
+        changed = np.ones(len(candidate_codes), dtype=bool)
+        if len(candidate_codes) > 0:
+            changed[0] = candidate_codes[0] != previous_code
+            changed[1:] = candidate_codes[1:] != candidate_codes[:-1]
+            previous_code = candidate_codes[-1]
+        for frame, code in zip(candidate_frames[changed], candidate_codes[changed]):
+            frame += frame_offset
+            events.append((int(frame), frame * stft.hop / rate, str(code)))
+
+        frame_offset += len(fft_frames)
+
+    return {"text": "".join(code for _, _, code in events), "events": events, "frames": frame_offset}
+
+
+def read_recording(path):
+    """WAVファイルを int16 のモノラル音声として読み込む"""
+    from scipy.io import wavfile
+
+    rate, data = wavfile.read(path)
+    if data.ndim > 1:
+        data = data[:, 0]
+    if data.dtype.kind == 'f':
+        data = np.clip(data * 32767, -32768, 32767).astype(np.int16)
+    elif data.dtype != np.int16:
+        # int32 などは上位16ビットに合わせる
+        data = (data >> (8 * data.dtype.itemsize - 16)).astype(np.int16)
+    return rate, data
 
 class AudioStreamVisualizer:
     """リアルタイムで音声データのスペクトログラムをグラフィカルに表示するクラスです。"""
 
-    def __init__(self, chunk=1600, format=pyaudio.paInt16, channels=1, rate=16000, history_length=100):
+    def __init__(self, chunk=1600, format=None, channels=1, rate=16000, history_length=100, hop=None, display_rows=None, zoom_bins=None):
         self.MAX_FREQ = 1000  # 最大周波数を2000Hzに設定
         self.CHUNK = chunk
-        self.FORMAT = format
+        self.HOP = hop or chunk  # chunkより小さくするとフレームが重なる
+        self.FORMAT = format  # 未使用 (録音は audio_capture が int16 で行う)
         self.CHANNELS = channels
         self.RATE = rate
         self.HISTORY_LENGTH = history_length
+        self.DISPLAY_ROWS = display_rows  # 履歴が長い場合に描画する最大行数 (None は全行)
+        self.ZOOM_BINS = zoom_bins  # 指定すると CODE_MIN_FREQ〜CODE_MAX_FREQ だけを細かく計算する
+        self.stft, self.variance_scale = create_stft(self.CHUNK, self.RATE, self.HOP, self.ZOOM_BINS)
+        self.frequencies = self.stft.frequencies  # 周波数の配列 [0, RATE/CHUNK, ..., RATE/2] (ズーム時は帯域内)
         self.init_audio_stream()
         self.setup_gui()
         self.setup_timer()
@@ -20,25 +146,26 @@ class AudioStreamVisualizer:
 
     def init_audio_stream(self):
         """オーディオストリームを初期化します。"""
-        self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(
-            format=self.FORMAT,
-            channels=self.CHANNELS,
-            rate=self.RATE,
-            input=True,
-            frames_per_buffer=self.CHUNK
-        )
+        # 録音はPortAudioのスレッドで行い、GUIスレッドはキューから取り出すだけにする
+        # (環境変数 SESSION_RECORD / SESSION_REPLAY でセッションの録音・再生に切り替わる)
+        self.capture = open_capture(self.RATE, self.CHANNELS, frames_per_buffer=self.HOP)
 
     def setup_gui(self):
         """グラフィカルユーザーインターフェースをセットアップ"""
+        import pyqtgraph as pg
+        from PyQt5 import QtWidgets
         self.app = QtWidgets.QApplication([])
         self.win = pg.GraphicsLayoutWidget(title="リアルタイムスペクトログラム")
         self.plot_spectrogram = self.win.addPlot(title="リアルタイムスペクトログラム")
         self.spectrogram = pg.ImageItem()
         self.plot_spectrogram.addItem(self.spectrogram)
-        self.spectrogram_data = np.zeros((self.HISTORY_LENGTH, self.CHUNK // 2 + 1))
-        self.spectrogram.setImage(self.spectrogram_data)
-        self.spectrogram.setRect(pg.QtCore.QRectF(0, 0, self.HISTORY_LENGTH, self.MAX_FREQ))
+        self.history = SpectrogramHistory(self.HISTORY_LENGTH, self.stft.num_bins)
+        self.spectrogram.setImage(self.history.view(self.DISPLAY_ROWS))
+        if self.ZOOM_BINS is None:
+            self.spectrogram.setRect(pg.QtCore.QRectF(0, 0, self.HISTORY_LENGTH, self.MAX_FREQ))
+        else:
+            # ズーム時は縦軸を実際の周波数に合わせる
+            self.spectrogram.setRect(pg.QtCore.QRectF(0, CODE_MIN_FREQ, self.HISTORY_LENGTH, CODE_MAX_FREQ - CODE_MIN_FREQ))
         self.plot_spectrogram.setLabel('left', 'Frequency (Hz)')
         self.plot_spectrogram.setLabel('bottom', 'Time (Samples)')
 
@@ -46,6 +173,7 @@ class AudioStreamVisualizer:
 
     def setup_timer(self):
         """タイマーを設定して定期的にデータを更新"""
+        from PyQt5 import QtCore
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.update)
         self.timer.start(50)
@@ -53,53 +181,54 @@ class AudioStreamVisualizer:
     def update(self):
         """ストリームからデータを読み込み、スペクトログラムを更新"""
         try:
-            data = self.stream.read(self.CHUNK, exception_on_overflow=False)
-            fft_data = self.compute_fft(data)
-
-            # # 2000Hz以上の周波数成分をカット
-            # fft_data = self.low_pass_filter(fft_data, 2000)
-
-            # 30未満の値を0に変換（ノイズ除去）
-            # fft_data = np.where(fft_data < 10, 0, fft_data)
-
-            # 正規化 (0-1の範囲に収める)
-            fft_data = self.normalize(fft_data)
-            
-            # 0.8未満の値を0に変換
-            fft_data = np.where(fft_data < 0.5, 0, fft_data)
-
-            self.update_spectrogram(fft_data)
-
-            pitch = self.detect_pitch(fft_data)
-
-            code = self.detect_code_from_pitch(pitch)
-            
-            # pitchとの分散を計算
-            variance = self.compute_variance(fft_data,pitch)
-            # print(code, end='', flush=True)
-            if 0 < np.abs(variance) < 4 and code != '' and code != self.previous_code:
-                print(code, end='', flush=True)
-                self.previous_code = code
-            else: 
-                print('^', end='', flush=True)
-            # print(f"{variance:.2f}", end='|', flush=True)
+            self.report_drops()
+            samples = self.capture.drain()
+            if len(samples) == 0:
+                return
+            for fft_data in self.stft.push(samples):
+                self.process_spectrum(fft_data)
+            self.draw_spectrogram()
         except Exception as e:
             print(f"エラーが発生しました: {str(e)}")
 
+    def process_spectrum(self, fft_data):
+        """1フレーム分のスペクトルから文字を検出し、スペクトログラムを更新"""
+        # # 2000Hz以上の周波数成分をカット
+        # fft_data = self.low_pass_filter(fft_data, 2000)
+
+        # 30未満の値を0に変換（ノイズ除去）
+        # fft_data = np.where(fft_data < 10, 0, fft_data)
+
+        # 正規化 (0-1の範囲に収める)
+        fft_data = self.normalize(fft_data)
+        
+        # 0.8未満の値を0に変換
+        fft_data = np.where(fft_data < 0.5, 0, fft_data)
+
+        self.update_spectrogram(fft_data)
+
+        pitch = self.detect_pitch(fft_data)
+
+        code = self.detect_code_from_pitch(pitch)
+        
+        # pitchとの分散を計算
+        variance = self.compute_variance(fft_data,pitch)
+        # print(code, end='', flush=True)
+        if 0 < np.abs(variance) < VARIANCE_LIMIT and code != '' and code != self.previous_code:
+            print(code, end='', flush=True)
+            self.previous_code = code
+        else: 
+            print('^', end='', flush=True)
+        # print(f"{variance:.2f}", end='|', flush=True)
+
     def compute_fft(self, data):
-        """FFTを計算して正規化"""
-        numpydata = np.frombuffer(data, dtype=np.int16)
-        fft_data = np.fft.rfft(numpydata)
-        fft_magnitude = np.abs(fft_data) / self.CHUNK
-        fft_magnitude = 20 * np.log10(fft_magnitude + 1e-10)
-        return fft_magnitude
+        """FFTを計算して正規化 (1フレーム分)"""
+        return self.stft.spectrum(np.frombuffer(data, dtype=np.int16))
     
     # 分散を計算
     def compute_variance(self, fft_data,pitch):
-        # 周波数の配列 [0,]
-        frequencies = np.arange(0, self.RATE//2+1, self.RATE/self.CHUNK)
         # 分散を計算
-        variance = np.sum((frequencies - pitch)**2 * fft_data)
+        variance = np.sum((self.frequencies - pitch)**2 * fft_data) * self.variance_scale
         if variance == 0:
             return 0
         return np.log10(variance)
@@ -107,8 +236,7 @@ class AudioStreamVisualizer:
     
     # 平均周波数を計算
     def compute_mean(self, fft_data):
-        # 周波数の配列 [0,]
-        frequencies = np.arange(0, self.RATE//2+1, self.RATE/self.CHUNK)
+        frequencies = self.frequencies
 
         # fft_dataのマイナス値を0に変換
         fft_data = np.where(fft_data < 0, 0, fft_data)
@@ -133,14 +261,13 @@ class AudioStreamVisualizer:
     def detect_pitch(self, fft_data):
         """FFTデータからピッチを検出"""
         index = np.argmax(fft_data)
-        frequency = index * self.RATE / self.CHUNK
+        frequency = self.frequencies[index]
         return frequency
     
     def detect_code_from_pitch(self,frequency):
-        """周波数から文字を検出します（周波数の範囲は2000Hzから4000Hz未満とします）。"""
-        MIN = 2000
-        MAX = 7900
-        CODE = 'abcdefghijklmnopqrstuvwxyz1234567890'
+        """周波数から文字を検出します（周波数の範囲は2000Hzから7900Hz未満とします）。"""
+        MIN = CODE_MIN_FREQ
+        MAX = CODE_MAX_FREQ
         if MIN <= frequency < MAX:
             index = (frequency - MIN) // ((MAX-MIN)/len(CODE)) # インデックスを計算
             return CODE[int(index)]  # 対応する文字を返す
@@ -154,10 +281,17 @@ class AudioStreamVisualizer:
         return fft_data
     
     def update_spectrogram(self, fft_data):
-        """スペクトログラムデータを更新"""
-        self.spectrogram_data = np.roll(self.spectrogram_data, 1, axis=0)
-        self.spectrogram_data[0, :] = fft_data
-        self.spectrogram.setImage(self.spectrogram_data, autoLevels=False, levels=(0, 1))
+        """スペクトログラムデータを更新 (履歴に1行書き込むだけで、描画は draw_spectrogram で行う)"""
+        self.history.append(fft_data)
+
+    def draw_spectrogram(self):
+        """履歴をコピーせずに画像として表示"""
+        self.spectrogram.setImage(self.history.view(self.DISPLAY_ROWS), autoLevels=False, levels=(0, 1))
+
+    def report_drops(self):
+        """取りこぼしが増えたらウィンドウのタイトルに表示"""
+        if self.capture.drops_changed():
+            self.win.setWindowTitle(f"リアルタイムスペクトログラム ({self.capture.status_text()})")
 
     def start(self):
         """イベントループを開始"""
@@ -165,12 +299,27 @@ class AudioStreamVisualizer:
 
     def close(self):
         """ストリームとPyAudioをクリーンアップ"""
-        self.stream.stop_stream()
-        self.stream.close()
+        self.capture.close()
 
 if __name__ == '__main__':
-    visualizer = AudioStreamVisualizer()
-    try:
-        visualizer.start()
-    finally:
-        visualizer.close()
+    parser = argparse.ArgumentParser(description="ピッチから文字を検出する (引数なしでマイク入力)")
+    parser.add_argument("--file", help="録音済みのWAVファイルをまとめて復号する")
+    parser.add_argument("--hop", type=int, default=None, help="フレームの移動量 (サンプル)")
+    parser.add_argument("--zoom-bins", type=int, default=None,
+                        help=f"{CODE_MIN_FREQ}〜{CODE_MAX_FREQ}Hz だけをチャープZ変換でこの点数計算する")
+    args = parser.parse_args()
+
+    if args.file:
+        rate, samples = read_recording(args.file)
+        chunk = int(round(1600 * rate / 16000))  # マイク入力時と同じ 0.1 秒のフレーム
+        start = time.perf_counter()
+        result = decode_recording(samples, rate=rate, chunk=chunk, hop=args.hop, zoom_bins=args.zoom_bins)
+        elapsed = time.perf_counter() - start
+        print(result["text"])
+        print(f"{len(samples) / rate:.1f} 秒の音声 ({result['frames']} フレーム) を {elapsed:.2f} 秒で復号しました")
+    else:
+        visualizer = AudioStreamVisualizer(hop=args.hop, zoom_bins=args.zoom_bins)
+        try:
+            visualizer.start()
+        finally:
+            visualizer.close()
@@ -1,40 +1,54 @@
+import os
+import sys
+
 import pyaudio
 import numpy as np
 import pyqtgraph as pg
 from PyQt5 import QtWidgets, QtCore
 from scipy.signal import find_peaks
 
+# 親ディレクトリの stft_engine.py をインポートできるようにする
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_capture import open_capture
+from spectrogram_history import SpectrogramHistory
+from pair_codec import FREQUENCY, decode_codes, pair_to_char
+from stft_engine import STFTEngine
+from tone_bank import ToneBank
+
 class AudioStreamVisualizer:
     """リアルタイムで音声データのスペクトログラムをグラフィカルに表示し、指定された周波数を検出します。"""
 
-    def __init__(self, chunk=2048, format=pyaudio.paInt16, channels=1, rate=16000, history_length=100, isDebug=False):
+    def __init__(self, chunk=2048, format=pyaudio.paInt16, channels=1, rate=16000, history_length=100, isDebug=False, hop=None, display_rows=None, mode="fft"):
         self.isDebug = isDebug
+        self.MODE = mode  # "fft": FFT + ピーク検出, "tone_bank": 16音だけを評価するトーンバンク
         self.CHUNK = chunk
+        # chunkより小さくするとフレームが重なり、短い音も拾いやすくなる (トーンバンクは既定で256サンプルごとに判定)
+        self.HOP = hop or (256 if mode == "tone_bank" else chunk)
         self.FORMAT = format
         self.CHANNELS = channels
         self.RATE = rate
         self.HISTORY_LENGTH = history_length
+        self.DISPLAY_ROWS = display_rows  # 履歴が長い場合に描画する最大行数 (None は全行)
         self.NFFT = 4096  # FFTのポイント数を増やして周波数分解能を高める
-        self.FREQUENCY = [
-            523.25, 587.33, 659.25, 698.46, 783.99, 880.00, 987.77, 1046.50,
-            1174.66, 1318.51, 1396.91, 1567.98, 1760.00, 1975.53, 2093.00, 2349.32
-        ]
+        self.FREQUENCY = FREQUENCY
         self.frequency_tolerance = 5  # 許容誤差を5Hzに設定
-        self.frequencies = np.fft.rfftfreq(self.NFFT, 1.0 / self.RATE)
+        self.peak_height = 10  # ピークとみなすレベル (dB)
+        if self.MODE == "tone_bank":
+            self.tone_bank = ToneBank(self.FREQUENCY, self.RATE, frame_length=self.CHUNK, hop=self.HOP)
+            self.previous_char = None
+        else:
+            self.stft = STFTEngine(self.CHUNK, self.RATE, nfft=self.NFFT, hop=self.HOP, window="hann")
+            self.frequencies = self.stft.frequencies
         self.init_audio_stream()
         self.setup_gui()
         self.setup_timer()
 
     def init_audio_stream(self):
         """オーディオストリームを初期化します。"""
-        self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(
-            format=self.FORMAT,
-            channels=self.CHANNELS,
-            rate=self.RATE,
-            input=True,
-            frames_per_buffer=self.CHUNK
-        )
+        # 録音はPortAudioのスレッドで行い、GUIスレッドはキューから取り出すだけにする
+        # (環境変数 SESSION_RECORD / SESSION_REPLAY でセッションの録音・再生に切り替わる)
+        self.capture = open_capture(self.RATE, self.CHANNELS, frames_per_buffer=self.HOP)
 
     def setup_gui(self):
         """グラフィカルユーザーインターフェースをセットアップ"""
@@ -43,13 +57,23 @@ class AudioStreamVisualizer:
         self.plot_spectrogram = self.win.addPlot(title="リアルタイムスペクトログラム")
         self.spectrogram = pg.ImageItem()
         self.plot_spectrogram.addItem(self.spectrogram)
-        self.spectrogram_data = np.zeros((self.HISTORY_LENGTH, self.NFFT // 2 + 1))
-        self.spectrogram.setImage(self.spectrogram_data)
-        self.spectrogram.setRect(pg.QtCore.QRectF(0, 0, self.HISTORY_LENGTH, self.RATE / 2))
-        self.plot_spectrogram.setLabel('left', 'Frequency (Hz)')
+        if self.MODE == "tone_bank":
+            # トーンバンクでは16音のレベルだけを表示する (縦軸は音の番号)
+            num_tones = self.tone_bank.num_tones
+            self.history = SpectrogramHistory(self.HISTORY_LENGTH, num_tones)
+            self.spectrogram.setImage(self.history.view(self.DISPLAY_ROWS))
+            self.spectrogram.setRect(pg.QtCore.QRectF(0, 0, self.HISTORY_LENGTH, num_tones))
+            self.plot_spectrogram.setLabel('left', 'Tone index')
+            self.plot_spectrogram.setLimits(yMin=0, yMax=num_tones)
+            self.plot_spectrogram.setRange(yRange=[0, num_tones])
+        else:
+            self.history = SpectrogramHistory(self.HISTORY_LENGTH, self.stft.num_bins)
+            self.spectrogram.setImage(self.history.view(self.DISPLAY_ROWS))
+            self.spectrogram.setRect(pg.QtCore.QRectF(0, 0, self.HISTORY_LENGTH, self.RATE / 2))
+            self.plot_spectrogram.setLabel('left', 'Frequency (Hz)')
+            self.plot_spectrogram.setLimits(yMin=0, yMax=self.RATE / 2)
+            self.plot_spectrogram.setRange(yRange=[0, self.RATE / 2])
         self.plot_spectrogram.setLabel('bottom', 'Time (Frames)')
-        self.plot_spectrogram.setLimits(yMin=0, yMax=self.RATE / 2)
-        self.plot_spectrogram.setRange(yRange=[0, self.RATE / 2])
         self.win.show()
 
     def setup_timer(self):
@@ -59,16 +83,8 @@ class AudioStreamVisualizer:
         self.timer.start(50)
 
     def compute_fft(self, data):
-        """FFTを計算して正規化"""
-        numpydata = np.frombuffer(data, dtype=np.int16)
-        window = np.hanning(len(numpydata))
-        windowed_data = numpydata * window
-        padded_data = np.zeros(self.NFFT)
-        padded_data[:len(windowed_data)] = windowed_data
-        fft_data = np.fft.rfft(padded_data)
-        fft_magnitude = np.abs(fft_data) / len(numpydata)
-        fft_magnitude = 20 * np.log10(fft_magnitude + 1e-10)
-        return fft_magnitude
+        """FFTを計算して正規化 (1フレーム分)"""
+        return self.stft.spectrum(np.frombuffer(data, dtype=np.int16))
 
     def parabolic(self, f, x):
         """ピークの位置をパラボリック補間で精密化"""
@@ -79,54 +95,87 @@ class AudioStreamVisualizer:
         return (xv, yv)
     
     def index_to_char(self, A, B):
-        C = 15 * A - (A * (A - 1)) // 2 + B
-        return chr(C)
+        return pair_to_char(A, B)
 
 
     def update(self):
         """ストリームからデータを読み込み、スペクトログラムとピークを更新"""
         try:
-            data = self.stream.read(self.CHUNK, exception_on_overflow=False)
-            fft_data = self.compute_fft(data)
-            # ピークを検出
-            peaks, _ = find_peaks(fft_data, height=10)
-            # エッジのピークを除外
-            peaks = peaks[(peaks > 0) & (peaks < len(fft_data) - 1)]
-            if len(peaks) > 0:
-                true_peaks = []
-                for peak in peaks:
-                    interpolated_peak, _ = self.parabolic(fft_data, peak)
-                    frequency = interpolated_peak * self.RATE / self.NFFT
-                    true_peaks.append(frequency)
-                # 検出された周波数を指定された周波数にマッピング
-                detected_frequencies = []
-                for freq in true_peaks:
-                    closest_freq = min(self.FREQUENCY, key=lambda x: abs(x - freq))
-                    if abs(closest_freq - freq) <= self.frequency_tolerance:
-                        detected_frequencies.append(closest_freq)
-                detected_frequencies = list(set(detected_frequencies))  # 重複を削除
-                if 0 < len(detected_frequencies) <= 2:
-                    A = self.FREQUENCY.index(detected_frequencies[0])
-                    B = A if len(detected_frequencies) == 1 else self.FREQUENCY.index(detected_frequencies[1])
-                    A, B = min(A, B), max(A, B)
-                    char = self.index_to_char(A, B)
-                    print(char)
-
-                    if self.isDebug:
-                        print()
-                        print(f"{detected_frequencies} Hz")
-                        print(f"A: {A}, B: {B}")
-
-
-            self.update_spectrogram(fft_data)
+            self.report_drops()
+            samples = self.capture.drain()
+            if len(samples) == 0:
+                return
+            if self.MODE == "tone_bank":
+                self.process_tone_levels(self.tone_bank.push(samples))
+            else:
+                for fft_data in self.stft.push(samples):
+                    self.process_spectrum(fft_data)
+            self.draw_spectrogram()
         except Exception as e:
             print(e)
 
+    def process_spectrum(self, fft_data):
+        """1フレーム分のスペクトルからピークを検出して文字に変換し、スペクトログラムを更新"""
+        # ピークを検出
+        peaks, _ = find_peaks(fft_data, height=self.peak_height)
+        # エッジのピークを除外
+        peaks = peaks[(peaks > 0) & (peaks < len(fft_data) - 1)]
+        if len(peaks) > 0:
+            true_peaks = []
+            for peak in peaks:
+                interpolated_peak, _ = self.parabolic(fft_data, peak)
+                frequency = interpolated_peak * self.RATE / self.NFFT
+                true_peaks.append(frequency)
+            # 検出された周波数を指定された周波数にマッピング
+            detected_frequencies = []
+            for freq in true_peaks:
+                closest_freq = min(self.FREQUENCY, key=lambda x: abs(x - freq))
+                if abs(closest_freq - freq) <= self.frequency_tolerance:
+                    detected_frequencies.append(closest_freq)
+            detected_frequencies = list(set(detected_frequencies))  # 重複を削除
+            if 0 < len(detected_frequencies) <= 2:
+                A = self.FREQUENCY.index(detected_frequencies[0])
+                B = A if len(detected_frequencies) == 1 else self.FREQUENCY.index(detected_frequencies[1])
+                A, B = min(A, B), max(A, B)
+                char = self.index_to_char(A, B)
+                print(char)
+
+                if self.isDebug:
+                    print()
+                    print(f"{detected_frequencies} Hz")
+                    print(f"A: {A}, B: {B}")
+
+
+        self.update_spectrogram(fft_data)
+
+    def process_tone_levels(self, levels):
+        """トーンバンクの判定結果 (フレーム数 x 16音) から文字を検出し、履歴を更新"""
+        A, B, valid = self.tone_bank.decide(levels, self.peak_height)
+        codes = decode_codes(A, B, valid)  # 全フレームをまとめて文字コードに変換 (無効は -1)
+        for i in range(len(levels)):
+            # hop ごとに判定するので、同じ組み合わせが続く間は1回だけ表示する
+            char = chr(codes[i]) if codes[i] >= 0 else None
+            if char is not None and char != self.previous_char:
+                print(char)
+                if self.isDebug:
+                    print()
+                    print(f"{[self.FREQUENCY[A[i]], self.FREQUENCY[B[i]]]} Hz")
+                    print(f"A: {A[i]}, B: {B[i]}")
+            self.previous_char = char
+            self.update_spectrogram(levels[i])
+
     def update_spectrogram(self, fft_data):
-        """スペクトログラムデータを更新"""
-        self.spectrogram_data = np.roll(self.spectrogram_data, 1, axis=0)
-        self.spectrogram_data[0, :] = fft_data
-        self.spectrogram.setImage(self.spectrogram_data, autoLevels=False, levels=(10, 40))
+        """スペクトログラムデータを更新 (履歴に1行書き込むだけで、描画は draw_spectrogram で行う)"""
+        self.history.append(fft_data)
+
+    def draw_spectrogram(self):
+        """履歴をコピーせずに画像として表示"""
+        self.spectrogram.setImage(self.history.view(self.DISPLAY_ROWS), autoLevels=False, levels=(10, 40))
+
+    def report_drops(self):
+        """取りこぼしが増えたらウィンドウのタイトルに表示"""
+        if self.capture.drops_changed():
+            self.win.setWindowTitle(f"リアルタイムスペクトログラム ({self.capture.status_text()})")
 
     def start(self):
         """イベントループを開始"""
@@ -134,18 +183,18 @@ class AudioStreamVisualizer:
 
     def close(self):
         """ストリームとPyAudioをクリーンアップ"""
-        self.stream.stop_stream()
-        self.stream.close()
-        self.p.terminate()
+        self.capture.close()
 
 if __name__ == '__main__':
     isDebug = input("DEBUG:1, press enter: ")
+    useToneBank = input("TONE BANK:1, press enter: ")
+    mode = "tone_bank" if useToneBank.strip() == "1" else "fft"
     if isDebug.strip() == "1":  # 入力の前後の空白を削除
         print("DEBUG MODE")
-        visualizer = AudioStreamVisualizer(isDebug=True)
+        visualizer = AudioStreamVisualizer(isDebug=True, mode=mode)
     else:
         print("NORMAL MODE")
-        visualizer = AudioStreamVisualizer()
+        visualizer = AudioStreamVisualizer(mode=mode)
     try:
         visualizer.start()
     finally:
@@ -0,0 +1,127 @@
+"""
+文字 ⇔ 2音の組み合わせ (A, B) の変換表
+
+16音から重複ありで2音を選ぶ組み合わせ (A <= B) は136通りあり、文字コード C (0〜135) と1対1に対応する。
+
+    C = 15 * A - A * (A - 1) / 2 + B
+      = S_A + (B - A)   (S_A = 16 * A - A * (A - 1) / 2 は A で始まる組み合わせの先頭の番号)
+
+tone.py / tone_sine.py / sine.py (送信) と code_detector.py (受信) はこのモジュールの表を引くだけにして、
+キー入力ごとに平方根を計算しないようにする。表は import 時に1度だけ作る。
+
+  - char_to_pair / pair_to_char: 1文字ずつの変換
+  - encode / decode: 文字列全体や検出結果の配列をまとめて変換
+  - render: 文字列全体を1本の音声バッファにする
+"""
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+NUM_TONES = 16
+NUM_CODES = NUM_TONES * (NUM_TONES + 1) // 2  # 136
+
+# Cメジャースケールの16音 (C5からD7まで)
+FREQUENCY = [
+    523.25, 587.33, 659.25, 698.46, 783.99, 880.00, 987.77, 1046.50,  # C5, D5, E5, F5, G5, A5, B5, C6
+    1174.66, 1318.51, 1396.91, 1567.98, 1760.00, 1975.53, 2093.00, 2349.32  # D6, E6, F6, G6, A6, B6, C7, D7
+]
+
+
+def _build_tables() -> Tuple[np.ndarray, np.ndarray]:
+    """文字コード → (A, B) と (A, B) → 文字コード の表を作る"""
+    code_to_pair = np.zeros((NUM_CODES, 2), dtype=np.int8)
+    pair_to_code = np.zeros((NUM_TONES, NUM_TONES), dtype=np.int16)
+    for A in range(NUM_TONES):
+        for B in range(A, NUM_TONES):
+            C = 15 * A - (A * (A - 1)) // 2 + B
+            code_to_pair[C] = (A, B)
+            # 受信側では A と B の順番が分からないので、両方の順番で引けるようにしておく
+            pair_to_code[A, B] = C
+            pair_to_code[B, A] = C
+    return code_to_pair, pair_to_code
+
+
+CODE_TO_PAIR, PAIR_TO_CODE = _build_tables()
+
+
+def char_to_pair(char: str) -> Tuple[int, int]:
+    """1文字を音の番号の組み合わせ (A, B) に変換する"""
+    C = ord(char)
+    if not 0 <= C < NUM_CODES:
+        raise ValueError(f"2音で表せない文字です: {char!r} (文字コード {C})")
+    A, B = CODE_TO_PAIR[C]
+    return int(A), int(B)
+
+
+def pair_to_char(A: int, B: int) -> str:
+    """音の番号の組み合わせ (順不同) を文字に変換する"""
+    return chr(PAIR_TO_CODE[A, B])
+
+
+def encode(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    文字列をまとめて (A の配列, B の配列) に変換する
+
+    Raises:
+        ValueError: 2音で表せない文字 (文字コード136以上) を含む場合
+    """
+    codes = np.fromiter((ord(c) for c in text), dtype=np.int64, count=len(text))
+    if np.any(codes >= NUM_CODES):
+        bad = text[int(np.argmax(codes >= NUM_CODES))]
+        raise ValueError(f"2音で表せない文字です: {bad!r}")
+    pairs = CODE_TO_PAIR[codes]
+    return pairs[:, 0], pairs[:, 1]
+
+
+def decode_codes(A: np.ndarray, B: np.ndarray, valid: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    検出結果の配列 (A, B) をまとめて文字コードの配列に変換する
+
+    Args:
+        valid: 有効な検出かどうか。False の位置は -1 になる
+    """
+    codes = PAIR_TO_CODE[np.asarray(A), np.asarray(B)].astype(np.int16)
+    if valid is not None:
+        codes = np.where(valid, codes, -1)
+    return codes
+
+
+def decode(A: Iterable[int], B: Iterable[int], valid: Optional[Iterable[bool]] = None) -> str:
+    """検出結果の配列 (A, B) を文字列に変換する (無効な検出は飛ばす)"""
+    codes = decode_codes(np.asarray(list(A)), np.asarray(list(B)),
+                         None if valid is None else np.asarray(list(valid)))
+    return "".join(chr(c) for c in codes if c >= 0)
+
+
+def tone_table(frequencies: List[float] = FREQUENCY, duration: float = 0.1,
+               sample_rate: int = 44100, amplitude: float = 0.3, envelope: bool = True) -> np.ndarray:
+    """
+    16音それぞれのサイン波 (16, サンプル数) を作る
+
+    envelope=True では sine.py と同じ三角形のエンベロープをかける (立ち上がりと減衰を滑らかにする)。
+    tone_sine.py はエンベロープをかけずに鳴らすので envelope=False で作る。
+    """
+    t = np.arange(int(sample_rate * duration)) / sample_rate
+    tones = amplitude * np.sin(2 * np.pi * np.outer(frequencies, t))
+    if envelope:
+        ramp = np.linspace(0, 1, len(t))
+        tones *= np.minimum(ramp, np.flip(ramp))
+    return tones.astype(np.float32)
+
+
+def render(text: str, tones: Optional[np.ndarray] = None, gap_samples: int = 0) -> np.ndarray:
+    """
+    文字列全体を1本の音声バッファにする (1文字 = 2音の和音、文字の間に gap_samples の無音)
+
+    Args:
+        tones: tone_table() の結果。None の場合は既定の設定で作る
+    """
+    if tones is None:
+        tones = tone_table()
+    A, B = encode(text)
+    note_samples = tones.shape[1]
+    # 文字ごとの行 (和音 + 無音) を並べてから1本にする
+    buffer = np.zeros((len(text), note_samples + gap_samples), dtype=np.float32)
+    np.add(tones[A], tones[B], out=buffer[:, :note_samples])
+    buffer[:, :note_samples] *= 0.5
+    return buffer.ravel()
@@ -1,14 +1,18 @@
 import numpy as np
-import sounddevice as sd
 
-def play_sine_wave(frequency, duration, amplitude=1.0, sample_rate=44100):
+from tone_mixer import get_mixer
+
+def play_sine_wave(frequency, duration, amplitude=1.0, sample_rate=44100, wait=False):
     """
     サイン波の音を生成して再生する関数
 
+    共有の出力ストリーム (tone_mixer.get_mixer) に積むだけなので、wait=False の場合はすぐに戻る
+
     :param frequency: 周波数（Hz）
     :param duration: 再生時間（秒）
     :param amplitude: 振幅（0.0から1.0の間）
     :param sample_rate: サンプリングレート（Hz）
+    :param wait: 再生が終わるまで待つかどうか
     """
     # 時間配列を生成
     t = np.linspace(0, duration, int(sample_rate * duration), False)
@@ -17,16 +21,21 @@ def play_sine_wave(frequency, duration, amplitude=1.0, sample_rate=44100):
     sine_wave = amplitude * np.sin(2 * np.pi * frequency * t)
 
     # 音を再生
-    sd.play(sine_wave, sample_rate)
-    sd.wait()
-def play_chord(frequencies, duration, amplitude=1.0, sample_rate=44100):
+    mixer = get_mixer(sample_rate)
+    end = mixer.play(sine_wave)
+    if wait:
+        mixer.wait_until(end)
+def play_chord(frequencies, duration, amplitude=1.0, sample_rate=44100, wait=False):
     """
     複数の周波数を同時に再生して和音を作る関数
 
+    共有の出力ストリーム (tone_mixer.get_mixer) に積むだけなので、wait=False の場合はすぐに戻る
+
     :param frequencies: 周波数のリスト（Hz）
     :param duration: 再生時間（秒）
     :param amplitude: 振幅（0.0から1.0の間）
     :param sample_rate: サンプリングレート（Hz）
+    :param wait: 再生が終わるまで待つかどうか
     """
     # 時間配列を生成
     t = np.linspace(0, duration, int(sample_rate * duration), False)
@@ -45,14 +54,16 @@ def play_chord(frequencies, duration, amplitude=1.0, sample_rate=44100):
         chord = chord / max_amplitude
 
     # 音を再生
-    sd.play(chord, sample_rate)
-    sd.wait()
+    mixer = get_mixer(sample_rate)
+    end = mixer.play(chord)
+    if wait:
+        mixer.wait_until(end)
 
 # 使用例
 if __name__ == "__main__":
         # Cメジャーコードを再生（C5, E5, G5）
     c_major = [523.25, 659.25, 783.99]
-    play_sine_wave(c_major[0], 2)  
-    play_sine_wave(c_major[1], 2)
-    play_sine_wave(c_major[2], 2)
-    play_chord(c_major, 2)
+    play_sine_wave(c_major[0], 2, wait=True)
+    play_sine_wave(c_major[1], 2, wait=True)
+    play_sine_wave(c_major[2], 2, wait=True)
+    play_chord(c_major, 2, wait=True)
@@ -3,9 +3,11 @@ import pygame
 from pynput import keyboard
 import time
 import threading
-import math
 import numpy as np
 
+from pair_codec import char_to_pair
+from wavetable import cached_note
+
 # Pygameの初期化
 pygame.init()
 pygame.midi.init()
@@ -27,21 +29,13 @@ NOTE_DURATION = 0.1
 use_instrument = True
 
 def char_to_notes(char):
-    C = ord(char)
-    A = math.floor((33 - math.sqrt(1089 - 8 * C)) / 2)
-    S_A = 16 * A - (A * (A - 1)) // 2
-    B = A + (C - S_A)
-    print(f"C: {C} -> A: {A}, B: {B}")
+    A, B = char_to_pair(char)  # 事前計算した表を引く
+    print(f"C: {ord(char)} -> A: {A}, B: {B}")
     return NOTES[A], NOTES[B]
 
 def generate_sine_wave(frequency, duration, sample_rate=44100, amplitude=0.3):
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    sine_wave = amplitude * np.sin(2 * np.pi * frequency * t)
-    # エンベロープを適用して音の立ち上がりと減衰を滑らかにする
-    envelope = np.linspace(0, 1, len(t))
-    envelope = np.minimum(envelope, np.flip(envelope))
-    sine_wave *= envelope
-    return sine_wave.astype(np.float32)
+    # エンベロープ付きの波形は wavetable.cached_note が1度だけ作って使い回す (書き込み禁止の配列)
+    return cached_note(frequency, duration, sample_rate, amplitude)
 
 def play_sine_wave(frequency):
     sine_wave = generate_sine_wave(frequency, NOTE_DURATION)
@@ -2,7 +2,8 @@ import pygame.midi
 from pynput import keyboard
 import time
 import threading
-import math
+
+from pair_codec import FREQUENCY, char_to_pair
 
 # Pygameの初期化
 pygame.init()
@@ -20,11 +21,7 @@ player.set_instrument(instruments[instrument_index], 0)  # チャンネル0に
 # 各数字はMIDIノート番号と周波数(Hz)を表しています
 NOTES = [60, 62, 64, 65, 67, 69, 71, 72, 74, 76, 77, 79, 81, 83, 84, 86]
 
-# 対応する周波数（Hz）の配列
-FREQUENCY = [
-    523.25, 587.33, 659.25, 698.46, 783.99, 880.00, 987.77, 1046.50,  # C5, D5, E5, F5, G5, A5, B5, C6
-    1174.66, 1318.51, 1396.91, 1567.98, 1760.00, 1975.53, 2093.00, 2349.32  # D6, E6, F6, G6, A6, B6, C7, D7
-]
+# 対応する周波数（Hz）の配列は pair_codec.FREQUENCY (受信側と共通)
 
 # このスケールはCメジャーコードの構成音（C, D, E, F, G, A, B）を2オクターブにわたって並べています
 # 隣接する音の周波数比は約1.12（全音）または約1.06（半音）です
@@ -33,11 +30,8 @@ FREQUENCY = [
 NOTE_DURATION = 0.1
 
 def char_to_index(char):
-    C = ord(char)
-    A = math.floor((33 - math.sqrt(1089 - 8 * C)) / 2)
-    S_A = 16 * A - (A * (A - 1)) // 2
-    B = A + (C - S_A)
-    print(f"C: {C} -> A: {A}, B: {B}")
+    A, B = char_to_pair(char)  # 事前計算した表を引く
+    print(f"C: {ord(char)} -> A: {A}, B: {B}")
     return A, B
 
 
@@ -0,0 +1,85 @@
+"""
+16音の組み合わせ検出用のトーンバンク
+
+code_detector.py の通常モードは 4096点FFT → find_peaks → 放物線補間 → 最も近い音の探索 を
+フレームごとに行うが、実際に必要なのは決まった16個の周波数の強さだけである。
+そこで16個の周波数それぞれについて、ハン窓を掛けた複素正弦波 (参照信号) との内積を取る
+(周波数を1点だけ計算するDFT = Goertzel と同じ値)。
+
+  - 参照信号は (16, frame_length) の行列として最初に1度だけ作る
+  - hop ごとのフレームを sliding_window_view で並べ、全フレーム x 全音を1回の行列積で計算する
+  - レベルは STFTEngine (window="hann") と同じ 20*log10(振幅 / frame_length) なので、しきい値をそのまま使える
+
+使い方:
+    bank = ToneBank(FREQUENCY, sample_rate=16000, frame_length=2048, hop=256)
+    levels = bank.push(samples)            # (フレーム数, 16) のdB値
+    A, B, valid = bank.decide(levels, 10)  # フレームごとの音の組み合わせ
+"""
+from typing import List, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class ToneBank:
+    """決まった周波数だけを評価するフィルタバンク"""
+
+    def __init__(self, frequencies: List[float], sample_rate: int, frame_length: int = 2048, hop: int = 256):
+        """
+        :param frequencies: 検出する周波数のリスト
+        :param sample_rate: サンプリングレート
+        :param frame_length: 1フレームのサンプル数 (周波数分解能は約 2 * sample_rate / frame_length)
+        :param hop: 判定の間隔 (サンプル)
+        """
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self.sample_rate = sample_rate
+        self.frame_length = frame_length
+        self.hop = hop
+        self.num_tones = len(frequencies)
+
+        # ハン窓と正規化 (1 / frame_length) を含めた参照信号
+        n = np.arange(frame_length)
+        window = np.hanning(frame_length)
+        phase = -2j * np.pi * np.outer(self.frequencies, n) / sample_rate
+        self.references = (window * np.exp(phase) / frame_length).astype(np.complex64).T  # (frame_length, 16)
+
+        self.pending = np.zeros(0, dtype=np.float32)
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        """
+        入力を追加し、hop ごとに完成したフレームの各音のレベル (dB) を返す
+
+        Returns:
+            np.ndarray: (フレーム数, num_tones) の float32。フレームが無い場合は (0, num_tones)
+        """
+        self.pending = np.concatenate([self.pending, np.asarray(samples, dtype=np.float32)])
+        if len(self.pending) < self.frame_length:
+            return np.zeros((0, self.num_tones), dtype=np.float32)
+
+        num_frames = (len(self.pending) - self.frame_length) // self.hop + 1
+        frames = sliding_window_view(self.pending, self.frame_length)[::self.hop][:num_frames]
+        amplitudes = np.abs(frames @ self.references)
+        # 次のフレームの先頭から残す
+        self.pending = self.pending[num_frames * self.hop:]
+        return (20 * np.log10(amplitudes + 1e-10)).astype(np.float32)
+
+    @staticmethod
+    def decide(levels: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        フレームごとに、しきい値を超えた音から組み合わせ (A <= B) を求める
+
+        1音だけの場合は A == B、3音以上の場合は無効とする (code_detector.py の通常モードと同じ規則)。
+
+        Returns:
+            (A, B, valid): それぞれ長さ フレーム数 の配列
+        """
+        active = levels >= threshold
+        counts = active.sum(axis=1)
+        A = np.argmax(active, axis=1)
+        B = active.shape[1] - 1 - np.argmax(active[:, ::-1], axis=1)
+        valid = (counts >= 1) & (counts <= 2)
+        return A, B, valid
+
+    def reset(self) -> None:
+        """ためた入力を捨てる"""
+        self.pending = np.zeros(0, dtype=np.float32)
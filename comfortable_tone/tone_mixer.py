@@ -0,0 +1,153 @@
+"""
+常駐する出力ストリームと複数音のミキサー
+
+キー入力ごとに PyAudio を初期化してストリームを開き直したり、sd.wait() で再生が終わるまで待ったりする代わりに、
+起動時に sounddevice のコールバック方式の出力ストリームを1つだけ開いておき、
+再生したい波形を (波形, 開始位置) のイベントとしてキューに積む。
+コールバックは届いたイベントを発音中の音 (ボイス) に加え、全ボイスを足し合わせて出力する。
+
+  - 1音あたりの遅延はデバイスの準備時間ではなく、バッファ1つ分 (blocksize / sample_rate) になる
+  - 速く打鍵してもスレッドは増えない (キューに積むだけ)
+  - 同時に鳴らせる音は max_voices まで。超えた場合は古い音から止める
+
+キューへの追加 (キー入力のスレッド) とコールバック (PortAudio のスレッド) の受け渡しは deque だけで行い、
+コールバック側でロックを取らない。
+
+使い方:
+    mixer = ToneMixer(sample_rate=44100)
+    mixer.start()
+    mixer.play(waveform)          # すぐに (次のバッファから) 鳴らす
+    mixer.play(waveform, start=mixer.position + 4410)  # 0.1秒後のサンプル位置から鳴らす
+    mixer.close()
+"""
+import collections
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class ToneMixer:
+    """コールバック方式の出力ストリームで複数の波形を足し合わせて再生するクラス"""
+
+    def __init__(self, sample_rate: int = 44100, blocksize: int = 256, max_voices: int = 8,
+                 device: Optional[int] = None):
+        """
+        :param sample_rate: サンプリングレート
+        :param blocksize: コールバック1回あたりのフレーム数 (小さいほど遅延が短い)
+        :param max_voices: 同時に鳴らせる音の数
+        :param device: 出力デバイスの番号 (None は既定のデバイス)
+        """
+        self.sample_rate = sample_rate
+        self.blocksize = blocksize
+        self.max_voices = max_voices
+        self.device = device
+
+        self.pending = collections.deque()  # 再生待ちのイベント [波形, 開始位置]
+        self.voices = []  # 発音中のボイス [波形, 読み出し位置, 開始位置] (コールバックだけが触る)
+        self.position = 0  # 次のコールバックで出力する最初のサンプル位置
+        self.stolen_voices = 0
+        self.underflow_count = 0
+        self.stream = None
+
+    def start(self) -> None:
+        """出力ストリームを開いて開始する"""
+        import sounddevice as sd
+
+        self.stream = sd.OutputStream(samplerate=self.sample_rate, channels=1, dtype='float32',
+                                      blocksize=self.blocksize, device=self.device, callback=self._callback)
+        self.stream.start()
+
+    def play(self, waveform: np.ndarray, start: Optional[int] = None) -> int:
+        """
+        波形を再生キューに積む (すぐに戻る)
+
+        Args:
+            waveform: float32 のモノラル波形 (-1〜1)。再生が終わるまで書き換えないこと
+            start: 再生を始めるサンプル位置 (None の場合は次のバッファの先頭)
+
+        Returns:
+            int: 再生が終わるおおよそのサンプル位置 (wait_until に渡せる)
+        """
+        waveform = np.asarray(waveform, dtype=np.float32).reshape(-1)
+        self.pending.append((waveform, start))
+        begin = self.position if start is None else max(start, self.position)
+        return begin + len(waveform)
+
+    def _callback(self, outdata, frames, time_info, status):
+        """PortAudio のスレッドから呼ばれる。キューのイベントを取り込み、全ボイスを足し合わせる"""
+        if status.output_underflow:
+            self.underflow_count += 1
+        block_start = self.position
+        block_end = block_start + frames
+
+        while True:
+            try:
+                waveform, start = self.pending.popleft()
+            except IndexError:
+                break
+            # 開始位置を過ぎたイベントは今のバッファの先頭から鳴らす
+            self.voices.append([waveform, 0, block_start if start is None else max(start, block_start)])
+        if len(self.voices) > self.max_voices:
+            self.stolen_voices += len(self.voices) - self.max_voices
+            del self.voices[:len(self.voices) - self.max_voices]
+
+        out = outdata[:, 0]
+        out.fill(0)
+        remaining = []
+        for voice in self.voices:
+            waveform, read, start = voice
+            if start >= block_end:
+                remaining.append(voice)  # まだ開始位置に達していない
+                continue
+            offset = max(0, start - block_start)
+            count = min(frames - offset, len(waveform) - read)
+            out[offset:offset + count] += waveform[read:read + count]
+            voice[1] = read + count
+            if voice[1] < len(waveform):
+                remaining.append(voice)
+        self.voices = remaining
+        np.clip(out, -1.0, 1.0, out=out)
+        self.position = block_end
+
+    def wait_until(self, position: int) -> None:
+        """指定したサンプル位置まで出力されるのを待つ"""
+        while self.position < position:
+            time.sleep(self.blocksize / self.sample_rate)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "position": self.position,
+            "active_voices": len(self.voices),
+            "pending_events": len(self.pending),
+            "stolen_voices": self.stolen_voices,
+            "underflow_count": self.underflow_count,
+        }
+
+    def close(self) -> None:
+        """ストリームを停止して閉じる"""
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_shared_mixer: Optional[ToneMixer] = None
+
+
+def get_mixer(sample_rate: int = 44100) -> ToneMixer:
+    """プロセスで共有するミキサー (最初の呼び出しでストリームを開く)"""
+    global _shared_mixer
+    if _shared_mixer is None or _shared_mixer.sample_rate != sample_rate:
+        if _shared_mixer is not None:
+            _shared_mixer.close()
+        _shared_mixer = ToneMixer(sample_rate)
+        _shared_mixer.start()
+    return _shared_mixer
@@ -0,0 +1,96 @@
+"""
+送信する音の波形キャッシュ (ウェーブテーブル)
+
+送信側で鳴らす音は16個の決まった周波数と決まった長さ (NOTE_DURATION) だけなので、
+キー入力のたびに linspace / sin / エンベロープを計算し直さず、起動時に1度だけ作っておく。
+
+  - notes: 16音それぞれの float32 波形 (pair_codec.tone_table と同じ波形。envelope=False でエンベロープなし)
+  - pair(A, B): 2音を足し合わせた和音 (136通り)。2音は同じ配列の中で足し合わせるので、開始位置がサンプル単位で一致する
+  - max_pairs を指定すると和音は必要になったときに作り、直近に使った max_pairs 個だけを残す (メモリの上限)
+
+再生は作成済みの配列を出力ストリーム (tone_mixer.ToneMixer など) に渡すだけになる。
+返す配列は書き込み禁止のビューなので、加工する場合はコピーすること。
+
+使い方:
+    table = WaveTable(FREQUENCY, duration=0.1, sample_rate=44100)
+    mixer.play(table.char("a"))  # 'a' に対応する和音
+"""
+import collections
+import functools
+from typing import List, Optional
+
+import numpy as np
+
+from pair_codec import CODE_TO_PAIR, FREQUENCY, PAIR_TO_CODE, char_to_pair, tone_table
+
+
+class WaveTable:
+    """16音と136通りの和音の波形を保持するクラス"""
+
+    def __init__(self, frequencies: List[float] = FREQUENCY, duration: float = 0.1, sample_rate: int = 44100,
+                 amplitude: float = 0.3, max_pairs: Optional[int] = None, envelope: bool = True):
+        """
+        :param frequencies: 音の周波数のリスト
+        :param duration: 1音の長さ (秒)
+        :param sample_rate: サンプリングレート
+        :param amplitude: 1音の振幅
+        :param max_pairs: 和音を保持する最大数 (None の場合は起動時に136通りすべてを作る)
+        :param envelope: 三角形のエンベロープをかけるかどうか (pair_codec.tone_table を参照)
+        """
+        self.frequencies = list(frequencies)
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.max_pairs = max_pairs
+
+        self.notes = tone_table(frequencies, duration, sample_rate, amplitude, envelope)
+        self.notes.flags.writeable = False
+        if max_pairs is None:
+            # (136, サンプル数) をまとめて作る。1音だけの組み合わせ (A == B) はその音と同じ波形になる
+            self.pairs = (self.notes[CODE_TO_PAIR[:, 0]] + self.notes[CODE_TO_PAIR[:, 1]]) * np.float32(0.5)
+            self.pairs.flags.writeable = False
+        else:
+            self.pairs = collections.OrderedDict()
+
+    def note(self, index: int) -> np.ndarray:
+        """index 番目の音の波形"""
+        return self.notes[index]
+
+    def pair(self, A: int, B: int) -> np.ndarray:
+        """音 A と音 B (順不同) の和音の波形"""
+        code = int(PAIR_TO_CODE[A, B])
+        if self.max_pairs is None:
+            return self.pairs[code]
+
+        chord = self.pairs.get(code)
+        if chord is None:
+            chord = (self.notes[A] + self.notes[B]) * np.float32(0.5)
+            chord.flags.writeable = False
+            self.pairs[code] = chord
+            if len(self.pairs) > self.max_pairs:
+                self.pairs.popitem(last=False)  # 最も長く使っていない和音を捨てる
+        else:
+            self.pairs.move_to_end(code)
+        return chord
+
+    def char(self, char: str) -> np.ndarray:
+        """文字に対応する和音の波形"""
+        return self.pair(*char_to_pair(char))
+
+    @property
+    def nbytes(self) -> int:
+        """保持している波形の合計バイト数"""
+        if self.max_pairs is None:
+            return self.notes.nbytes + self.pairs.nbytes
+        return self.notes.nbytes + sum(chord.nbytes for chord in self.pairs.values())
+
+
+@functools.lru_cache(maxsize=64)
+def cached_note(frequency: float, duration: float, sample_rate: int = 44100, amplitude: float = 0.3) -> np.ndarray:
+    """
+    任意の周波数のエンベロープ付き波形 (同じ引数の2回目以降は作成済みの配列を返す)
+
+    16音以外の周波数を鳴らす場合用。直近に使った64通りまで保持する。
+    """
+    note = tone_table([frequency], duration, sample_rate, amplitude)[0]
+    note.flags.writeable = False
+    return note
@@ -3,23 +3,25 @@ import numpy as np
 import pyqtgraph as pg
 from PyQt5 import QtWidgets, QtCore
 
+from audio_capture import open_capture
+from stft_engine import STFTEngine
+
 class AudioStreamVisualizer:
     """リアルタイムで音声データの振幅と周波数特性をグラフィカルに表示するクラスです。"""
 
-    def __init__(self, chunk=1024, format=pyaudio.paInt16, channels=1, rate=16000):
+    def __init__(self, chunk=1024, format=pyaudio.paInt16, channels=1, rate=16000, hop=None, min_freq=1000):
         self.CHUNK = chunk
+        self.HOP = hop or chunk  # chunkより小さくするとフレームが重なり、更新が細かくなる
         self.FORMAT = format
         self.CHANNELS = channels
         self.RATE = rate
+        # 表示する帯域 (min_freq〜ナイキスト周波数) のビンだけを計算する
+        self.stft = STFTEngine(self.CHUNK, self.RATE, hop=self.HOP, window=None,
+                               band=(min_freq, self.RATE / 2), output="magnitude")
 
-        self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(
-            format=self.FORMAT,
-            channels=self.CHANNELS,
-            rate=self.RATE,
-            input=True,
-            frames_per_buffer=self.CHUNK
-        )
+        # 録音はPortAudioのスレッドで行い、GUIスレッドはキューから取り出すだけにする
+        # (環境変数 SESSION_RECORD / SESSION_REPLAY でセッションの録音・再生に切り替わる)
+        self.capture = open_capture(self.RATE, self.CHANNELS, frames_per_buffer=self.HOP)
 
         self.app = QtWidgets.QApplication([])
         self.win = pg.GraphicsLayoutWidget(title="リアルタイム音声分析")
@@ -29,7 +31,7 @@ class AudioStreamVisualizer:
         self.curve_frequency = self.plot_frequency.plot(pen='y')
         self.plot_frequency.setLogMode(x=False, y=True)  # y軸を対数スケールに設定
         self.plot_frequency.setYRange(0, 3)
-        self.plot_frequency.setXRange(1000, self.RATE // 2)  # ナイキスト周波数まで表示
+        self.plot_frequency.setXRange(min_freq, self.RATE // 2)  # ナイキスト周波数まで表示
 
         self.win.nextRow()  # 次の行にプロット
 
@@ -42,27 +44,34 @@ class AudioStreamVisualizer:
     def update(self):
         """ストリームからデータを読み込み、振幅と周波数特性のグラフを更新します。"""
         try:
-            data = self.stream.read(self.CHUNK, exception_on_overflow=False)
-            numpydata = np.frombuffer(data, dtype=np.int16)
+            self.report_drops()
+            samples = self.capture.drain()
+            if len(samples) == 0:
+                return
 
-            # 周波数データの計算とプロット
-            fft_data = np.fft.rfft(numpydata)
-            fft_magnitude = np.abs(fft_data) / self.CHUNK  # 正規化
-            frequency = np.linspace(0, self.RATE / 2, len(fft_magnitude))
-            self.curve_frequency.setData(frequency, fft_magnitude)
+            # 周波数データの計算とプロット (最新のフレームだけを描画する)
+            fft_magnitude = None
+            for fft_magnitude in self.stft.push(samples):
+                pass
+            if fft_magnitude is not None:
+                # エンジンの出力バッファは次のフレームで上書きされるのでコピーして渡す
+                self.curve_frequency.setData(self.stft.frequencies, fft_magnitude.copy())
 
         except Exception as e:
             print(f"エラーが発生しました: {str(e)}")
 
+    def report_drops(self):
+        """取りこぼしが増えたらウィンドウのタイトルに表示"""
+        if self.capture.drops_changed():
+            self.win.setWindowTitle(f"リアルタイム音声分析 ({self.capture.status_text()})")
+
     def start(self):
         """イベントループを開始します。"""
         self.app.exec_()
 
     def close(self):
         """ストリームとPyAudioをクリーンアップします。"""
-        self.stream.stop_stream()
-        self.stream.close()
-        self.p.terminate()
+        self.capture.close()
 
 # メイン関数
 if __name__ == '__main__':
@@ -0,0 +1,9 @@
+"""python -m psk <サブコマンド> の入口 (cli.py を参照)"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main
+
+sys.exit(main())
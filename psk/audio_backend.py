@@ -0,0 +1,721 @@
+"""
+音声入出力のバックエンド
+
+keyboard_psk.py (出力) と detector_v3.py (入力) が使うオーディオI/Oを切り替えられるようにする。
+
+  - "pyaudio":     PyAudio (keyboard_psk.py の従来の出力。入力にも使える)
+  - "sounddevice": sounddevice (detector_v3.py の従来の入力)
+  - "loopback":    同一プロセス内の仮想ループバックデバイス (サウンドカード不要)
+  - "loopback-shm": 共有メモリ上の仮想ループバックデバイス (送信・受信を別プロセスで動かす)
+  - "replay":      session_recorder.py で録音したセッションファイルを入力として流す (入力のみ)
+
+バックエンドは環境変数 PSK_AUDIO_BACKEND で選択する (既定: 出力は pyaudio、入力は sounddevice)。
+共有メモリの名前は PSK_LOOPBACK_NAME で変更できる。
+pskgeneratorGui.py の再生と録音は SoundDeviceDuplex (sounddevice の入出力ストリーム) で同時に行う。
+"replay" のファイルは SESSION_REPLAY、速度は SESSION_REPLAY_SPEED (既定 1.0、0 で待ち時間なし) で指定する。
+SESSION_RECORD を指定すると、どのバックエンドでも入力をセッションファイルに録音する。
+
+入力の型は open_input の dtype で選ぶ ("float32" または "int16")。"int16" では sounddevice は RawInputStream、
+PyAudio は paInt16 で開き、デバイスのバッファを np.frombuffer でコピーせずに (frames, 1) の配列として渡す。
+仮想ループバックと "replay" は dtype によらず float32 で渡す (PSKReceiver はどちらも受け付ける)。
+
+仮想ループバックには2つの動作モードがある。
+  - realtime=True:  実時間でサンプルクロックを進める (実機と同じタイミング)
+  - realtime=False: 書き込まれた音声を受信側が処理できる速さで読み出す (CIでの高速実行用)。
+                    無音の区間も書き込み側が無音データとして書き込む
+
+使い方 (psk/ ディレクトリで実行):
+    python audio_backend.py --text "hello world"            # 実時間モードでキー入力から復号までを計測
+    python audio_backend.py --text "hello world" --free-run # 非実時間モード
+"""
+import argparse
+import atexit
+import os
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from session_recorder import ReplaySource, SessionRecorder, replay_speed_from_env
+
+SAMPLE_RATE = 44100
+DEFAULT_LOOPBACK_NAME = "psk_loopback"
+
+
+class CallbackFlags:
+    """sounddevice の CallbackFlags と同じ属性を持つステータス"""
+
+    def __init__(self, input_overflow: bool = False):
+        self.input_overflow = input_overflow
+        self.input_underflow = False
+        self.output_overflow = False
+        self.output_underflow = False
+
+    def __bool__(self):
+        return self.input_overflow
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    既存の共有メモリに接続する
+
+    Python 3.12以前は接続しただけのプロセスも終了時に共有メモリを削除してしまうため、
+    resource_tracker の登録を解除する (作成したプロセスだけが削除する)。
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class LoopbackDevice:
+    """
+    スピーカー出力がそのままマイク入力に戻る仮想デバイス
+
+    書き込み側・読み出し側それぞれ1つのスレッド(またはプロセス)から使うリングバッファ。
+    shm_name を指定すると共有メモリ上に確保し、別プロセスから同じ名前で接続できる。
+    ヘッダ [書き込み位置, 読み出し位置] はそれぞれ片方の側だけが更新する。
+    ただし読み出しは読んだ区間を無音に戻すので、blocksize が latency より大きいと書き込んだばかりの区間を消しうる。
+    同じプロセス内の書き込みと読み出しは lock で排他する (別プロセスの間は latency を blocksize 以上にして使う)。
+    """
+
+    HEADER_ITEMS = 2
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, capacity_seconds: float = 10.0,
+                 latency: int = 1024, shm_name: Optional[str] = None):
+        """
+        :param capacity_seconds: リングバッファの長さ (秒)
+        :param latency: 書き込んだ音声が読み出し位置から最低何サンプル後に置かれるか
+        :param shm_name: 共有メモリの名前 (None の場合はプロセス内のメモリ)
+        """
+        self.sample_rate = sample_rate
+        self.capacity = int(capacity_seconds * sample_rate)
+        self.latency = latency
+        self.shm = None
+        self.owner = False
+        self.lock = threading.Lock()
+
+        nbytes = (self.HEADER_ITEMS * 8) + self.capacity * 4
+        if shm_name is None:
+            buffer = bytearray(nbytes)
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=shm_name, create=True, size=nbytes)
+                self.owner = True
+            except FileExistsError:
+                self.shm = _attach_shared_memory(shm_name)
+            buffer = self.shm.buf
+
+        self.header = np.ndarray((self.HEADER_ITEMS,), dtype=np.int64, buffer=buffer)
+        self.ring = np.ndarray((self.capacity,), dtype=np.float32, buffer=buffer, offset=self.HEADER_ITEMS * 8)
+        if shm_name is None or self.owner:
+            self.header[:] = 0
+            self.ring[:] = 0
+
+    @property
+    def write_position(self) -> int:
+        return int(self.header[0])
+
+    @property
+    def read_position(self) -> int:
+        return int(self.header[1])
+
+    def write(self, audio: np.ndarray, block: bool = True) -> int:
+        """
+        音声を書き込む (スピーカーから再生する)
+
+        前回の書き込みの直後、または読み出し位置 + latency のどちらか遅い方から再生される。
+        :param block: リングバッファに空きが無い場合に空くまで待つかどうか
+        :return: 再生が始まるサンプル位置 (受信側のサンプルクロック)
+        """
+        if audio.dtype == np.int16:
+            audio = audio.astype(np.float32) / 32767.0
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        if len(audio) > self.capacity - self.latency:
+            raise ValueError("書き込むデータがリングバッファより長すぎます")
+
+        while True:
+            with self.lock:
+                start = max(self.write_position, self.read_position + self.latency)
+                end = start + len(audio)
+                if end - self.read_position <= self.capacity:
+                    index = np.arange(start, end) % self.capacity
+                    self.ring[index] = audio
+                    self.header[0] = end
+                    return start
+            if not block:
+                raise BufferError("リングバッファに空きがありません")
+            time.sleep(0.001)
+
+    def read(self, frames: int) -> np.ndarray:
+        """frames サンプルを読み出す (マイクで録音する)。書き込まれていない区間は無音になる"""
+        with self.lock:
+            start = self.read_position
+            index = np.arange(start, start + frames) % self.capacity
+            data = self.ring[index].copy()
+            # 読み終わった区間は次の周回のために無音に戻す
+            self.ring[index] = 0.0
+            self.header[1] = start + frames
+        return data
+
+    def wait_until_played(self, position: int) -> None:
+        """指定したサンプル位置まで読み出されるのを待つ"""
+        while self.read_position < position:
+            time.sleep(0.001)
+
+    def close(self) -> None:
+        if self.shm is not None:
+            # ndarray のビューを先に解放しないと共有メモリを閉じられない
+            del self.header, self.ring
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+            self.shm = None
+
+
+# ---- 出力ストリーム ----
+
+class PyAudioOutput:
+    """PyAudio の出力ストリーム (int16, モノラル)"""
+
+    def __init__(self, sample_rate: int):
+        import pyaudio
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(format=pyaudio.paInt16, channels=1, rate=sample_rate, output=True)
+
+    def write(self, audio: np.ndarray) -> None:
+        self.stream.write(audio.astype(np.int16).tobytes())
+
+    def close(self) -> None:
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
+
+
+class SoundDeviceOutput:
+    """sounddevice の出力ストリーム (int16, モノラル)"""
+
+    def __init__(self, sample_rate: int):
+        import sounddevice as sd
+        self.stream = sd.OutputStream(samplerate=sample_rate, channels=1, dtype='int16')
+        self.stream.start()
+
+    def write(self, audio: np.ndarray) -> None:
+        self.stream.write(audio.astype(np.int16).reshape(-1, 1))
+
+    def close(self) -> None:
+        self.stream.stop()
+        self.stream.close()
+
+
+class LoopbackOutput:
+    """仮想ループバックデバイスへの出力"""
+
+    def __init__(self, device: LoopbackDevice, realtime: bool = True):
+        self.device = device
+        self.realtime = realtime
+        self.last_position = 0  # 最後に書き込んだ音声の再生開始位置
+
+    def write(self, audio: np.ndarray) -> None:
+        self.last_position = self.device.write(audio)
+        if self.realtime:
+            # 実機の blocking write と同じく、再生し終わるまで待つ
+            self.device.wait_until_played(self.last_position + len(audio))
+
+    def close(self) -> None:
+        self.device.close()
+        # 次に開くときは新しいデバイスを作る (閉じたデバイスの位置や共有メモリを使い回さない)
+        for key, device in list(_loopback_devices.items()):
+            if device is self.device:
+                del _loopback_devices[key]
+
+
+# ---- 入力ストリーム ----
+
+class SoundDeviceInput:
+    """sounddevice の入力ストリーム (コールバック方式)"""
+
+    def __init__(self, sample_rate: int, callback: Callable, blocksize: int = 0, dtype: str = "float32"):
+        import sounddevice as sd
+        if dtype == "int16":
+            # RawInputStream は numpy 配列を作らずにバッファをそのまま渡すので、ここで int16 として見る
+            def raw_callback(indata, frames, time_info, status):
+                callback(np.frombuffer(indata, dtype=np.int16).reshape(-1, 1), frames, time_info, status)
+
+            self.stream = sd.RawInputStream(samplerate=sample_rate, channels=1, dtype='int16',
+                                            blocksize=blocksize, callback=raw_callback)
+        else:
+            self.stream = sd.InputStream(samplerate=sample_rate, channels=1, dtype=dtype,
+                                         blocksize=blocksize, callback=callback)
+
+    def start(self) -> None:
+        self.stream.start()
+
+    def stop(self) -> None:
+        self.stream.stop()
+        self.stream.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class PyAudioInput:
+    """
+    PyAudio の入力ストリーム (コールバック方式)
+
+    sounddevice.InputStream と同じ形式 (indata, frames, time, status) でコールバックを呼ぶ。
+    indata は PyAudio のバッファを np.frombuffer で見た (frames, 1) の配列 (コピーしない)。
+    """
+
+    def __init__(self, sample_rate: int, callback: Callable, blocksize: int = 0, dtype: str = "float32"):
+        import pyaudio
+        formats = {"int16": pyaudio.paInt16, "float32": pyaudio.paFloat32}
+        if dtype not in formats:
+            raise ValueError(f"PyAudio の入力に対応していない型です: {dtype}")
+        numpy_dtype = np.dtype(dtype)
+
+        def stream_callback(in_data, frame_count, time_info, status_flags):
+            data = np.frombuffer(in_data, dtype=numpy_dtype).reshape(-1, 1)
+            info = SimpleNamespace(inputBufferAdcTime=time_info["input_buffer_adc_time"],
+                                   currentTime=time_info["current_time"])
+            callback(data, frame_count, info, CallbackFlags(bool(status_flags & pyaudio.paInputOverflow)))
+            return None, pyaudio.paContinue
+
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(format=formats[dtype], channels=1, rate=sample_rate, input=True,
+                                  frames_per_buffer=blocksize or pyaudio.paFramesPerBufferUnspecified,
+                                  stream_callback=stream_callback, start=False)
+
+    def start(self) -> None:
+        self.stream.start_stream()
+
+    def stop(self) -> None:
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class LoopbackInput:
+    """
+    仮想ループバックデバイスからの入力
+
+    sounddevice.InputStream と同じ形式 (indata, frames, time, status) でコールバックを呼ぶ。
+    """
+
+    def __init__(self, device: LoopbackDevice, callback: Callable, blocksize: int = 1024,
+                 realtime: bool = True):
+        self.device = device
+        self.callback = callback
+        self.blocksize = blocksize or 1024
+        self.realtime = realtime
+        self.running = False
+        self.thread = None
+        self.overflows = 0
+
+    def _run(self) -> None:
+        sample_rate = self.device.sample_rate
+        block_seconds = self.blocksize / sample_rate
+        start_time = time.perf_counter()
+        start_position = self.device.read_position
+        blocks = 0
+        while self.running:
+            overflow = False
+            if not self.realtime:
+                # 非実時間モードでは書き込み側がサンプルクロックを進める。
+                # 1ブロック分書き込まれるまで待ってからすぐに読み出す
+                if self.device.write_position - self.device.read_position < self.blocksize:
+                    time.sleep(0.0005)
+                    continue
+            else:
+                # サンプルクロックに合わせて次のブロックが「録音し終わる」まで待つ
+                deadline = start_time + (blocks + 1) * block_seconds
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                elif -delay > block_seconds:
+                    # コールバックが間に合わなかった (実機のオーバーフローに相当)
+                    overflow = True
+                    self.overflows += 1
+            data = self.device.read(self.blocksize)
+            blocks += 1
+            position = start_position + blocks * self.blocksize
+            time_info = SimpleNamespace(inputBufferAdcTime=position / sample_rate,
+                                        currentTime=time.perf_counter() - start_time)
+            self.callback(data.reshape(-1, 1), self.blocksize, time_info, CallbackFlags(overflow))
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class ReplayInput:
+    """
+    セッションファイルからの入力
+
+    録音を blocksize ごとに区切り直し、sounddevice.InputStream と同じ形式でコールバックを呼ぶ。
+    speed=1.0 で実時間、speed=0 で待ち時間なしに流す。
+    """
+
+    def __init__(self, path: str, callback: Callable, blocksize: int = 1024, speed: float = 1.0):
+        self.source = ReplaySource(path)
+        self.callback = callback
+        self.blocksize = blocksize or 1024
+        self.speed = speed
+        self.running = False
+        self.thread = None
+        self.overflows = 0
+
+    def _run(self) -> None:
+        sample_rate = self.source.rate
+        start_time = time.perf_counter()
+        try:
+            for position, block in self.source.iter_blocks(self.blocksize):
+                if not self.running:
+                    break
+                if self.speed > 0:
+                    # ブロックの最後のサンプルが「録音し終わる」時刻まで待つ
+                    deadline = start_time + (position + self.blocksize / sample_rate) / self.speed
+                    delay = deadline - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                data = block.astype(np.float32).reshape(-1, 1)
+                if self.source.reader.dtype == np.int16:
+                    data /= 32768.0
+                time_info = SimpleNamespace(inputBufferAdcTime=position, currentTime=time.perf_counter() - start_time)
+                self.callback(data, self.blocksize, time_info, CallbackFlags())
+        finally:
+            # 最後まで流したら (またはコールバックが例外を出したら) 止まる
+            self.running = False
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.source.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ---- 再生と録音を同じストリームで行う ----
+
+class SoundDeviceDuplex:
+    """
+    メモリ上の波形を再生しながら録音する sounddevice の入出力ストリーム (コールバック方式)
+
+    1つのコールバックで出力 (outdata) と入力 (indata) を扱うので、再生と録音が同じサンプルクロックで進む。
+    録音の n サンプル目は再生の n サンプル目と同じ時刻 (+ デバイス固有の一定の遅延) になり、
+    ファイルの読み込みやプレイヤーの起動待ちによるずれが入らない。
+
+    on_input は PortAudio のスレッドから (入力ブロック, そのブロックの先頭のサンプル位置) で呼ばれるので、
+    ファイル書き込みや復調などの重い処理はキューに積んで別スレッドで行うこと。
+    """
+
+    def __init__(self, audio: np.ndarray, sample_rate: int, on_input: Optional[Callable] = None,
+                 tail_frames: int = 0, blocksize: int = 1024):
+        """
+        :param audio: 再生する波形 (int16 または -1〜1 の float)
+        :param on_input: 録音したブロックを受け取る関数 (None の場合は再生だけを行う)
+        :param tail_frames: 再生し終わってから録音を続けるサンプル数 (残響や遅延の分)
+        """
+        import sounddevice as sd
+
+        audio = np.asarray(audio).reshape(-1)
+        if audio.dtype.kind != "f":
+            audio = audio / 32768.0
+        self.audio = audio.astype(np.float32)
+        self.sample_rate = sample_rate
+        self.on_input = on_input
+        self.end_position = len(self.audio) + tail_frames
+        self.position = 0  # 次のコールバックで再生・録音する最初のサンプル位置
+        self.xruns = 0
+        self.finished = threading.Event()
+        self.stop_lock = threading.Lock()
+        if on_input is None:
+            self.stream = sd.OutputStream(samplerate=sample_rate, channels=1, dtype='float32',
+                                          blocksize=blocksize, callback=self._output_callback,
+                                          finished_callback=self.finished.set)
+        else:
+            self.stream = sd.Stream(samplerate=sample_rate, channels=1, dtype='float32',
+                                    blocksize=blocksize, callback=self._duplex_callback,
+                                    finished_callback=self.finished.set)
+
+    def _fill(self, outdata, frames: int) -> None:
+        out = outdata[:, 0]
+        chunk = self.audio[self.position:self.position + frames]
+        out[:len(chunk)] = chunk
+        out[len(chunk):] = 0
+
+    def _advance(self, frames: int) -> None:
+        import sounddevice as sd
+
+        self.position += frames
+        if self.position >= self.end_position:
+            raise sd.CallbackStop
+
+    def _output_callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.xruns += 1
+        self._fill(outdata, frames)
+        self._advance(frames)
+
+    def _duplex_callback(self, indata, outdata, frames, time_info, status):
+        if status.input_overflow or status.output_underflow:
+            self.xruns += 1
+        self._fill(outdata, frames)
+        self.on_input(indata[:, 0].copy(), self.position)
+        self._advance(frames)
+
+    @property
+    def latency_frames(self) -> int:
+        """再生した音が録音に現れるまでのおおよそのサンプル数 (デバイスが報告する入力と出力の遅延の和)"""
+        latency = self.stream.latency
+        if isinstance(latency, (tuple, list)):
+            latency = sum(latency)
+        return int(round(latency * self.sample_rate))
+
+    def start(self) -> None:
+        self.stream.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """最後まで再生 (と tail_frames 分の録音) が終わるのを待つ"""
+        return self.finished.wait(timeout)
+
+    def stop(self) -> None:
+        """
+        停止してストリームを閉じる (何度呼んでもよい)
+
+        利用者の停止操作と再生スレッドの終了処理の両方から呼ばれるので、2回目以降は何もしない。
+        """
+        with self.stop_lock:
+            if self.stream is None:
+                return
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        self.finished.set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _recording_callback(callback: Callable, path: str, sample_rate: int, dtype: str = "float32"):
+    """入力ブロックをセッションファイルに書き込んでから callback を呼ぶラッパー"""
+    # int16 の入力は int16 のまま録音する (再生時に ReplayInput が -1〜1 に戻す)
+    recorder = SessionRecorder(path, sample_rate, dtype=dtype)
+    # ストリームの停止時には閉じられないので、プロセス終了時に書き残しを保存する
+    atexit.register(recorder.close)
+
+    def wrapper(indata, frames, time_info, status):
+        recorder.write(indata[:, 0])
+        callback(indata, frames, time_info, status)
+
+    wrapper.recorder = recorder
+    return wrapper
+
+
+# ---- バックエンドの選択 ----
+
+_loopback_devices: Dict[str, LoopbackDevice] = {}
+
+
+def get_loopback_device(shared: bool = False, sample_rate: int = SAMPLE_RATE) -> LoopbackDevice:
+    """同じプロセス内では同じ仮想デバイスを返す"""
+    key = "shm" if shared else "local"
+    if key not in _loopback_devices:
+        name = os.environ.get("PSK_LOOPBACK_NAME", DEFAULT_LOOPBACK_NAME) if shared else None
+        _loopback_devices[key] = LoopbackDevice(sample_rate, shm_name=name)
+    return _loopback_devices[key]
+
+
+def _backend_name(default: str) -> str:
+    return os.environ.get("PSK_AUDIO_BACKEND", default)
+
+
+def _is_realtime() -> bool:
+    return os.environ.get("PSK_LOOPBACK_FREE_RUN", "") == ""
+
+
+def open_output(sample_rate: int = SAMPLE_RATE, backend: Optional[str] = None):
+    """出力ストリームを開く"""
+    backend = backend or _backend_name("pyaudio")
+    if backend == "pyaudio":
+        return PyAudioOutput(sample_rate)
+    if backend == "sounddevice":
+        return SoundDeviceOutput(sample_rate)
+    if backend in ("loopback", "loopback-shm"):
+        return LoopbackOutput(get_loopback_device(backend == "loopback-shm", sample_rate), _is_realtime())
+    raise ValueError(f"不明なバックエンドです: {backend}")
+
+
+def open_input(callback: Callable, sample_rate: int = SAMPLE_RATE, blocksize: int = 0,
+               backend: Optional[str] = None, dtype: str = "float32"):
+    """
+    入力ストリームを開く (with 文で開始・停止する)
+
+    :param dtype: "float32" または "int16" (sounddevice / pyaudio のみ。ほかのバックエンドは float32)
+    """
+    backend = backend or _backend_name("sounddevice")
+    if backend not in ("sounddevice", "pyaudio"):
+        dtype = "float32"
+    record_path = os.environ.get("SESSION_RECORD")
+    if record_path and backend != "replay":
+        callback = _recording_callback(callback, record_path, sample_rate, dtype)
+    if backend == "replay":
+        stream = ReplayInput(os.environ["SESSION_REPLAY"], callback, blocksize, replay_speed_from_env())
+        if stream.source.rate != sample_rate:
+            raise ValueError(f"録音のサンプリングレート ({stream.source.rate}Hz) が受信の設定 ({sample_rate}Hz) と異なります")
+        return stream
+    if backend == "sounddevice":
+        return SoundDeviceInput(sample_rate, callback, blocksize, dtype)
+    if backend == "pyaudio":
+        return PyAudioInput(sample_rate, callback, blocksize, dtype)
+    if backend in ("loopback", "loopback-shm"):
+        return LoopbackInput(get_loopback_device(backend == "loopback-shm", sample_rate), callback,
+                             blocksize, _is_realtime())
+    raise ValueError(f"入力に対応していないバックエンドです: {backend}")
+
+
+# ---- ループバックでのE2E計測 ----
+
+def measure_loopback(text: str, realtime: bool = True, char_interval: float = 0.25,
+                     blocksize: int = 1024) -> Dict:
+    """
+    送信 (keyboard_psk.py と同じ信号) と受信 (PSKReceiver) を同じプロセスで動かし、
+    キー入力から復号までのレイテンシと持続的な文字スループットを計測する
+    """
+    import contextlib
+    import io
+    from channel_simulator import evaluate_detections
+    from psk_charcodec import build_waves, char_code_to_bits
+    from psk_receiver import PSKReceiver
+    from pskgenerator import generate_psk_signal_in_memory
+
+    device = LoopbackDevice(SAMPLE_RATE, latency=blocksize)
+    receiver = PSKReceiver()
+    detections = []
+    callback_seconds = []
+
+    def callback(indata, frames, time_info, status):
+        start = time.perf_counter()
+        result = receiver.process_block(indata[:, 0])
+        callback_seconds.append(time.perf_counter() - start)
+        if result is not None:
+            position = int(round(time_info.inputBufferAdcTime * SAMPLE_RATE))
+            detections.append((position, result["bits"][0] + result["bits"][1], result["char_code"]))
+
+    spans = []
+    stream = LoopbackInput(device, callback, blocksize, realtime)
+    wall_start = time.perf_counter()
+    spacing = int(char_interval * SAMPLE_RATE)
+    with stream:
+        for character in text:
+            key_time = time.perf_counter()
+            waves = build_waves(char_code_to_bits(ord(character)))
+            with contextlib.redirect_stdout(io.StringIO()):
+                audio = generate_psk_signal_in_memory(SAMPLE_RATE, waves)
+            if realtime:
+                start = device.write(audio)
+                # 次のキー入力まで待つ
+                time.sleep(max(0.0, key_time + char_interval - time.perf_counter()))
+            else:
+                # 次のキー入力までの無音も含めて書き込む
+                padded = np.zeros(max(spacing, len(audio)), dtype=np.float32)
+                padded[:len(audio)] = audio / 32767.0
+                start = device.write(padded)
+            spans.append((start, start + len(audio)))
+        tail = spans[-1][1] + SAMPLE_RATE // 2
+        if not realtime:
+            # 受信側はブロック単位で読むので、最後のブロックが埋まるまで無音を書き込む
+            device.write(np.zeros(max(0, tail + blocksize - device.write_position), dtype=np.float32))
+        device.wait_until_played(tail)
+    wall_seconds = time.perf_counter() - wall_start
+
+    total_samples = device.read_position
+    result = evaluate_detections(text, spans, detections, total_samples, SAMPLE_RATE)
+    block_seconds = blocksize / SAMPLE_RATE
+    result.update({
+        "mode": "realtime" if realtime else "free-run",
+        "audio_seconds": total_samples / SAMPLE_RATE,
+        "wall_seconds": wall_seconds,
+        "overflows": stream.overflows,
+        "callback_ms": {
+            "p50": float(np.percentile(callback_seconds, 50) * 1000),
+            "p99": float(np.percentile(callback_seconds, 99) * 1000),
+            "deadline": block_seconds * 1000,
+        },
+    })
+    return result
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="仮想ループバックでキー入力から復号までを計測する")
+    parser.add_argument("--text", default="hello world", help="送信する文字列")
+    parser.add_argument("--free-run", action="store_true", help="実時間に合わせず最大速度で動かす")
+    parser.add_argument("--char-interval", type=float, default=0.25, help="キー入力の間隔 (秒)")
+    parser.add_argument("--block-size", type=int, default=1024, help="受信側のブロックサイズ")
+    args = parser.parse_args(argv)
+
+    result = measure_loopback(args.text, not args.free_run, args.char_interval, args.block_size)
+    print(f"モード: {result['mode']}")
+    print(f"送信: {result['text']}")
+    print(f"受信 (理想同期): {result['decoded']}")
+    print(f"文字正解率: {result['char_accuracy'] * 100:.1f}%")
+    if result["latency_ms"]["mean"] is not None:
+        print(f"キー入力から復号まで: 平均 {result['latency_ms']['mean']:.1f} ms / 最大 {result['latency_ms']['max']:.1f} ms (送信終了基準)")
+    print(f"スループット: {result['chars_per_second']:.2f} 文字/秒 (音声時間基準)")
+    print(f"経過時間: {result['wall_seconds']:.2f} 秒 (音声 {result['audio_seconds']:.2f} 秒)")
+    print(f"コールバック: p50 {result['callback_ms']['p50']:.2f} ms / p99 {result['callback_ms']['p99']:.2f} ms "
+          f"(期限 {result['callback_ms']['deadline']:.2f} ms), オーバーフロー {result['overflows']} 回")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
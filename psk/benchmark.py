@@ -0,0 +1,355 @@
+"""
+送受信ホットパスの性能回帰ベンチマーク
+
+各ステージについて以下を計測し、JSONに保存する。
+  - samples_per_sec: 1秒あたりに処理できたサンプル数
+  - latency_ms:      1ブロックあたりの処理時間のパーセンタイル (p50/p90/p99/max)
+  - peak_memory_bytes: 1ブロック処理中のピークメモリ (tracemalloc)
+
+使い方 (psk/ ディレクトリで実行):
+    python benchmark.py                          # 計測して bench/latest.json に保存
+    python benchmark.py --save-baseline          # 計測結果を bench/baseline.json として保存
+    python benchmark.py --compare                # bench/baseline.json と比較し、劣化があれば終了コード1
+    python benchmark.py --stage bandpass_filter  # 特定のステージのみ計測
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+PSK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(PSK_DIR)
+for path in (PSK_DIR, os.path.join(PSK_DIR, "gui")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from psk_charcodec import build_waves, char_code_to_bits
+
+SAMPLE_RATE = 44100
+BENCH_DIR = os.path.join(PSK_DIR, "bench")
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "latest.json")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# keyboard_psk.py と同じ搬送波設定 (channel_plan.json) で文字 "s" を送る波形
+CHARACTER_WAVES = build_waves(char_code_to_bits(ord("s")))
+
+
+class Stage:
+    """ベンチマーク対象の1ステージ"""
+
+    def __init__(self, name: str, setup: Callable[[], Callable[[], None]],
+                 samples_per_call: Callable[[], int], repeats: int = 50):
+        # setup() は計測対象の関数 (引数なし) を返す。依存ライブラリが無い場合は ImportError を送出する
+        self.name = name
+        self.setup = setup
+        self.samples_per_call = samples_per_call
+        self.repeats = repeats
+
+
+def _random_audio(num_samples: int, dtype=np.float64, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-1.0, 1.0, num_samples).astype(dtype)
+
+
+def _load_module_from_path(name: str, path: str):
+    """同名モジュール (code_detector.py など) を区別してファイルパスから読み込む"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ---- 各ステージの準備 ----
+
+def _setup_generate_psk_signal():
+    from pskgenerator import generate_psk_signal_in_memory
+    return lambda: generate_psk_signal_in_memory(SAMPLE_RATE, CHARACTER_WAVES)
+
+
+def _setup_combine_audio_signals():
+    from pskgenerator import combine_audio_signals, generate_phase_shifting_sine
+    with contextlib.redirect_stdout(io.StringIO()):
+        signals = [generate_phase_shifting_sine(w["frequency"], SAMPLE_RATE, w["switch_interval"], w["binary_message"])
+                   for w in CHARACTER_WAVES]
+    return lambda: combine_audio_signals(*signals, waves=CHARACTER_WAVES)
+
+
+RECORDING_SECONDS = 10
+
+
+def _setup_bandpass_filter():
+    from pskdetector_pureData import bandpass_filter
+    audio = _random_audio(SAMPLE_RATE * RECORDING_SECONDS)
+    return lambda: bandpass_filter(audio, SAMPLE_RATE, 4410, 441)
+
+
+def _setup_detect_phase_shifting_sine_multiply():
+    from pskdetector_pureData import detect_phase_shifting_sine_multiply
+    audio = _random_audio(SAMPLE_RATE * RECORDING_SECONDS)
+    return lambda: detect_phase_shifting_sine_multiply(audio, SAMPLE_RATE, 4410, 110, save_mixed_audio=False)
+
+
+def _setup_detect_phase_shifting_sine_coherent():
+    from pskdetector_pureData import detect_phase_shifting_sine_coherent
+    audio = _random_audio(SAMPLE_RATE * RECORDING_SECONDS)
+    return lambda: detect_phase_shifting_sine_coherent(audio, SAMPLE_RATE, 4410, 110)
+
+
+CALLBACK_BLOCK_SIZE = 1024
+
+
+def _setup_detector_v3_callback():
+    import detector_v3
+    indata = _random_audio(CALLBACK_BLOCK_SIZE, np.float32).reshape(-1, 1)
+    return lambda: detector_v3.audio_callback(indata, CALLBACK_BLOCK_SIZE, None, None)
+
+
+def _setup_receiver_process_block(demodulator: str = "delay", kernels: str = "numpy", sample_dtype: str = "float64"):
+    def setup():
+        from psk_receiver import SAMPLE_DTYPES, PSKReceiver
+        import receiver_kernels
+        # kernels="numba" は numba が無ければスキップする (受信器は NumPy の経路に戻るので、計測しても意味がない)。
+        # 初回のコンパイルはウォームアップに含まれる
+        if kernels == "numba" and receiver_kernels.numba is None:
+            raise ImportError("numba がインストールされていません")
+        input_dtype, dtype = SAMPLE_DTYPES[sample_dtype]
+        receiver = PSKReceiver(demodulator=demodulator, kernels=kernels, dtype=dtype)
+        data = _random_audio(CALLBACK_BLOCK_SIZE, np.float32)
+        if input_dtype == "int16":
+            # sd.RawInputStream のバッファを np.frombuffer で見たものと同じ形
+            data = np.frombuffer((data * 32767).astype(np.int16).tobytes(), dtype=np.int16)
+        return lambda: receiver.process_block(data)
+    return setup
+
+
+def _setup_compute_fft(module_name: str, relative_path: str, window: Optional[str] = None, **attributes):
+    def setup():
+        if REPO_ROOT not in sys.path:
+            sys.path.insert(0, REPO_ROOT)
+        from stft_engine import STFTEngine
+        module = _load_module_from_path(module_name, os.path.join(REPO_ROOT, relative_path))
+        # GUIやオーディオデバイスを開かずに compute_fft だけを呼び出す (STFTエンジンは各ビジュアライザと同じ設定)
+        stft = STFTEngine(attributes["CHUNK"], 16000, nfft=attributes.get("NFFT"), window=window)
+        visualizer = SimpleNamespace(stft=stft, **attributes)
+        data = (_random_audio(attributes["CHUNK"]) * 32767).astype(np.int16).tobytes()
+        return lambda: module.AudioStreamVisualizer.compute_fft(visualizer, data)
+    return setup
+
+
+def _setup_stft_engine_push():
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from stft_engine import STFTEngine
+    # comfortable_tone/code_detector.py 相当の設定で、75% 重なりのフレームを計算する
+    stft = STFTEngine(2048, 16000, nfft=4096, hop=512)
+    data = (_random_audio(2048) * 32767).astype(np.int16)
+
+    def run():
+        for _ in stft.push(data):
+            pass
+    return run
+
+
+def _setup_stft_engine_zoom():
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from stft_engine import STFTEngine
+    # code_detector.py --zoom-bins 591 と同じ設定 (2000〜7900Hz だけをチャープZ変換で計算する)
+    stft = STFTEngine(1600, 16000, window=None, band=(2000, 7900), zoom_bins=591)
+    data = (_random_audio(1600) * 32767).astype(np.int16)
+    return lambda: stft.spectrum(data)
+
+
+def _setup_tone_bank_push():
+    path = os.path.join(REPO_ROOT, "comfortable_tone")
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    from pair_codec import FREQUENCY
+    from tone_bank import ToneBank
+    # comfortable_tone/code_detector.py のトーンバンクモードと同じ設定 (2048サンプル窓、256サンプルごとに判定)
+    bank = ToneBank(FREQUENCY, 16000, 2048, 256)
+    data = (_random_audio(2048) * 32767).astype(np.int16)
+    return lambda: bank.push(data)
+
+
+STAGES: List[Stage] = [
+    Stage("generate_psk_signal_in_memory", _setup_generate_psk_signal,
+          lambda: 5 * SAMPLE_RATE * 110 // 4410),
+    Stage("combine_audio_signals", _setup_combine_audio_signals,
+          lambda: 4 * 5 * SAMPLE_RATE * 110 // 4410),
+    Stage("bandpass_filter", _setup_bandpass_filter,
+          lambda: SAMPLE_RATE * RECORDING_SECONDS, repeats=10),
+    Stage("detect_phase_shifting_sine_multiply", _setup_detect_phase_shifting_sine_multiply,
+          lambda: SAMPLE_RATE * RECORDING_SECONDS, repeats=10),
+    Stage("detect_phase_shifting_sine_coherent", _setup_detect_phase_shifting_sine_coherent,
+          lambda: SAMPLE_RATE * RECORDING_SECONDS, repeats=10),
+    Stage("detector_v3.audio_callback", _setup_detector_v3_callback,
+          lambda: CALLBACK_BLOCK_SIZE, repeats=200),
+    Stage("psk_receiver.process_block", _setup_receiver_process_block(),
+          lambda: CALLBACK_BLOCK_SIZE, repeats=200),
+    Stage("psk_receiver.process_block[numba]", _setup_receiver_process_block(kernels="numba"),
+          lambda: CALLBACK_BLOCK_SIZE, repeats=200),
+    Stage("psk_receiver.process_block[float32]", _setup_receiver_process_block(sample_dtype="float32"),
+          lambda: CALLBACK_BLOCK_SIZE, repeats=200),
+    Stage("psk_receiver.process_block[int16]", _setup_receiver_process_block(sample_dtype="int16"),
+          lambda: CALLBACK_BLOCK_SIZE, repeats=200),
+    Stage("psk_receiver.process_block[coherent]", _setup_receiver_process_block("coherent"),
+          lambda: CALLBACK_BLOCK_SIZE, repeats=200),
+    Stage("spectrogram.compute_fft", _setup_compute_fft("spectrogram", "spectrogram.py", CHUNK=2048),
+          lambda: 2048, repeats=500),
+    Stage("code_detector.compute_fft", _setup_compute_fft("code_detector", "code_detector.py", CHUNK=1600),
+          lambda: 1600, repeats=500),
+    Stage("comfortable_tone.code_detector.compute_fft",
+          _setup_compute_fft("comfortable_tone_code_detector", os.path.join("comfortable_tone", "code_detector.py"),
+                             window="hann", CHUNK=2048, NFFT=4096),
+          lambda: 2048, repeats=500),
+    Stage("stft_engine.push", _setup_stft_engine_push, lambda: 2048, repeats=500),
+    Stage("stft_engine.zoom", _setup_stft_engine_zoom, lambda: 1600, repeats=500),
+    Stage("comfortable_tone.tone_bank.push", _setup_tone_bank_push, lambda: 2048, repeats=500),
+]
+
+
+def run_stage(stage: Stage, warmup: int = 3) -> Dict:
+    """1ステージを計測して結果の辞書を返す"""
+    try:
+        func = stage.setup()
+    except (ImportError, OSError) as e:
+        # sounddevice (PortAudio) やPyQt5が無い環境ではスキップ
+        return {"skipped": f"{type(e).__name__}: {e}"}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            func()
+
+        durations = np.empty(stage.repeats)
+        for i in range(stage.repeats):
+            start = time.perf_counter()
+            func()
+            durations[i] = time.perf_counter() - start
+
+        # ピークメモリは計測のオーバーヘッドが大きいので別に1回だけ測る
+        tracemalloc.start()
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    samples = stage.samples_per_call()
+    latency_ms = durations * 1000
+    return {
+        "samples_per_call": samples,
+        "repeats": stage.repeats,
+        "samples_per_sec": samples * stage.repeats / float(np.sum(durations)),
+        "latency_ms": {
+            "p50": float(np.percentile(latency_ms, 50)),
+            "p90": float(np.percentile(latency_ms, 90)),
+            "p99": float(np.percentile(latency_ms, 99)),
+            "max": float(np.max(latency_ms)),
+        },
+        "peak_memory_bytes": int(peak_memory),
+    }
+
+
+def run_benchmarks(stage_names: Optional[List[str]] = None) -> Dict:
+    """全ステージ (または指定したステージ) を計測する"""
+    results = {}
+    for stage in STAGES:
+        if stage_names and stage.name not in stage_names:
+            continue
+        print(f"計測中: {stage.name} ...", flush=True)
+        results[stage.name] = run_stage(stage)
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "stages": results,
+    }
+
+
+def compare_results(current: Dict, baseline: Dict, tolerance: float = 0.2) -> List[str]:
+    """
+    ベースラインと比較し、劣化したステージのメッセージを返す
+
+    :param tolerance: 許容する劣化の割合 (0.2 = 20%)
+    """
+    regressions = []
+    for name, result in current["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None or "skipped" in base or "skipped" in result:
+            continue
+        if result["samples_per_sec"] < base["samples_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: スループット {base['samples_per_sec']:.0f} -> {result['samples_per_sec']:.0f} samples/s")
+        if result["latency_ms"]["p99"] > base["latency_ms"]["p99"] * (1 + tolerance):
+            regressions.append(f"{name}: p99レイテンシ {base['latency_ms']['p99']:.3f} -> {result['latency_ms']['p99']:.3f} ms")
+        if result["peak_memory_bytes"] > base["peak_memory_bytes"] * (1 + tolerance):
+            regressions.append(f"{name}: ピークメモリ {base['peak_memory_bytes']} -> {result['peak_memory_bytes']} bytes")
+    return regressions
+
+
+def print_results(results: Dict) -> None:
+    print(f"\n{'stage':<45} {'samples/s':>14} {'p50 ms':>9} {'p99 ms':>9} {'peak KiB':>10}")
+    print("-" * 91)
+    for name, result in results["stages"].items():
+        if "skipped" in result:
+            print(f"{name:<45} スキップ ({result['skipped']})")
+            continue
+        print(f"{name:<45} {result['samples_per_sec']:>14.0f} {result['latency_ms']['p50']:>9.3f} "
+              f"{result['latency_ms']['p99']:>9.3f} {result['peak_memory_bytes'] / 1024:>10.1f}")
+
+
+def save_json(data: Dict, path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="PSK送受信ホットパスの性能回帰ベンチマーク")
+    parser.add_argument("--stage", action="append", help="計測するステージ名 (複数指定可)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="結果の保存先JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="ベースラインJSON")
+    parser.add_argument("--save-baseline", action="store_true", help="結果をベースラインとして保存する")
+    parser.add_argument("--compare", action="store_true", help="ベースラインと比較し、劣化があれば終了コード1を返す")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="許容する劣化の割合 (既定: 0.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.stage)
+    print_results(results)
+    save_json(results, args.output)
+    print(f"\n結果を {args.output} に保存しました")
+
+    if args.save_baseline:
+        save_json(results, args.baseline)
+        print(f"ベースラインを {args.baseline} に保存しました")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"エラー: ベースライン '{args.baseline}' が見つかりません。--save-baseline で作成してください。")
+            return 1
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print("\n性能劣化を検出しました:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print("\nベースラインからの劣化はありません")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+搬送波の割り当て (チャンネルプラン) の読み込み
+
+keyboard_psk.py (送信)、psk_receiver.py (受信)、main.py が同じ channel_plan.json を読み込むことで、
+周波数とスイッチ間隔の設定が送受信でずれないようにする。
+plan_optimizer.py で探索したプランを書き出すと、そのまま送受信の両方に反映される。
+
+別のプランを使う場合は環境変数 PSK_CHANNEL_PLAN にJSONのパスを指定する。
+
+形式:
+    {
+      "sample_rate": 44100,
+      "carriers": [
+        {"frequency": 4410, "switch_interval": 110, "bandwidth": 441},
+        ...
+      ]
+    }
+
+period_samples (任意): 1周期のサンプル数 k。plan_optimizer.py は周波数を sample_rate / k に限っており、
+この値を書き出す。指定した搬送波は周波数を sample_rate / k そのものとして扱い、1ビットの長さを
+k * switch_interval サンプルとする (丸めた frequency から計算すると1サンプル短くなることがあるため)。
+"""
+import json
+import os
+from typing import Dict, List, Optional
+
+DEFAULT_PLAN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "channel_plan.json")
+
+# 受信側の自動ゲイン調整の初期値 (プランに含まれていない場合に使う)
+DEFAULT_INITIAL_GAIN = 100
+DEFAULT_MAX_GAIN = 500
+
+# 1文字あたりのビット数 (7bit ASCII + パリティ を2回繰り返す)
+BITS_PER_CHARACTER = 16
+
+
+def load_channel_plan(path: Optional[str] = None) -> Dict:
+    """チャンネルプランを読み込む"""
+    path = path or os.environ.get("PSK_CHANNEL_PLAN", DEFAULT_PLAN_PATH)
+    with open(path, encoding="utf-8") as f:
+        plan = json.load(f)
+    validate_channel_plan(plan)
+    return plan
+
+
+def save_channel_plan(plan: Dict, path: str = DEFAULT_PLAN_PATH) -> None:
+    """チャンネルプランを書き出す"""
+    validate_channel_plan(plan)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+
+def validate_channel_plan(plan: Dict) -> None:
+    """送受信できないプランを読み込んだ時点で検出する"""
+    carriers = plan.get("carriers", [])
+    if not carriers:
+        raise ValueError("チャンネルプランに搬送波がありません")
+    if BITS_PER_CHARACTER % len(carriers) != 0 or len(carriers) % 2 != 0:
+        # 16ビットを均等に分け、前半8ビットと後半8ビットでそれぞれパリティを確認するため
+        raise ValueError(f"搬送波の数は16の約数の偶数である必要があります: {len(carriers)}")
+    sample_rate = plan.get("sample_rate", 44100)
+    nyquist = sample_rate / 2
+    for carrier in carriers:
+        if not 0 < carrier["frequency"] < nyquist:
+            raise ValueError(f"搬送波の周波数がナイキスト周波数を超えています: {carrier['frequency']}")
+        period = carrier.get("period_samples")
+        if period is not None and (int(period) != period or period < 2
+                                   or abs(sample_rate / period - carrier["frequency"]) > 0.5):
+            raise ValueError(f"period_samples が周波数と一致しません: {carrier['frequency']}Hz, {period}")
+
+
+def bits_per_carrier(plan: Dict) -> int:
+    """1つの搬送波で1文字あたりに送るビット数"""
+    return BITS_PER_CHARACTER // len(plan["carriers"])
+
+
+def symbol_samples(frequency: float, switch_interval: int, sample_rate: int,
+                   period_samples: Optional[int] = None) -> int:
+    """1ビット (位相反転1回分) のサンプル数。pskgenerator.py と同じ計算"""
+    if period_samples:
+        return int(period_samples) * switch_interval
+    return int(sample_rate * switch_interval / frequency)
+
+
+def _carrier_timing(carrier: Dict, sample_rate: int) -> Dict:
+    """周波数とスイッチ間隔 (period_samples があれば周波数は sample_rate / period_samples)"""
+    timing = {"frequency": carrier["frequency"], "switch_interval": carrier["switch_interval"]}
+    if carrier.get("period_samples"):
+        timing["frequency"] = sample_rate / carrier["period_samples"]
+        timing["period_samples"] = int(carrier["period_samples"])
+    return timing
+
+
+def transmitter_carriers(plan: Dict) -> List[Dict]:
+    """送信側 (build_waves) 用の搬送波設定"""
+    sample_rate = plan.get("sample_rate", 44100)
+    return [_carrier_timing(c, sample_rate) for c in plan["carriers"]]
+
+
+def receiver_waves(plan: Dict) -> List[Dict]:
+    """受信側 (PSKReceiver) 用の波の設定"""
+    sample_rate = plan.get("sample_rate", 44100)
+    return [
+        {
+            **_carrier_timing(c, sample_rate),
+            "bandwidth": c.get("bandwidth", 441),
+            "initial_gain": c.get("initial_gain", DEFAULT_INITIAL_GAIN),
+            "max_gain": c.get("max_gain", DEFAULT_MAX_GAIN),
+        }
+        for c in plan["carriers"]
+    ]
@@ -0,0 +1,303 @@
+"""
+スピーカー → 部屋 → マイク の音響チャンネルシミュレータ
+
+keyboard_psk.py (送信) → detector_v3.py (受信) のE2E検証を、実機のスピーカー・マイク無しで
+再現するためのもの。以下の劣化を生成済みの音声にまとめて (ベクトル演算で) 適用する。
+
+  - 部屋のインパルス応答 (RT60から合成、または任意のRIRを指定)
+  - 帯域制限ノイズ (SNR指定)
+  - スピーカーとマイクのサンプリングクロックのずれ (ppm)
+  - ゲインのゆらぎ
+  - ランダムな開始オフセット
+
+乱数は seed で固定できるので、現場で起きた失敗を同じ条件で再現できる。
+
+使い方 (psk/ ディレクトリで実行):
+    python channel_simulator.py --text "hello world" --snr 20 --skew-ppm 50 --seed 1
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import signal
+
+from pskgenerator import generate_psk_signal_in_memory
+from psk_charcodec import CARRIERS, build_waves, char_code_to_bits
+from psk_receiver import PSKReceiver
+
+SAMPLE_RATE = 44100
+
+
+class AcousticChannel:
+    """スピーカーからマイクまでの音響経路を模擬する"""
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, rt60: float = 0.2,
+                 rir: Optional[np.ndarray] = None, direct_to_reverb_db: float = 6.0,
+                 snr_db: Optional[float] = 30.0, noise_band: Tuple[float, float] = (100.0, 8000.0),
+                 clock_skew_ppm: float = 0.0, gain_drift_depth: float = 0.0, gain_drift_rate: float = 0.5,
+                 max_start_offset: float = 0.0, level: float = 0.5, seed: Optional[int] = None):
+        """
+        :param rt60: 残響時間 (秒)。0 の場合は残響なし (rir を指定した場合は無視)
+        :param rir: 部屋のインパルス応答。指定しない場合は rt60 から合成する
+        :param direct_to_reverb_db: 直接音と残響のエネルギー比 (dB)
+        :param snr_db: 信号対雑音比 (dB)。None の場合はノイズなし
+        :param noise_band: ノイズの帯域 (Hz)
+        :param clock_skew_ppm: マイク側のサンプリングクロックのずれ (ppm)
+        :param gain_drift_depth: ゲインのゆらぎの深さ (0.1 = ±10%)
+        :param gain_drift_rate: ゲインのゆらぎの速さ (Hz)
+        :param max_start_offset: 受信開始から信号到達までのランダムな遅れの最大値 (秒)
+        :param level: マイク入力での信号レベル (int16の最大値を1.0とした振幅)
+        :param seed: 乱数のシード
+        """
+        self.sample_rate = sample_rate
+        self.snr_db = snr_db
+        self.noise_band = noise_band
+        self.clock_skew_ppm = clock_skew_ppm
+        self.gain_drift_depth = gain_drift_depth
+        self.gain_drift_rate = gain_drift_rate
+        self.max_start_offset = max_start_offset
+        self.level = level
+        self.rng = np.random.default_rng(seed)
+        self.rir = rir if rir is not None else self.synthesize_rir(rt60, direct_to_reverb_db)
+
+        nyquist = sample_rate * 0.5
+        low, high = noise_band
+        self.noise_sos = signal.butter(4, [low / nyquist, min(high / nyquist, 0.99)], btype='band', output='sos')
+
+    def synthesize_rir(self, rt60: float, direct_to_reverb_db: float) -> np.ndarray:
+        """指数減衰するノイズで部屋のインパルス応答を合成する"""
+        if rt60 <= 0:
+            return np.ones(1)
+        length = int(rt60 * self.sample_rate)
+        t = np.arange(length) / self.sample_rate
+        # RT60で60dB減衰する包絡線
+        tail = self.rng.standard_normal(length) * np.exp(-6.9 * t / rt60)
+        tail[0] = 0.0
+        tail_energy = np.sum(tail ** 2)
+        if tail_energy > 0:
+            tail *= np.sqrt(10 ** (-direct_to_reverb_db / 10) / tail_energy)
+        tail[0] = 1.0  # 直接音
+        return tail
+
+    def apply(self, audio: np.ndarray) -> Tuple[np.ndarray, int]:
+        """
+        音声全体にチャンネルの劣化を適用する
+
+        :param audio: 送信音声 (int16 または -1.0〜1.0 のfloat)
+        :return: (マイクで受信した音声 float32, 付加した開始オフセットのサンプル数)
+        """
+        if audio.dtype == np.int16:
+            audio = audio / 32767.0
+        audio = np.asarray(audio, dtype=np.float64)
+
+        # 部屋の残響
+        received = signal.oaconvolve(audio, self.rir)[:len(audio) + len(self.rir) - 1]
+
+        # 開始オフセット
+        offset = int(self.rng.integers(0, int(self.max_start_offset * self.sample_rate) + 1))
+        received = np.concatenate([np.zeros(offset), received])
+
+        # クロックのずれ: マイク側のサンプル時刻で送信側の波形を線形補間する
+        if self.clock_skew_ppm != 0:
+            ratio = 1.0 + self.clock_skew_ppm * 1e-6
+            num_samples = int(len(received) / ratio)
+            positions = np.arange(num_samples) * ratio
+            received = np.interp(positions, np.arange(len(received)), received)
+
+        # ゲインのゆらぎ
+        if self.gain_drift_depth > 0:
+            t = np.arange(len(received)) / self.sample_rate
+            phase = self.rng.uniform(0, 2 * np.pi)
+            received = received * (1.0 + self.gain_drift_depth * np.sin(2 * np.pi * self.gain_drift_rate * t + phase))
+
+        peak = np.max(np.abs(received))
+        if peak > 0:
+            received = received * (self.level / peak)
+
+        # 帯域制限ノイズ (信号が存在する区間の電力を基準にSNRを決める)
+        if self.snr_db is not None:
+            active = received[np.abs(received) > self.level * 0.05]
+            signal_power = np.mean(active ** 2) if len(active) else self.level ** 2
+            noise = signal.sosfilt(self.noise_sos, self.rng.standard_normal(len(received)))
+            noise *= np.sqrt(signal_power / 10 ** (self.snr_db / 10) / np.mean(noise ** 2))
+            received = received + noise
+
+        return np.clip(received, -1.0, 1.0).astype(np.float32), offset
+
+    @staticmethod
+    def iter_blocks(audio: np.ndarray, block_size: int) -> Iterator[np.ndarray]:
+        """受信側のコールバックと同じ大きさのブロックに分割する"""
+        for start in range(0, len(audio) - block_size + 1, block_size):
+            yield audio[start:start + block_size]
+
+
+def render_text(text: str, sample_rate: int = SAMPLE_RATE, char_interval: float = 0.25,
+                carriers: Optional[List[Dict]] = None) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+    """
+    keyboard_psk.py と同じ方法で文字列を音声にし、char_interval ごとに並べる
+
+    :return: (送信音声 int16, 各文字の (開始サンプル, 終了サンプル))
+    """
+    spacing = int(char_interval * sample_rate)
+    segments = []
+    carriers = carriers or CARRIERS
+    for character in text:
+        waves = build_waves(char_code_to_bits(ord(character), len(carriers)), carriers)
+        with contextlib.redirect_stdout(io.StringIO()):
+            segments.append(generate_psk_signal_in_memory(sample_rate, waves))
+
+    total = spacing * len(text) + max((len(s) for s in segments), default=0) + sample_rate // 2
+    audio = np.zeros(total, dtype=np.int16)
+    spans = []
+    for i, segment in enumerate(segments):
+        start = i * spacing
+        audio[start:start + len(segment)] = segment
+        spans.append((start, start + len(segment)))
+    return audio, spans
+
+
+def _char_bits(char_code: int) -> List[int]:
+    """送信される16ビット (パリティ付き8ビット x 2) をリストで返す"""
+    return [int(bit) for bit in ''.join(char_code_to_bits(char_code))]
+
+
+def simulate_session(text: str, channel: AcousticChannel, receiver: Optional[PSKReceiver] = None,
+                     block_size: int = 1024, char_interval: float = 0.25,
+                     carriers: Optional[List[Dict]] = None) -> Dict:
+    """
+    文字列を送信 → チャンネル → 受信器 の順に処理し、復号結果と性能を返す
+
+    受信器はシンボル同期を持たず、1文字の区間内で窓の位置がずれた検出を何度も返す。
+    そこで2種類の指標を返す。
+      - 理想同期 (char_accuracy, bit_error_rate): 区間内の検出のうち送信ビットに最も近いもの。
+        detector_v3.py の出力を人が読んで正しい行を選べるかどうかに相当する
+      - 最初の検出 (first_detection_accuracy): 区間内で最初にパリティが通った検出
+    """
+    receiver = receiver or PSKReceiver(sample_rate=channel.sample_rate)
+    sample_rate = channel.sample_rate
+
+    transmitted, spans = render_text(text, sample_rate, char_interval, carriers)
+    received, offset = channel.apply(transmitted)
+    skew = 1.0 + channel.clock_skew_ppm * 1e-6
+
+    # 受信側のサンプル位置に換算した各文字の開始・終了
+    rx_spans = [(int((start + offset) / skew), int((end + offset) / skew)) for start, end in spans]
+
+    detections = []  # (ブロック終了サンプル, 16ビット, 文字コード or None)
+    process_start = time.perf_counter()
+    for index, block in enumerate(channel.iter_blocks(received, block_size)):
+        result = receiver.process_block(block)
+        if result is not None:
+            detections.append(((index + 1) * block_size, result["bits"][0] + result["bits"][1], result["char_code"]))
+    process_seconds = time.perf_counter() - process_start
+
+    audio_seconds = len(received) / sample_rate
+    result = evaluate_detections(text, rx_spans, detections, len(received), sample_rate)
+    result.update({
+        "start_offset_samples": offset,
+        "audio_seconds": audio_seconds,
+        "process_seconds": process_seconds,
+        "realtime_factor": audio_seconds / process_seconds if process_seconds > 0 else float("inf"),
+    })
+    return result
+
+
+def evaluate_detections(text: str, rx_spans: List[Tuple[int, int]], detections: List[Tuple[int, List[int], Optional[int]]],
+                        total_samples: int, sample_rate: int) -> Dict:
+    """
+    受信器の検出結果を送信した文字列と照合する
+
+    :param rx_spans: 受信側のサンプル位置での各文字の (開始, 終了)
+    :param detections: (検出したブロックの終了サンプル, 16ビット, 文字コード or None) のリスト
+    :param total_samples: 受信した音声の総サンプル数
+    """
+    decoded = []
+    first_decoded = []
+    bit_errors = 0
+    false_detections = 0
+    latencies = []
+    for i, (start, end) in enumerate(rx_spans):
+        window_end = rx_spans[i + 1][0] if i + 1 < len(rx_spans) else total_samples
+        in_window = [d for d in detections if start < d[0] <= window_end]
+        expected_code = ord(text[i])
+        expected_bits = np.array(_char_bits(expected_code))
+
+        if not in_window:
+            decoded.append(None)
+            first_decoded.append(None)
+            bit_errors += len(expected_bits)
+            continue
+
+        errors = [int(np.sum(np.array(bits) != expected_bits)) for _, bits, _ in in_window]
+        best = int(np.argmin(errors))
+        bit_errors += errors[best]
+        decoded.append(chr(in_window[best][2]) if in_window[best][2] is not None else None)
+
+        parity_ok = [d for d in in_window if d[2] is not None]
+        first_decoded.append(chr(parity_ok[0][2]) if parity_ok else None)
+        false_detections += sum(1 for d in parity_ok if d[2] != expected_code)
+
+        first_correct = next((pos for pos, _, code in in_window if code == expected_code), None)
+        if first_correct is not None:
+            # 送信終了から正しい文字が最初に得られるまでの遅れ
+            latencies.append((first_correct - end) / sample_rate)
+
+    correct = sum(1 for expected, got in zip(text, decoded) if expected == got)
+    first_correct_count = sum(1 for expected, got in zip(text, first_decoded) if expected == got)
+    return {
+        "text": text,
+        "decoded": ''.join(c if c is not None else '?' for c in decoded),
+        "first_decoded": ''.join(c if c is not None else '?' for c in first_decoded),
+        "char_accuracy": correct / len(text) if text else 0.0,
+        "first_detection_accuracy": first_correct_count / len(text) if text else 0.0,
+        "bit_error_rate": bit_errors / (16 * len(text)) if text else 0.0,
+        "false_detections": false_detections,
+        "chars_per_second": correct / (total_samples / sample_rate),
+        "latency_ms": {
+            "mean": float(np.mean(latencies) * 1000) if latencies else None,
+            "max": float(np.max(latencies) * 1000) if latencies else None,
+        },
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="音響チャンネルを模擬してPSK送受信をE2Eで検証する")
+    parser.add_argument("--text", default="hello world", help="送信する文字列")
+    parser.add_argument("--snr", type=float, default=30.0, help="信号対雑音比 (dB)")
+    parser.add_argument("--rt60", type=float, default=0.2, help="残響時間 (秒)")
+    parser.add_argument("--skew-ppm", type=float, default=0.0, help="サンプリングクロックのずれ (ppm)")
+    parser.add_argument("--gain-drift", type=float, default=0.0, help="ゲインのゆらぎの深さ (0.1 = ±10%%)")
+    parser.add_argument("--max-offset", type=float, default=0.1, help="開始オフセットの最大値 (秒)")
+    parser.add_argument("--block-size", type=int, default=1024, help="受信側のブロックサイズ")
+    parser.add_argument("--char-interval", type=float, default=0.25, help="文字の送信間隔 (秒)")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--demodulator", choices=["delay", "coherent"], default="delay",
+                        help="受信器の復調方式 (遅延乗算 / 複素参照信号への射影)")
+    args = parser.parse_args(argv)
+
+    channel = AcousticChannel(
+        rt60=args.rt60, snr_db=args.snr, clock_skew_ppm=args.skew_ppm,
+        gain_drift_depth=args.gain_drift, max_start_offset=args.max_offset, seed=args.seed,
+    )
+    receiver = PSKReceiver(sample_rate=channel.sample_rate, demodulator=args.demodulator)
+    result = simulate_session(args.text, channel, receiver, block_size=args.block_size, char_interval=args.char_interval)
+
+    print(f"送信: {result['text']}")
+    print(f"受信 (理想同期): {result['decoded']}")
+    print(f"受信 (最初の検出): {result['first_decoded']}")
+    print(f"文字正解率: 理想同期 {result['char_accuracy'] * 100:.1f}% / 最初の検出 {result['first_detection_accuracy'] * 100:.1f}%")
+    print(f"ビット誤り率: {result['bit_error_rate'] * 100:.2f}%")
+    print(f"誤検出 (パリティを通過した誤り): {result['false_detections']} 回")
+    print(f"スループット: {result['chars_per_second']:.2f} 文字/秒")
+    if result["latency_ms"]["mean"] is not None:
+        print(f"復号レイテンシ: 平均 {result['latency_ms']['mean']:.1f} ms / 最大 {result['latency_ms']['max']:.1f} ms")
+    print(f"処理速度: 実時間の {result['realtime_factor']:.1f} 倍")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+psk ツールのコマンドラインの入口
+
+    python -m psk transmit                  # キーボード入力をPSKで送信 (keyboard_psk.py)
+    python -m psk receive                   # マイク入力を受信して表示 (gui/detector_v3.py)
+    python -m psk decode recording.wav      # 録音したWAVを受信器に通して文字を取り出す
+    python -m psk generate "hello" -o hello.wav
+    python -m psk bench --stage bandpass_filter
+    python -m psk serve --tcp 127.0.0.1:8765  # 複数のPCMストリームを復号するサービス (decoder_service.py)
+    python -m psk startup                   # 各サブコマンドの起動時間を計測し、予算と比べる
+
+(リポジトリのルートで実行する。psk/ ディレクトリでは python cli.py <サブコマンド> でもよい)
+
+各スクリプトは import するだけで keyboard のフックや PyAudio、matplotlib、scipy.signal を読み込むため、
+このファイルではサブコマンドを選んでから必要なモジュールだけを読み込む。
+引数の解析とヘルプの表示は標準ライブラリだけで行い、numpy も読み込まない。
+
+起動時間の予算は STARTUP_BUDGET_SECONDS。python -m psk startup で
+「python -m psk --help」と各サブコマンドのモジュールの読み込み時間を別プロセスで計測する。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+PSK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(PSK_DIR)
+SAMPLE_RATE = 44100
+
+# 短いバッチ処理やテストで毎回払うことになる起動時間の上限 (秒)
+STARTUP_BUDGET_SECONDS = 1.0
+
+# サブコマンドごとに読み込むモジュール (startup での計測用)
+COMMAND_MODULES: Dict[str, List[str]] = {
+    "transmit": ["keyboard_psk"],
+    "receive": ["detector_v3"],
+    "decode": ["psk_receiver", "scipy.io.wavfile"],
+    "generate": ["pskgenerator", "psk_charcodec"],
+    "bench": ["benchmark"],
+    "serve": ["decoder_service"],
+}
+
+# psk_receiver.SAMPLE_DTYPES の名前 (引数の解析で psk_receiver を読み込まないように、ここにも並べる)
+SAMPLE_DTYPES = ("float64", "float32", "int16")
+
+# 実機の送受信はデバイスの準備に時間がかかるので予算の対象外とする
+BUDGETED_COMMANDS = ("decode", "generate", "bench")
+
+
+def _add_module_paths() -> None:
+    """psk/ のスクリプトは同じディレクトリのモジュールを直接 import するので、検索パスに加える"""
+    for path in (PSK_DIR, os.path.join(PSK_DIR, "gui")):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def _set_backend(args: argparse.Namespace) -> None:
+    if getattr(args, "backend", None):
+        os.environ["PSK_AUDIO_BACKEND"] = args.backend
+
+
+# ---- サブコマンド ----
+
+def run_transmit(args: argparse.Namespace) -> int:
+    _set_backend(args)
+    import keyboard_psk
+    keyboard_psk.main()
+    return 0
+
+
+def run_receive(args: argparse.Namespace) -> int:
+    _set_backend(args)
+    # detector_v3 は import 時に環境変数から復調方式とサンプルの型を読んで受信器を作る
+    os.environ["PSK_DEMODULATOR"] = args.demodulator
+    os.environ["PSK_SAMPLE_DTYPE"] = args.dtype
+    import detector_v3
+    detector_v3.main()
+    return 0
+
+
+def run_decode(args: argparse.Namespace) -> int:
+    import numpy as np
+    from scipy.io import wavfile
+    from psk_receiver import SAMPLE_DTYPES, CharacterAssembler, PSKReceiver
+
+    input_dtype, dtype = SAMPLE_DTYPES[args.dtype]
+    # int16 のWAVは memmap で開き、ブロックごとに int16 のまま受信器に渡す (ファイル全体を変換しない)
+    sample_rate, audio = wavfile.read(args.wav, mmap=input_dtype == "int16")
+    if audio.ndim > 1:
+        audio = audio[:, 0]
+    if audio.dtype != np.int16 or input_dtype != "int16":
+        if audio.dtype.kind == "i":
+            audio = audio / float(np.iinfo(audio.dtype).max)
+        audio = np.asarray(audio, dtype=np.float32)
+
+    receiver = PSKReceiver(sample_rate=sample_rate, demodulator=args.demodulator, dtype=dtype)
+    # 1文字の区間内で何度も返る検出を、CharacterAssembler で1文字にまとめる
+    assembler = CharacterAssembler()
+    detections = []
+    for start in range(0, len(audio) - args.block_size + 1, args.block_size):
+        result = receiver.process_block(audio[start:start + args.block_size])
+        if args.verbose and result is not None and result["char_code"] is not None:
+            snr = " ".join(f"{value:5.1f}" for value in result["snr_db"])
+            margins = " ".join(f"{float(np.min(value)):.2f}" for value in result["margins"])
+            print(f"{(start + args.block_size) / sample_rate:8.3f} 秒: {chr(result['char_code'])!r}  "
+                  f"SNR [{snr}] dB  余裕 [{margins}]")
+        detections.append(assembler.push(result))
+    detections.append(assembler.flush())
+
+    print("".join("?" if d["char_code"] is None else chr(d["char_code"]) for d in detections if d is not None))
+    return 0
+
+
+def run_generate(args: argparse.Namespace) -> int:
+    import contextlib
+    import io
+    import numpy as np
+    from scipy.io import wavfile
+    from psk_charcodec import build_waves, char_code_to_bits
+    from pskgenerator import generate_psk_signal_in_memory
+
+    # channel_simulator.render_text と同じ並べ方 (scipy.signal を読み込まないように、ここで組み立てる)
+    spacing = int(args.char_interval * SAMPLE_RATE)
+    segments = []
+    for character in args.text:
+        waves = build_waves(char_code_to_bits(ord(character)))
+        with contextlib.redirect_stdout(io.StringIO()):
+            segments.append(generate_psk_signal_in_memory(SAMPLE_RATE, waves))
+    total = spacing * len(args.text) + max((len(s) for s in segments), default=0) + SAMPLE_RATE // 2
+    audio = np.zeros(total, dtype=np.int16)
+    for i, segment in enumerate(segments):
+        audio[i * spacing:i * spacing + len(segment)] = segment
+
+    wavfile.write(args.output, SAMPLE_RATE, audio)
+    print(f"{len(args.text)} 文字 ({total / SAMPLE_RATE:.2f} 秒) を {args.output} に保存しました")
+    return 0
+
+
+def run_bench(args: argparse.Namespace) -> int:
+    import benchmark
+    return benchmark.main(args.bench_args)
+
+
+def run_serve(args: argparse.Namespace) -> int:
+    import decoder_service
+    return decoder_service.main(["serve", *args.passthrough_args])
+
+
+def measure_startup(repeats: int = 3) -> Dict[str, float]:
+    """
+    起動時間を別プロセスで計測する (それぞれ repeats 回の最小値、秒)
+
+      - "--help": python -m psk --help の実行時間 (インタプリタの起動を含む)
+      - 各サブコマンド: そのサブコマンドが読み込むモジュールの import 時間
+    """
+    timings = {}
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "psk", "--help"], cwd=REPO_ROOT, stdout=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    timings["--help"] = best
+
+    for command, modules in COMMAND_MODULES.items():
+        code = ("import sys, time; sys.path[:0] = [%r, %r]; start = time.perf_counter(); "
+                "import %s; print(time.perf_counter() - start)"
+                % (PSK_DIR, os.path.join(PSK_DIR, "gui"), ", ".join(modules)))
+        samples = []
+        for _ in range(repeats):
+            completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+            if completed.returncode != 0:
+                break
+            samples.append(float(completed.stdout.strip().splitlines()[-1]))
+        timings[command] = min(samples) if samples else None
+    return timings
+
+
+def run_startup(args: argparse.Namespace) -> int:
+    timings = measure_startup(args.repeats)
+    over_budget = []
+    print(f"{'command':<12} {'seconds':>8}  (予算 {args.budget:.2f} 秒)")
+    for command, seconds in timings.items():
+        if seconds is None:
+            print(f"{command:<12} {'-':>8}  スキップ (依存ライブラリがありません)")
+            continue
+        budgeted = command == "--help" or command in BUDGETED_COMMANDS
+        mark = ""
+        if budgeted and seconds > args.budget:
+            over_budget.append(command)
+            mark = "  予算超過"
+        elif not budgeted:
+            mark = "  (予算の対象外)"
+        print(f"{command:<12} {seconds:>8.3f}{mark}")
+    if over_budget:
+        print(f"\n起動時間が予算を超えました: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m psk", description="PSK送受信ツール")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backends = ["pyaudio", "sounddevice", "loopback", "loopback-shm", "replay"]
+
+    transmit = subparsers.add_parser("transmit", help="キーボード入力をPSKで送信する")
+    transmit.add_argument("--backend", choices=backends, help="出力のバックエンド (PSK_AUDIO_BACKEND)")
+    transmit.set_defaults(func=run_transmit)
+
+    receive = subparsers.add_parser("receive", help="マイク入力を受信して波形とビットを表示する")
+    receive.add_argument("--backend", choices=backends, help="入力のバックエンド (PSK_AUDIO_BACKEND)")
+    receive.add_argument("--demodulator", choices=["delay", "coherent"], default="delay", help="復調方式")
+    receive.add_argument("--dtype", choices=SAMPLE_DTYPES, default="float64",
+                         help="サンプルの型 (float64: float32で受け取りfloat64で処理, int16: int16で受け取りfloat32で処理)")
+    receive.set_defaults(func=run_receive)
+
+    decode = subparsers.add_parser("decode", help="録音したWAVを受信器に通して文字を取り出す")
+    decode.add_argument("wav", help="入力のWAVファイル")
+    decode.add_argument("--demodulator", choices=["delay", "coherent"], default="delay", help="復調方式")
+    decode.add_argument("--dtype", choices=SAMPLE_DTYPES, default="float64", help="受信処理のサンプルの型")
+    decode.add_argument("--block-size", type=int, default=256,
+                        help="受信器に渡すブロックのサンプル数 (小さいほど窓の位置の候補が増える)")
+    decode.add_argument("-v", "--verbose", action="store_true", help="検出ごとの時刻と文字を表示する")
+    decode.set_defaults(func=run_decode)
+
+    generate = subparsers.add_parser("generate", help="文字列をPSKの音声にしてWAVに保存する")
+    generate.add_argument("text", help="送信する文字列")
+    generate.add_argument("-o", "--output", default="psk_output.wav", help="出力のWAVファイル")
+    generate.add_argument("--char-interval", type=float, default=0.25, help="文字の送信間隔 (秒)")
+    generate.set_defaults(func=run_generate)
+
+    # bench の引数 (--stage など) は解析せずに benchmark.py へそのまま渡す (main を参照)
+    bench = subparsers.add_parser("bench", help="性能回帰ベンチマーク (benchmark.py の引数をそのまま渡す)",
+                                  add_help=False)
+    bench.set_defaults(func=run_bench)
+
+    serve = subparsers.add_parser("serve", help="PCMストリームを復号するサービス (decoder_service.py serve の引数をそのまま渡す)",
+                                  add_help=False)
+    serve.set_defaults(func=run_serve)
+
+    startup = subparsers.add_parser("startup", help="各サブコマンドの起動時間を計測する")
+    startup.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS, help="起動時間の予算 (秒)")
+    startup.add_argument("--repeats", type=int, default=3, help="計測回数 (最小値を使う)")
+    startup.set_defaults(func=run_startup)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "bench":
+        args.bench_args = extra
+    elif args.command == "serve":
+        args.passthrough_args = extra
+    elif extra:
+        parser.error(f"不明な引数です: {' '.join(extra)}")
+    _add_module_paths()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+コヒーレント (複素参照信号への射影) によるPSK復調
+
+archive/pskdetector.py の PSKDetector.detect_phase_shift は区間ごとに全帯域のFFTを計算し、
+fftfreq と argmin で搬送波のビンを探して位相を読んでいた。実際に必要なのは搬送波の周波数1点だけなので、
+ここでは各区間を搬送波の複素参照信号 exp(-j w m) (m = 区間内のサンプル番号) に射影する (1点のDFT)。
+
+  - 全搬送波 x 全区間の射影を、(搬送波, 区間, サンプル) と (搬送波, サンプル, 1) のバッチ行列積1回で計算する
+  - 隣り合う区間の射影 P_k と P_{k-1} の積 P_k * conj(P_{k-1}) の実部が、遅延乗算の区間和に相当する
+    (区間の長さが搬送波の周期の整数倍でない場合に回る位相 exp(j w L) は参照側で打ち消す)
+  - 和は遅延乗算 (psk_receiver.detect_sums) と同じ大きさになるように 8 / L を掛ける
+    (振幅 A の正弦波で、どちらも 2 * A^2 * L になる)
+
+遅延乗算と同じ形式の和を返すので、ビット判定 (detect_bits) や表示はそのまま使える。
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+
+def carrier_reference(frequency: float, length: int, sample_rate: int) -> np.ndarray:
+    """1区間分の複素参照信号 exp(-j 2 pi f m / fs) (m = 0 .. length-1)"""
+    m = np.arange(length)
+    return np.exp(-2j * np.pi * frequency * m / sample_rate)
+
+
+def differential_sums(projections: np.ndarray, frequency: float, length: int, sample_rate: int) -> np.ndarray:
+    """
+    区間ごとの射影から、隣り合う区間の位相の一致度 (遅延乗算の区間和に相当) を求める
+
+    Args:
+        projections: (..., 区間数) の複素数。各区間の先頭を基準にした射影
+        length: 1区間のサンプル数
+
+    Returns:
+        np.ndarray: (..., 区間数 - 1) の実数。同じ位相なら正、反転していれば負
+    """
+    # 区間の先頭は length サンプルずつずれるので、定常な搬送波でも位相が w * length 進む
+    rotation = np.exp(-2j * np.pi * frequency * length / sample_rate)
+    products = projections[..., 1:] * np.conj(projections[..., :-1]) * rotation
+    return products.real * (8.0 / length)
+
+
+class CoherentDemodulator:
+    """
+    PSKReceiver 用のコヒーレント復調器
+
+    搬送波ごとに区間の長さが違うので、最も長い区間に合わせてゼロ詰めした
+    (搬送波, 区間, サンプル) のバッファを事前に確保し、ブロックごとにバッチ行列積1回で射影する。
+    """
+
+    def __init__(self, frequencies: List[float], delay_samples: List[int], num_intervals: int,
+                 sample_rate: int, dtype=np.float64):
+        """
+        :param frequencies: 搬送波の周波数
+        :param delay_samples: 搬送波ごとの1区間 (1ビット) のサンプル数
+        :param num_intervals: 判定する区間数 (位相の基準となる先頭の1区間を含む)
+        :param dtype: 信号の型 (np.float32 の場合は参照信号も complex64 にする)
+        """
+        self.frequencies = list(frequencies)
+        self.delay_samples = list(delay_samples)
+        self.num_intervals = num_intervals
+        self.sample_rate = sample_rate
+
+        # 区間の和 (num_intervals 個) には、その手前の区間も含めて num_intervals + 1 区間の射影が必要
+        self.num_projections = num_intervals + 1
+        self.window_sizes = [delay * self.num_projections for delay in self.delay_samples]
+        max_length = max(self.delay_samples)
+        self.windows = np.zeros((len(self.frequencies), self.num_projections, max_length), dtype=dtype)
+        self.references = np.zeros((len(self.frequencies), max_length, 1), dtype=np.result_type(dtype, np.complex64))
+        for i, (frequency, length) in enumerate(zip(self.frequencies, self.delay_samples)):
+            self.references[i, :length, 0] = carrier_reference(frequency, length, sample_rate)
+
+    def process(self, signals: List[np.ndarray]) -> Tuple[List[np.ndarray], List[float]]:
+        """
+        搬送波ごとのフィルタ後の信号 (末尾が最新) から、区間ごとの和と信号の強さを求める
+
+        Returns:
+            (sums, levels): sums は搬送波ごとの長さ num_intervals の和 (遅延乗算と同じ形式)、
+            levels は信号の強さ (遅延乗算の mean(|乗算結果|) に相当し、DETECT_THRESHOLD と比べられる)
+        """
+        for i, length in enumerate(self.delay_samples):
+            window = signals[i][-self.window_sizes[i]:]
+            self.windows[i, :, :length] = window.reshape(self.num_projections, length)
+
+        projections = np.matmul(self.windows, self.references)[..., 0]  # (搬送波, 区間)
+        # 信号の強さは遅延乗算の mean(|4 x[n] x[n-L]|) と同じく、位相に関係なく雑音も含めた 4 * mean(x^2) とする
+        # (振幅 A の正弦波でどちらも 2 * A^2)
+        energies = np.einsum("ckl,ckl->c", self.windows[:, 1:], self.windows[:, 1:])
+
+        sums = []
+        levels = []
+        for i, (frequency, length) in enumerate(zip(self.frequencies, self.delay_samples)):
+            sums.append(differential_sums(projections[i], frequency, length, self.sample_rate))
+            levels.append(4.0 * float(energies[i]) / (self.num_intervals * length))
+        return sums, levels
+
+
+def interval_sums(audio: np.ndarray, sample_rate: int, frequency: float, switch_interval: int) -> np.ndarray:
+    """
+    録音全体を1ビットの区間に分け、区間ごとの射影から隣り合う区間の和を求める (pskdetector_pureData.py 用)
+
+    Returns:
+        np.ndarray: 長さ (区間数 - 1) の和。k 番目は区間 k+1 と区間 k の位相の一致度
+    """
+    length = int(sample_rate * switch_interval / frequency)
+    count = len(audio) // length
+    intervals = np.asarray(audio[:count * length], dtype=np.float64).reshape(count, length)
+    projections = intervals @ carrier_reference(frequency, length, sample_rate)
+    return differential_sums(projections, frequency, length, sample_rate)
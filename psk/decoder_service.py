@@ -0,0 +1,463 @@
+"""
+複数の音声ストリームを1つのサーバーで復号するサービス (asyncio + プロセスプール)
+
+detector_v3.py は1つのプロセスが1つのサウンドカードを受け持つ。ここでは複数の収録地点から
+PCMをTCPまたはUnixソケットで受け取り、復号した文字と計測値をそれぞれのクライアントに返す。
+
+プロトコル (1接続 = 1ストリーム、モノラル):
+    クライアント → サーバー: 1行のJSONヘッダ、続けてPCMのバイト列 (送信側を閉じると終わり)
+        {"sample_rate": 44100, "dtype": "int16", "plan": {...}, "demodulator": "delay", "block_size": 1024}
+        dtype は "int16" または "float32" (リトルエンディアン)。plan は channel_plan.json と同じ形式 (省略時は既定のプラン)
+    サーバー → クライアント: 1行1イベントのJSON
+        {"type": "ready", "stream": 3, "shard": 1}
+        {"type": "char", "char": "h", "time": 1.234, "snr_db": [...], "margins": [...]}
+        {"type": "metrics", "audio_seconds": ..., "realtime_factor": ..., "queued_chunks": ..., "receiver": {...}}
+        {"type": "end", "text": "hello", "audio_seconds": ..., "realtime_factor": ...}
+        {"type": "error", "message": "..."}
+
+処理の分担:
+  - 受信処理 (PSKReceiver) はストリームごとに状態を持つので、各ストリームを1つのシャード
+    (ワーカー1つのプロセスプール) に固定し、ストリームの状態はそのプロセスの中に置く。
+    シャードの数だけCPUコアを使って並列に復号する。新しいストリームは担当の少ないシャードに割り当てる。
+  - イベントループはソケットの読み書きとシャードへの受け渡しだけを行う。
+
+背圧 (クライアントが実時間より速く、または復号より速く送ってくる場合):
+  ストリームごとに受信したチャンクを長さ queue_chunks のキューに入れ、キューが一杯の間はソケットから読まない。
+  するとカーネルの受信バッファが埋まり、TCPのフロー制御でクライアントの送信が止まる。
+  キューで待った回数は metrics と end イベントの backpressure_waits で分かる。
+
+使い方 (psk/ ディレクトリで実行):
+    python decoder_service.py serve --tcp 127.0.0.1:8765 --unix /tmp/psk_decoder.sock --shards 4
+    python decoder_service.py send hello.wav --tcp 127.0.0.1:8765               # 1ストリーム送って結果を表示
+    python decoder_service.py send hello.wav --tcp 127.0.0.1:8765 --streams 8   # 8ストリーム同時 (スループットの計測)
+    python decoder_service.py send hello.wav --unix /tmp/psk_decoder.sock --realtime
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+PSK_DIR = os.path.dirname(os.path.abspath(__file__))
+if PSK_DIR not in sys.path:
+    sys.path.insert(0, PSK_DIR)
+
+STREAM_DTYPES = ("int16", "float32")
+DEFAULT_BLOCK_SIZE = 512  # python -m psk decode の 256 より粗いが、文字の取り出しには十分で処理は半分
+DEFAULT_CHUNK_FRAMES = 8192  # 1回にソケットから読むフレーム数
+DEFAULT_QUEUE_CHUNKS = 4     # ストリームごとにためるチャンク数 (これを超えるとソケットから読まない)
+DEFAULT_METRICS_INTERVAL = 1.0  # 音声の何秒ごとに metrics を返すか
+
+
+# ---- シャードのプロセスの中で動く部分 ----
+
+class StreamDecoder:
+    """1ストリーム分の受信器と、ブロックに満たない残りのサンプル"""
+
+    def __init__(self, header: Dict, metrics_interval: float):
+        from channel_plan import receiver_waves, validate_channel_plan
+        from psk_receiver import WAVES, CharacterAssembler, PSKReceiver
+        from receiver_metrics import ReceiverMetrics
+
+        self.sample_rate = int(header["sample_rate"])
+        self.dtype = np.dtype(header.get("dtype", "int16")).newbyteorder("<")
+        self.block_size = int(header.get("block_size", DEFAULT_BLOCK_SIZE))
+        if self.block_size <= 0:
+            raise ValueError(f"block_size は正の整数にしてください: {self.block_size}")
+        waves = WAVES
+        if header.get("plan") is not None:
+            validate_channel_plan(header["plan"])
+            waves = receiver_waves(header["plan"])
+        self.metrics = ReceiverMetrics([wave["frequency"] for wave in waves], self.sample_rate)
+        self.receiver = PSKReceiver(waves, self.sample_rate, demodulator=header.get("demodulator", "delay"),
+                                    metrics=self.metrics, dtype=np.float32)
+        self.assembler = CharacterAssembler(self.metrics)
+        self.pending = np.zeros(0, dtype=self.dtype)
+        self.position = 0  # 処理したサンプル数
+        self.process_seconds = 0.0
+        self.metrics_interval = int(metrics_interval * self.sample_rate)
+        self.next_metrics = self.metrics_interval
+        self.text: List[str] = []
+
+    def feed(self, payload: bytes) -> List[Dict]:
+        """PCMのバイト列 (フレーム単位にそろっている) を処理し、イベントのリストを返す"""
+        samples = np.frombuffer(payload, dtype=self.dtype)
+        if len(self.pending):
+            samples = np.concatenate((self.pending, samples))
+        events = []
+        consumed = 0
+        block_size = self.block_size
+        while consumed + block_size <= len(samples):
+            start = time.perf_counter()
+            result = self.receiver.process_block(samples[consumed:consumed + block_size])
+            elapsed = time.perf_counter() - start
+            self.metrics.record_callback(elapsed, block_size)
+            self.process_seconds += elapsed
+            consumed += block_size
+            self.position += block_size
+            self._emit(self.assembler.push(result), events)
+            if self.position >= self.next_metrics:
+                self.next_metrics += self.metrics_interval
+                events.append({"type": "metrics", **self._progress(), "receiver": self.metrics.snapshot()})
+        self.pending = samples[consumed:].copy()
+        return events
+
+    def finish(self) -> List[Dict]:
+        """入力の終わり: 途中の文字を確定して end イベントを返す"""
+        events = []
+        self._emit(self.assembler.flush(), events)
+        events.append({"type": "end", "text": "".join(self.text), **self._progress(),
+                       "receiver": self.metrics.snapshot()})
+        return events
+
+    def _emit(self, detection: Optional[Dict], events: List[Dict]) -> None:
+        if detection is None:
+            return
+        character = "?" if detection["char_code"] is None else chr(detection["char_code"])
+        self.text.append(character)
+        events.append({
+            "type": "char",
+            "char": character,
+            "time": self.position / self.sample_rate,
+            "snr_db": [float(value) for value in detection["snr_db"]],
+            "margins": [float(np.min(margins)) for margins in detection["margins"]],
+        })
+
+    def _progress(self) -> Dict:
+        audio_seconds = self.position / self.sample_rate
+        return {
+            "audio_seconds": audio_seconds,
+            "process_seconds": self.process_seconds,
+            "realtime_factor": audio_seconds / self.process_seconds if self.process_seconds > 0 else None,
+        }
+
+
+_streams: Dict[int, StreamDecoder] = {}
+
+
+def open_stream(stream_id: int, header: Dict, metrics_interval: float) -> None:
+    _streams[stream_id] = StreamDecoder(header, metrics_interval)
+
+
+def feed_stream(stream_id: int, payload: bytes) -> List[Dict]:
+    return _streams[stream_id].feed(payload)
+
+
+def close_stream(stream_id: int) -> List[Dict]:
+    return _streams.pop(stream_id).finish()
+
+
+def discard_stream(stream_id: int) -> None:
+    """クライアントが途中で切断した場合などに、結果を返さずに状態を捨てる"""
+    _streams.pop(stream_id, None)
+
+
+def _warm_up() -> None:
+    """scipy.signal などの読み込みを、最初のストリームが来る前に済ませておく"""
+    import psk_receiver  # noqa: F401
+
+
+# ---- イベントループ側 ----
+
+async def _close_writer(writer: asyncio.StreamWriter) -> None:
+    """接続を閉じ、閉じ終わるまで待つ (相手が先に切断していた場合のエラーは無視する)"""
+    writer.close()
+    with contextlib.suppress(ConnectionError):
+        await writer.wait_closed()
+
+
+class Shard:
+    """ワーカー1つのプロセスプール (担当するストリームの状態はこのプロセスの中にある)"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.executor = ProcessPoolExecutor(max_workers=1, initializer=_warm_up)
+        self.streams = 0
+
+
+class DecoderService:
+    """PCMストリームを受け付けて、シャードで復号した結果を返すサーバー"""
+
+    def __init__(self, shards: int = 0, chunk_frames: int = DEFAULT_CHUNK_FRAMES,
+                 queue_chunks: int = DEFAULT_QUEUE_CHUNKS, metrics_interval: float = DEFAULT_METRICS_INTERVAL):
+        """
+        :param shards: シャード (ワーカープロセス) の数。0 の場合はCPUコア数
+        :param chunk_frames: 1回にソケットから読むフレーム数
+        :param queue_chunks: ストリームごとにためるチャンク数 (背圧をかけ始める量)
+        :param metrics_interval: 音声の何秒ごとに metrics イベントを返すか
+        """
+        self.shards = [Shard(i) for i in range(shards or os.cpu_count() or 1)]
+        self.chunk_frames = chunk_frames
+        self.queue_chunks = queue_chunks
+        self.metrics_interval = metrics_interval
+        self.stream_ids = itertools.count(1)
+        self.servers: List[asyncio.AbstractServer] = []
+
+    async def start(self, tcp: Optional[Tuple[str, int]] = None, unix_path: Optional[str] = None) -> None:
+        # シャードのプロセスは接続を受け付ける前に起動しておく。最初のストリームで起動すると、
+        # fork したプロセスがその時点で開いている接続のソケットを引き継ぎ、切断 (FIN / RST) が相手に届かなくなる
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(shard.executor, _warm_up) for shard in self.shards))
+        if tcp is not None:
+            self.servers.append(await asyncio.start_server(self.handle, tcp[0], tcp[1]))
+        if unix_path is not None:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            self.servers.append(await asyncio.start_unix_server(self.handle, unix_path))
+
+    async def serve_forever(self) -> None:
+        await asyncio.gather(*(server.serve_forever() for server in self.servers))
+
+    def close(self) -> None:
+        for server in self.servers:
+            server.close()
+        for shard in self.shards:
+            shard.executor.shutdown(cancel_futures=True)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """1接続 (1ストリーム) を処理する"""
+        loop = asyncio.get_running_loop()
+        try:
+            header = json.loads(await reader.readline())
+            if not isinstance(header, dict):
+                raise ValueError("ヘッダは JSON のオブジェクトにしてください")
+            if "sample_rate" not in header:
+                raise ValueError("ヘッダに sample_rate がありません")
+            if header.get("dtype", "int16") not in STREAM_DTYPES:
+                raise ValueError(f"未対応の dtype です: {header.get('dtype')} (int16 または float32)")
+            if int(header.get("block_size", DEFAULT_BLOCK_SIZE)) <= 0:
+                raise ValueError(f"block_size は正の整数にしてください: {header['block_size']}")
+        except (ValueError, TypeError, UnicodeDecodeError) as e:
+            await self._send(writer, [{"type": "error", "message": f"ヘッダが不正です: {e}"}])
+            await _close_writer(writer)
+            return
+
+        shard = min(self.shards, key=lambda s: s.streams)
+        shard.streams += 1
+        stream_id = next(self.stream_ids)
+        try:
+            try:
+                await loop.run_in_executor(shard.executor, open_stream, stream_id, header, self.metrics_interval)
+            except (ValueError, KeyError, TypeError) as e:
+                await self._send(writer, [{"type": "error", "message": f"ストリームを開けません: {e}"}])
+                return
+            await self._send(writer, [{"type": "ready", "stream": stream_id, "shard": shard.index}])
+            await self._decode(reader, writer, shard, stream_id, np.dtype(header.get("dtype", "int16")).itemsize)
+        except ConnectionError:
+            # クライアントが途中で切断した場合は、ストリームの状態だけ片付ける
+            await loop.run_in_executor(shard.executor, discard_stream, stream_id)
+        except Exception as e:
+            # 復号中のエラーはそのストリームだけを終わらせ、サーバーは動かし続ける
+            await loop.run_in_executor(shard.executor, discard_stream, stream_id)
+            with contextlib.suppress(ConnectionError):
+                await self._send(writer, [{"type": "error", "message": f"{type(e).__name__}: {e}"}])
+        finally:
+            shard.streams -= 1
+            await _close_writer(writer)
+
+    async def _decode(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                      shard: Shard, stream_id: int, itemsize: int) -> None:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(self.queue_chunks)
+        stats = {"backpressure_waits": 0}
+        errors: List[Exception] = []
+
+        async def receive():
+            # キューが一杯の間は読まない (TCPのフロー制御でクライアントの送信が止まる)
+            remainder = b""
+            try:
+                while True:
+                    chunk = await reader.read(self.chunk_frames * itemsize)
+                    if not chunk:
+                        break
+                    data = remainder + chunk
+                    usable = len(data) - len(data) % itemsize
+                    remainder = data[usable:]
+                    if queue.full():
+                        stats["backpressure_waits"] += 1
+                    await queue.put(data[:usable])
+            except Exception as e:
+                # 読み出しのエラー (接続のリセットなど) も終端を積んで知らせ、下のループで送出する
+                errors.append(e)
+            await queue.put(None)
+
+        receiver_task = asyncio.ensure_future(receive())
+        try:
+            while True:
+                payload = await queue.get()
+                if payload is None:
+                    if errors:
+                        raise errors[0]
+                    break
+                events = await loop.run_in_executor(shard.executor, feed_stream, stream_id, payload)
+                for event in events:
+                    if event["type"] == "metrics":
+                        event.update(queued_chunks=queue.qsize(), **stats)
+                await self._send(writer, events)
+            events = await loop.run_in_executor(shard.executor, close_stream, stream_id)
+            events[-1].update(stats)
+            await self._send(writer, events)
+        finally:
+            receiver_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await receiver_task
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, events: List[Dict]) -> None:
+        if not events:
+            return
+        writer.write(b"".join(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n" for event in events))
+        await writer.drain()  # クライアントが結果を読まない場合も、ここで待つ
+
+
+# ---- クライアント ----
+
+async def _connect(tcp: Optional[Tuple[str, int]], unix_path: Optional[str]):
+    if unix_path is not None:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(tcp[0], tcp[1])
+
+
+async def send_audio(audio: np.ndarray, sample_rate: int, tcp: Optional[Tuple[str, int]] = None,
+                     unix_path: Optional[str] = None, realtime: bool = False, chunk_frames: int = 1024,
+                     on_event=None, block_size: int = DEFAULT_BLOCK_SIZE) -> Dict:
+    """
+    1ストリーム分の音声 (int16 または float32) を送り、end イベントを返す
+
+    :param realtime: True の場合は実時間の速さで送る (False の場合はできるだけ速く送る)
+    :param on_event: イベントごとに呼ぶ関数 (ready / char / metrics / end / error)
+    :param block_size: 受信器に渡すブロックのサンプル数 (小さいほど窓の位置の候補が増えるが、処理は重くなる)
+    """
+    reader, writer = await _connect(tcp, unix_path)
+    header = {"sample_rate": sample_rate, "dtype": audio.dtype.name, "block_size": block_size}
+    writer.write(json.dumps(header).encode("utf-8") + b"\n")
+    data = np.ascontiguousarray(audio, dtype=audio.dtype.newbyteorder("<"))
+
+    async def send():
+        start = time.perf_counter()
+        for position in range(0, len(data), chunk_frames):
+            writer.write(data[position:position + chunk_frames].tobytes())
+            await writer.drain()  # サーバーが背圧をかけている間はここで止まる
+            if realtime:
+                delay = start + (position + chunk_frames) / sample_rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        writer.write_eof()
+
+    sender = asyncio.ensure_future(send())
+    end = {"type": "error", "message": "サーバーが end を返さずに切断しました"}
+    try:
+        async for line in reader:
+            event = json.loads(line)
+            if on_event is not None:
+                on_event(event)
+            if event["type"] in ("end", "error"):
+                end = event
+                break
+    finally:
+        sender.cancel()
+        await _close_writer(writer)
+    return end
+
+
+def _read_wav(path: str) -> Tuple[int, np.ndarray]:
+    from scipy.io import wavfile
+
+    sample_rate, audio = wavfile.read(path)
+    if audio.ndim > 1:
+        audio = audio[:, 0]
+    if audio.dtype not in (np.int16, np.float32):
+        audio = audio.astype(np.float32) / float(np.iinfo(audio.dtype).max) if audio.dtype.kind == "i" \
+            else audio.astype(np.float32)
+    return sample_rate, audio
+
+
+def _parse_tcp(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    if value is None:
+        return None
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+async def _run_send(args: argparse.Namespace) -> int:
+    sample_rate, audio = _read_wav(args.wav)
+    tcp, unix_path = _parse_tcp(args.tcp), args.unix
+
+    def show(event):
+        # 複数ストリームのときは最後のまとめだけを表示する
+        if args.verbose:
+            print(json.dumps(event, ensure_ascii=False))
+        elif args.streams == 1 and event["type"] == "char":
+            print(f"{event['time']:8.3f} 秒: {event['char']!r}")
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(send_audio(audio, sample_rate, tcp, unix_path, args.realtime, on_event=show,
+                                                block_size=args.block_size)
+                                     for _ in range(args.streams)))
+    elapsed = time.perf_counter() - start
+
+    failed = [result for result in results if result["type"] != "end"]
+    for result in failed:
+        print(f"エラー: {result['message']}")
+    audio_seconds = sum(result.get("audio_seconds", 0.0) for result in results)
+    for i, result in enumerate(results):
+        if result["type"] == "end":
+            print(f"ストリーム {i + 1}: {result['text']!r}  (背圧で待った回数 {result['backpressure_waits']})")
+    print(f"{args.streams} ストリーム, 音声 {audio_seconds:.1f} 秒を {elapsed:.2f} 秒で復号 "
+          f"(実時間の {audio_seconds / elapsed:.1f} 倍)")
+    return 1 if failed else 0
+
+
+async def _run_serve(args: argparse.Namespace) -> int:
+    service = DecoderService(args.shards, args.chunk_frames, args.queue_chunks, args.metrics_interval)
+    await service.start(_parse_tcp(args.tcp), args.unix)
+    addresses = [address for address in (args.tcp, args.unix) if address]
+    print(f"復号サービスを開始しました: {', '.join(addresses)} (シャード {len(service.shards)})")
+    try:
+        await service.serve_forever()
+    finally:
+        service.close()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="複数のPCMストリームを復号するサービス")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="サーバーを起動する")
+    serve.add_argument("--tcp", help="待ち受けるアドレス (ホスト:ポート)")
+    serve.add_argument("--unix", help="待ち受けるUnixソケットのパス")
+    serve.add_argument("--shards", type=int, default=0, help="ワーカープロセスの数 (既定: CPUコア数)")
+    serve.add_argument("--chunk-frames", type=int, default=DEFAULT_CHUNK_FRAMES, help="1回に読むフレーム数")
+    serve.add_argument("--queue-chunks", type=int, default=DEFAULT_QUEUE_CHUNKS,
+                       help="ストリームごとにためるチャンク数 (超えると背圧をかける)")
+    serve.add_argument("--metrics-interval", type=float, default=DEFAULT_METRICS_INTERVAL,
+                       help="metrics を返す間隔 (音声の秒数)")
+
+    send = subparsers.add_parser("send", help="WAVファイルをストリームとして送り、復号結果を表示する")
+    send.add_argument("wav", help="送信するWAVファイル (int16 または float32)")
+    send.add_argument("--tcp", help="接続先 (ホスト:ポート)")
+    send.add_argument("--unix", help="接続先のUnixソケットのパス")
+    send.add_argument("--streams", type=int, default=1, help="同時に送るストリーム数")
+    send.add_argument("--realtime", action="store_true", help="実時間の速さで送る")
+    send.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="受信器に渡すブロックのサンプル数")
+    send.add_argument("-v", "--verbose", action="store_true", help="すべてのイベントを表示する")
+
+    args = parser.parse_args(argv)
+    if not args.tcp and not args.unix:
+        parser.error("--tcp または --unix を指定してください")
+    try:
+        return asyncio.run(_run_serve(args) if args.command == "serve" else _run_send(args))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+連続位相のFSK/MFSK変調と、非コヒーレント (トーンのエネルギー比較) 復調
+
+generate.py はビットごとに t の配列で np.sin を計算してリストに継ぎ足していたため、
+ビットの境界で位相が飛び (クリック音が可聴帯域まで広がる)、復調器もなかった。ここでは
+
+  - FSKModulator: シンボルごとの周波数を np.repeat でサンプル単位に展開し、位相を cumsum で積分する。
+                  位相はブロックをまたいで引き継ぐので、境界で波形がつながる (連続位相)
+  - FSKDemodulator: シンボル区間を (区間数, サンプル) に並べ、各トーンの複素参照信号との行列積1回で
+                    全区間 x 全トーンのエネルギーを求め、最大のトーンをシンボルとする。push() でブロックごとに処理できる
+  - find_symbol_offset: 累積和によるスライディングDFTで全サンプル位置のトーンのエネルギーを求め、
+                        シンボルの区切り位置を推定する
+
+トーンの間隔は 1 / シンボル長 (Hz) の整数倍にする (非コヒーレント検波で互いに直交する最小の間隔)。
+既定では 18kHz から上の超音波帯域を使うので、PSKの搬送波 (2〜4.4kHz) とは重ならない。
+
+使い方 (psk/ ディレクトリで実行):
+    python fsk/fsk_modem.py --tones 4 --symbol-ms 10 --snr 20
+    python fsk/fsk_modem.py --tones 8 --symbol-ms 5 --with-psk   # 可聴帯域のPSKと同時に流す
+"""
+import argparse
+import os
+import sys
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+DEFAULT_BASE_FREQUENCY = 18000.0
+
+
+def tone_frequencies(num_tones: int, symbol_samples: int, sample_rate: int = SAMPLE_RATE,
+                     base_frequency: float = DEFAULT_BASE_FREQUENCY, spacing_bins: int = 1) -> np.ndarray:
+    """
+    互いに直交するトーンの周波数
+
+    :param spacing_bins: トーンの間隔 (sample_rate / symbol_samples の何倍か)
+    """
+    spacing = spacing_bins * sample_rate / symbol_samples
+    frequencies = base_frequency + spacing * np.arange(num_tones)
+    if frequencies[-1] >= sample_rate / 2:
+        raise ValueError(f"最も高いトーン ({frequencies[-1]:.0f}Hz) がナイキスト周波数 ({sample_rate / 2:.0f}Hz) を超えます")
+    return frequencies
+
+
+def bits_per_symbol(num_tones: int) -> int:
+    """1シンボルで送れるビット数 (トーン数は2のべき乗)"""
+    bits = int(num_tones).bit_length() - 1
+    if bits < 1 or 1 << bits != num_tones:
+        raise ValueError(f"トーン数は2以上の2のべき乗にしてください: {num_tones}")
+    return bits
+
+
+def bits_to_symbols(bits: str, num_tones: int) -> np.ndarray:
+    """'0101...' をシンボル番号の配列にする (足りないビットは0で埋める)"""
+    width = bits_per_symbol(num_tones)
+    values = np.frombuffer(bits.encode("ascii"), dtype=np.uint8) - ord("0")
+    values = np.concatenate([values, np.zeros(-len(values) % width, dtype=np.uint8)]).reshape(-1, width)
+    weights = 1 << np.arange(width - 1, -1, -1)
+    return values @ weights
+
+
+def symbols_to_bits(symbols: np.ndarray, num_tones: int) -> str:
+    """シンボル番号の配列を '0101...' にする"""
+    width = bits_per_symbol(num_tones)
+    symbols = np.asarray(symbols, dtype=np.int64)
+    values = (symbols[:, None] >> np.arange(width - 1, -1, -1)) & 1
+    return (values.reshape(-1).astype(np.uint8) + ord("0")).tobytes().decode("ascii")
+
+
+class FSKModulator:
+    """連続位相のMFSK変調器"""
+
+    def __init__(self, frequencies: Sequence[float], symbol_samples: int, sample_rate: int = SAMPLE_RATE,
+                 amplitude: float = 0.5):
+        """
+        :param frequencies: シンボル番号ごとのトーンの周波数
+        :param symbol_samples: 1シンボルのサンプル数
+        :param amplitude: 振幅 (-1〜1 の float に対して)
+        """
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self.symbol_samples = symbol_samples
+        self.sample_rate = sample_rate
+        self.amplitude = amplitude
+        self.phase = 0.0  # 次のサンプルの位相 (ブロックをまたいで引き継ぐ)
+
+    def modulate(self, symbols: Sequence[int]) -> np.ndarray:
+        """シンボル列を float32 の波形にする (続けて呼ぶと前のブロックと位相がつながる)"""
+        symbols = np.asarray(symbols, dtype=np.intp)
+        if len(symbols) == 0:
+            return np.zeros(0, dtype=np.float32)
+        steps = np.repeat(2 * np.pi * self.frequencies[symbols] / self.sample_rate, self.symbol_samples)
+        phase = np.cumsum(steps)
+        phase -= steps  # 各サンプルの位相は、そのサンプルまでの増分の和
+        phase += self.phase
+        self.phase = float((phase[-1] + steps[-1]) % (2 * np.pi))
+        return (self.amplitude * np.sin(phase)).astype(np.float32)
+
+    def reset(self) -> None:
+        self.phase = 0.0
+
+
+def apply_fade(audio: np.ndarray, fade_samples: int) -> np.ndarray:
+    """バーストの先頭と末尾に半コサインのフェードをかける (送信開始・終了時のクリック音を抑える)"""
+    fade_samples = min(fade_samples, len(audio) // 2)
+    if fade_samples <= 0:
+        return audio
+    ramp = (0.5 - 0.5 * np.cos(np.pi * np.arange(fade_samples) / fade_samples)).astype(audio.dtype)
+    audio = audio.copy()
+    audio[:fade_samples] *= ramp
+    audio[-fade_samples:] *= ramp[::-1]
+    return audio
+
+
+def modulate_bits(bits: str, frequencies: Sequence[float], symbol_samples: int, sample_rate: int = SAMPLE_RATE,
+                  amplitude: float = 0.5, fade_seconds: float = 0.002) -> np.ndarray:
+    """ビット列を1つのバースト (float32) にする"""
+    modulator = FSKModulator(frequencies, symbol_samples, sample_rate, amplitude)
+    audio = modulator.modulate(bits_to_symbols(bits, len(frequencies)))
+    return apply_fade(audio, int(fade_seconds * sample_rate))
+
+
+class FSKDemodulator:
+    """
+    非コヒーレントのMFSK復調器
+
+    各シンボル区間を全トーンの複素参照信号に射影し (1点のDFTを行列積でまとめて計算)、
+    エネルギーが最大のトーンをシンボルとする。位相は見ないので、送信側と位相や区間の先頭をそろえる必要はない。
+    """
+
+    def __init__(self, frequencies: Sequence[float], symbol_samples: int, sample_rate: int = SAMPLE_RATE,
+                 offset: int = 0):
+        """
+        :param offset: ストリームの先頭から最初のシンボルの先頭までのサンプル数 (push 用)
+        """
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self.symbol_samples = symbol_samples
+        self.sample_rate = sample_rate
+        m = np.arange(symbol_samples)
+        self.references = np.exp(-2j * np.pi * np.outer(m, self.frequencies) / sample_rate)  # (サンプル, トーン)
+        self.skip = offset
+        self.pending = np.zeros(0, dtype=np.float64)  # シンボル1つに満たない残り
+
+    def tone_energies(self, audio: np.ndarray) -> np.ndarray:
+        """
+        先頭から symbol_samples ごとに区切った各区間のトーンのエネルギー
+
+        Returns:
+            np.ndarray: (区間数, トーン数)。振幅 A の正弦波のトーンで A^2 になるように正規化
+        """
+        count = len(audio) // self.symbol_samples
+        windows = np.asarray(audio[:count * self.symbol_samples], dtype=np.float64).reshape(count, self.symbol_samples)
+        projections = windows @ self.references
+        return np.abs(projections) ** 2 * (4.0 / self.symbol_samples ** 2)
+
+    def decide(self, energies: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(区間, トーン) のエネルギーから (シンボル, 区間ごとの信号の強さ) を求める"""
+        return np.argmax(energies, axis=1), np.max(energies, axis=1)
+
+    def demodulate(self, audio: np.ndarray, offset: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        録音全体を復調する
+
+        Returns:
+            (symbols, levels): levels は各シンボルで選んだトーンのエネルギー (無音区間の除外に使う)
+        """
+        return self.decide(self.tone_energies(audio[offset:]))
+
+    def push(self, block: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """受信したブロックを処理し、新しく完成したシンボルを返す"""
+        block = np.asarray(block, dtype=np.float64).reshape(-1)
+        if self.skip > 0:
+            skipped = min(self.skip, len(block))
+            self.skip -= skipped
+            block = block[skipped:]
+        audio = np.concatenate([self.pending, block]) if len(self.pending) else block
+        used = len(audio) - len(audio) % self.symbol_samples
+        self.pending = audio[used:].copy()
+        return self.decide(self.tone_energies(audio[:used]))
+
+
+def sliding_tone_energies(audio: np.ndarray, frequencies: Sequence[float], symbol_samples: int,
+                          sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    スライディングDFT: 全てのサンプル位置 n から始まる長さ symbol_samples の区間のトーンのエネルギー
+
+    x[m] exp(-j w m) の累積和 C を1度だけ計算し、区間 [n, n + L) の和を C[n + L] - C[n] で求める。
+
+    Returns:
+        np.ndarray: (トーン数, len(audio) - symbol_samples + 1)
+    """
+    audio = np.asarray(audio, dtype=np.float64)
+    n = np.arange(len(audio))
+    cumulative = np.zeros((len(frequencies), len(audio) + 1), dtype=np.complex128)
+    for i, frequency in enumerate(frequencies):
+        np.cumsum(audio * np.exp(-2j * np.pi * frequency * n / sample_rate), out=cumulative[i, 1:])
+    sums = cumulative[:, symbol_samples:] - cumulative[:, :-symbol_samples]
+    return np.abs(sums) ** 2 * (4.0 / symbol_samples ** 2)
+
+
+def find_symbol_offset(audio: np.ndarray, frequencies: Sequence[float], symbol_samples: int,
+                       sample_rate: int = SAMPLE_RATE) -> int:
+    """
+    シンボルの区切り位置 (0 〜 symbol_samples - 1) を推定する
+
+    区切りが合っていれば各区間のエネルギーが1つのトーンに集中する。
+    位置ごとに「最大のトーンのエネルギー / 全トーンのエネルギー」を求め、区切りの候補ごとに平均して最大のものを選ぶ。
+    """
+    energies = sliding_tone_energies(audio, frequencies, symbol_samples, sample_rate)
+    total = np.sum(energies, axis=0)
+    weight = total / (np.max(total) + 1e-30)  # 信号のない区間は数えない
+    purity = np.max(energies, axis=0) / (total + 1e-30) * weight
+    count = len(purity) // symbol_samples
+    if count == 0:
+        return 0
+    scores = np.mean(purity[:count * symbol_samples].reshape(count, symbol_samples), axis=0)
+    return int(np.argmax(scores))
+
+
+def audible_leakage_db(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, cutoff: float = 8000.0) -> float:
+    """cutoff (Hz) より下に漏れた電力の割合 (dB)。PSKの搬送波の帯域への影響の目安"""
+    spectrum = np.abs(np.fft.rfft(np.asarray(audio, dtype=np.float64))) ** 2
+    frequencies = np.fft.rfftfreq(len(audio), 1.0 / sample_rate)
+    leaked = np.sum(spectrum[frequencies < cutoff])
+    return float(10 * np.log10(leaked / np.sum(spectrum) + 1e-30))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from channel_simulator import AcousticChannel, render_text
+
+    parser = argparse.ArgumentParser(description="超音波帯域のMFSKの送受信を音響チャンネルのシミュレーションで計測する")
+    parser.add_argument("--tones", type=int, default=4, help="トーン数 (2のべき乗)")
+    parser.add_argument("--symbol-ms", type=float, default=10.0, help="1シンボルの長さ (ミリ秒)")
+    parser.add_argument("--base", type=float, default=DEFAULT_BASE_FREQUENCY, help="最も低いトーンの周波数 (Hz)")
+    parser.add_argument("--bits", type=int, default=2000, help="送信するビット数")
+    parser.add_argument("--snr", type=float, default=20.0, help="信号対雑音比 (dB)")
+    parser.add_argument("--rt60", type=float, default=0.0, help="残響時間 (秒)")
+    parser.add_argument("--with-psk", action="store_true", help="可聴帯域のPSK (keyboard_psk.py と同じ信号) を重ねる")
+    parser.add_argument("--block-size", type=int, default=1024, help="受信側のブロックサイズ (ストリーミング復調)")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    symbol_samples = int(round(args.symbol_ms * SAMPLE_RATE / 1000))
+    frequencies = tone_frequencies(args.tones, symbol_samples, SAMPLE_RATE, args.base)
+    bits = "".join(rng.choice(["0", "1"], args.bits))
+    fsk = modulate_bits(bits, frequencies, symbol_samples, SAMPLE_RATE)
+    sent_symbols = bits_to_symbols(bits, args.tones)
+    leakage = audible_leakage_db(fsk)
+
+    transmitted = fsk
+    if args.with_psk:
+        psk, _ = render_text("hello world", SAMPLE_RATE)
+        length = max(len(psk), len(fsk))
+        transmitted = np.zeros(length, dtype=np.float32)
+        transmitted[:len(fsk)] += fsk
+        transmitted[:len(psk)] += psk / 32767.0 * 0.5
+
+    noise_band = (frequencies[0] - 500, min(frequencies[-1] + 500, SAMPLE_RATE * 0.49))
+    channel = AcousticChannel(rt60=args.rt60, snr_db=args.snr, noise_band=noise_band,
+                              max_start_offset=0.05, seed=args.seed)
+    received, start_offset = channel.apply(transmitted)
+
+    # 区切り位置を推定し、ストリーミング復調 (push) で受信する
+    offset = find_symbol_offset(received[:SAMPLE_RATE], frequencies, symbol_samples)
+    demodulator = FSKDemodulator(frequencies, symbol_samples, SAMPLE_RATE, offset)
+    symbols = []
+    levels = []
+    for start in range(0, len(received), args.block_size):
+        block_symbols, block_levels = demodulator.push(received[start:start + args.block_size])
+        symbols.append(block_symbols)
+        levels.append(block_levels)
+    symbols = np.concatenate(symbols)
+    levels = np.concatenate(levels)
+
+    # 信号の来ていない区間 (開始オフセットの無音) を除く
+    active = np.flatnonzero(levels > 0.1 * np.max(levels))
+    detected = symbols[active[0]:active[0] + len(sent_symbols)] if len(active) else symbols[:0]
+    detected_bits = symbols_to_bits(detected, args.tones)[:len(bits)]
+    errors = sum(a != b for a, b in zip(bits, detected_bits)) + len(bits) - len(detected_bits)
+
+    bit_rate = bits_per_symbol(args.tones) * SAMPLE_RATE / symbol_samples
+    print(f"トーン: {', '.join(f'{f:.0f}' for f in frequencies)} Hz (間隔 {frequencies[1] - frequencies[0]:.1f} Hz)")
+    print(f"シンボル長: {symbol_samples} サンプル ({symbol_samples / SAMPLE_RATE * 1000:.2f} ms)")
+    print(f"ビットレート: {bit_rate:.1f} bps")
+    print(f"開始オフセット: {start_offset} サンプル (推定した区切り位置 {offset})")
+    print(f"ビット誤り率: {errors / len(bits) * 100:.3f}% ({errors} / {len(bits)})")
+    print(f"8kHz未満への漏れ: {leakage:.1f} dB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,31 @@
 import numpy as np
 from scipy.io import wavfile
 
-# FSK変調のパラメータ設定
-sample_rate = 44100  # サンプリングレート
+from fsk_modem import SAMPLE_RATE, modulate_bits
+
+# FSK変調のパラメータ設定 (変調は fsk_modem.py の連続位相FSK)
+sample_rate = SAMPLE_RATE  # サンプリングレート
 duration = 0.001  # 1ビットあたりの時間(秒)
-t = np.linspace(0, duration, int(sample_rate * duration))
+symbol_samples = int(sample_rate * duration)  # 1ビットあたりのサンプル数
+gap_samples = symbol_samples  # ビットの後の無音区間 (1ビットと同じ長さ)
+# 0の場合は19000Hz、1の場合は20000Hz
+# (1ミリ秒の区間では直交する間隔が sample_rate / 44 = 1002Hz になるので、tone_frequencies は使わず固定する)
+frequencies = np.array([19000.0, 20000.0])
 
 # 入力バイナリ信号
-# ランダムな10000桁のバイナリ信号を生成
-binary_signal = ''.join(np.random.choice(['0', '1']) for _ in range(40))
-# FSK変調の実装
-modulated_signal = []
-for bit in binary_signal:
-    if bit == '1':
-        # 1の場合は2000Hz（可聴域内）
-        signal = np.sin(2 * np.pi * 20000 * t)
-    else:
-        # 0の場合は1000Hz（可聴域内）
-        signal = np.sin(2 * np.pi * 19000 * t)
-    modulated_signal.extend(signal)
-    # 無音区間の追加
-    silence = np.zeros(int(sample_rate * duration))
-    modulated_signal.extend(silence)
+binary_signal = ''.join(np.random.choice(['0', '1'], 40))
+
+# FSK変調 (ビットの境界で位相がつながる)。ビットごとに無音区間を挟むので、バースト全体のフェードはかけない
+bursts = modulate_bits(binary_signal, frequencies, symbol_samples, sample_rate, amplitude=1.0, fade_seconds=0)
+bursts = bursts.reshape(-1, symbol_samples)
 
-# 信号を-1から1の範囲に正規化
-modulated_signal = np.array(modulated_signal)
-modulated_signal = modulated_signal / np.max(np.abs(modulated_signal))
+# 無音区間の追加
+silence = np.zeros((len(bursts), gap_samples), dtype=bursts.dtype)
+modulated_signal = np.hstack([bursts, silence]).reshape(-1)
 
 # 16ビット整数に変換（-32768から32767の範囲）
 modulated_signal = (modulated_signal * 32767).astype(np.int16)
 
 # WAVファイルとして保存
 wavfile.write('fsk_modulated.wav', sample_rate, modulated_signal)
+print(f"トーン {frequencies[0]:.0f}Hz / {frequencies[1]:.0f}Hz で {len(binary_signal)} ビットを fsk_modulated.wav に保存しました")
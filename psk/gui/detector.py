@@ -1,12 +1,20 @@
-import sounddevice as sd
+import os
+import sys
 import numpy as np
 from matplotlib.animation import FuncAnimation
 import matplotlib.pyplot as plt
 from scipy import signal
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio_backend import open_input
+
 # オーディオデバイスの設定
 def setup_audio_device():
     """オーディオデバイスの初期設定を行う"""
+    # 仮想ループバックや録音の再生 (PSK_AUDIO_BACKEND=replay) ではサウンドカードを使わない
+    if os.environ.get("PSK_AUDIO_BACKEND", "sounddevice") != "sounddevice":
+        return
+    import sounddevice as sd
     device_list = sd.query_devices()
     print("利用可能なオーディオデバイス:")
     print(device_list)
@@ -137,11 +145,8 @@ setup_audio_device()
 fig, lines = setup_plot()
 
 # オーディオストリームとアニメーションの設定
-stream = sd.InputStream(
-    channels=1,
-    dtype='float32',
-    callback=audio_callback
-)
+# (audio_backend 経由で開くので、SESSION_RECORD / SESSION_REPLAY による録音・再生にも対応する)
+stream = open_input(audio_callback, SAMPLE_RATE)
 animation = FuncAnimation(fig, update_plot, interval=30, blit=True)
 
 # ストリーム開始とプロット表示
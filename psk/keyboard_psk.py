@@ -1,56 +1,39 @@
-import keyboard
 import time
 import numpy as np
 from pskgenerator import generate_psk_signal, generate_psk_signal_in_memory
-import sounddevice as sd
-import wave
-import pyaudio
+from psk_charcodec import CARRIERS, build_waves, calculate_parity, key_name_to_char_code, split_16bit
+from audio_backend import open_output
 
 # グローバル変数として設定
 SAMPLE_RATE = 44100
-# sounddeviceの初期化
-sd.default.samplerate = SAMPLE_RATE
-sd.default.channels = 1
-sd.default.dtype = np.int16
+# keyboard と sounddevice は import 時にデバイスやフックを初期化するので、使うときまで読み込まない
+# (python -m psk の他のサブコマンドや、このモジュールの関数だけを使う場合に待たされないように)
 
-# グローバル変数としてPyAudioとストリームを保持
-p = pyaudio.PyAudio()
+# グローバル変数として出力ストリームを保持
+# (出力先は環境変数 PSK_AUDIO_BACKEND で切り替える。既定は pyaudio)
 stream = None
 
 def initialize_audio_stream(sample_rate: int):
     """音声ストリームを初期化"""
     global stream
     if stream is None:
-        stream = p.open(format=pyaudio.paInt16,
-                        channels=1,
-                        rate=sample_rate,
-                        output=True)
+        stream = open_output(sample_rate)
 
 def play_audio_data_with_pyaudio(audio_data: np.ndarray):
-    """pyaudioを使用して音声データを再生"""
+    """出力バックエンド (既定: pyaudio) を使用して音声データを再生"""
     if stream is not None:
-        stream.write(audio_data.tobytes())
+        stream.write(audio_data)
 
 def close_audio_stream():
     """音声ストリームを閉じる"""
     global stream
     if stream is not None:
-        stream.stop_stream()
         stream.close()
         stream = None
-    p.terminate()
-
-def split_16bit_to_4bits(binary_16bit: str) -> list:
-    """16ビットの文字列を4ビットずつに分割"""
-    return [binary_16bit[i:i+4] for i in range(0, 16, 4)]
-
-def calculate_parity(binary_str: str) -> str:
-    """8ビットのパリティビットを計算"""
-    count_ones = sum(1 for bit in binary_str if bit == '1')
-    return binary_str + ('0' if count_ones % 2 == 0 else '1')
 
 def play_audio_data(audio_data: np.ndarray, sample_rate: int):
     """メモリ上の音声データを再生"""
+    import sounddevice as sd
     try:
         # 前の再生が終わっていない場合は停止
         sd.stop()
@@ -71,20 +54,10 @@ def on_key_press(event):
     # 入力された文字を取得
     character = event.name
     
-    # 特殊キーの処理
-    if character in ['backspace', 'delete', 'space']:
-        if character == 'backspace':
-            char_code = 8
-        elif character == 'delete':
-            char_code = 127
-        else:  # space
-            char_code = 32
-    else:
-        # 通常の文字の処理
-        if len(character) == 1:
-            char_code = ord(character)
-        else:
-            return
+    # 特殊キー (backspace/delete/space) と通常の文字の処理
+    char_code = key_name_to_char_code(character)
+    if char_code is None:
+        return
 
     try:
         # 7ビットの2進数に変換
@@ -94,16 +67,11 @@ def on_key_press(event):
         # 16ビットにする（同じ8ビットを2回繰り返す）
         binary_16bit = binary_8bit * 2
         
-        # 4ビットずつに分割
-        four_bits = split_16bit_to_4bits(binary_16bit)
+        # 搬送波の数で分割 (既定のプランでは4ビットずつ)
+        carrier_bits = split_16bit(binary_16bit, len(CARRIERS))
         
-        # 波形パラメータを設定
-        waves = [
-            {"frequency": 4410, "switch_interval": 110, "binary_message": four_bits[0]},
-            {"frequency": 3308, "switch_interval": 82, "binary_message": four_bits[1]},
-            {"frequency": 2756, "switch_interval": 68, "binary_message": four_bits[2]},
-            {"frequency": 2205, "switch_interval": 56, "binary_message": four_bits[3]},
-        ]
+        # 波形パラメータを設定 (channel_plan.json の搬送波設定)
+        waves = build_waves(carrier_bits)
         
         # 生成した音声データを直接再生
         audio_data = generate_psk_signal_in_memory(SAMPLE_RATE, waves)
@@ -115,14 +83,15 @@ def on_key_press(event):
         print(f"7bit: {binary_7bit}")
         print(f"8bit with parity: {binary_8bit}")
         print(f"16bit: {binary_16bit}")
-        print(f"4bit splits: {four_bits}")
+        print(f"carrier splits: {carrier_bits}")
         print("-" * 40)
         
     except Exception as e:
         print(f"エラーが発生しました: {e}")
 
-# メイン処理
-if __name__ == "__main__":
+def main():
+    import keyboard
+
     try:
         print("キーボードの入力を監視中... (終了するには 'esc' キーを押してください)")
         
@@ -141,4 +110,9 @@ if __name__ == "__main__":
         print(f"予期せぬエラーが発生しました: {e}")
     finally:
         print("プログラムを終了します。")
-        close_audio_stream()  # 終了時にストリームを閉じる
\ No newline at end of file
+        close_audio_stream()  # 終了時にストリームを閉じる
+
+
+# メイン処理
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from pskgenerator import generate_psk_signal
 from pskdetector_pureData import main as detect_signal
 from pskdetector_pureData import convert_wave_to_binary
+from channel_plan import load_channel_plan, transmitter_carriers
 import os
 import random
 def ensure_wav_directory():
@@ -33,12 +34,11 @@ def main():
     # message = ''.join([str(random.randint(0, 1)) for _ in range(10000)])  
     # message = "010011"
     # 生成する信号のパラメータ
-    # frequencyはサンプリングレートの1/4以下の約数にする
+    # 周波数とスイッチ間隔は送受信と共通の channel_plan.json から読み込む
+    messages = ["010011", "101011", "100101", "110100"]
     waves = [
-        {"frequency": 4410, "switch_interval": 55, "binary_message": "010011"},
-        {"frequency": 3308, "switch_interval": 41, "binary_message": "101011"},
-        {"frequency": 2756, "switch_interval": 34, "binary_message": "100101"},
-        {"frequency": 2205, "switch_interval": 28, "binary_message": "110100"},
+        {**carrier, "binary_message": messages[i % len(messages)]}
+        for i, carrier in enumerate(transmitter_carriers(load_channel_plan()))
     ]
 
     # waves = [
@@ -0,0 +1,207 @@
+"""
+チャンネルプラン (搬送波の数・周波数・スイッチ間隔・フィルタ帯域) の自動探索
+
+候補のプランを channel_simulator.py の音響チャンネルで送受信し、目標のビット誤り率以下で
+ビットレートが最大になるプランを channel_plan.json に書き出す。
+keyboard_psk.py (送信) と psk_receiver.py (受信) は同じ channel_plan.json を読み込むので、
+書き出したプランはそのまま送受信の両方に反映される。
+
+候補の作り方:
+  - 周波数は 44.1kHz を整数で割った値 (fs / k) に限定する。1周期がちょうど k サンプルになるので、
+    switch_interval を整数にすれば1ビットの長さも整数サンプルになる (ビット境界がずれない)。
+    k は period_samples としてプランに書き出し、送受信とも1ビットを k * switch_interval サンプルとする
+  - 最も高い周波数から、指定した間隔以上離れた fs / k を順に選ぶ
+  - 全搬送波で1ビットの長さがほぼ同じ (symbol_samples) になるよう switch_interval を決める
+  - フィルタ帯域は搬送波の間隔以下に限る (隣の搬送波が通過帯域に入らないように)
+
+候補ごとの評価は独立しているので、ProcessPoolExecutor で並列に実行する。
+
+使い方 (psk/ ディレクトリで実行):
+    python plan_optimizer.py --snr 20 --target-ber 0.01
+    python plan_optimizer.py --output /tmp/plan.json --workers 4
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from channel_plan import BITS_PER_CHARACTER, DEFAULT_PLAN_PATH, save_channel_plan, symbol_samples
+
+SAMPLE_RATE = 44100
+
+# 探索範囲
+CARRIER_COUNTS = (2, 4, 8)
+TOP_FREQUENCIES = (4900, 4410, 3675)  # それぞれ fs/9, fs/10, fs/12
+SPACINGS = (441, 630, 882)
+SYMBOL_SAMPLES = (600, 800, 1100, 1400)  # 1ビットの長さの目安 (サンプル)
+BANDWIDTHS = (220, 441, 630, 882)
+MIN_FREQUENCY = 1000  # これより低い搬送波は使わない (部屋の低域ノイズが大きいため)
+
+
+def make_plan(num_carriers: int, top_frequency: float, spacing: float, target_symbol: int,
+              bandwidth: float, sample_rate: int = SAMPLE_RATE) -> Optional[Dict]:
+    """
+    探索パラメータから1つのプランを作る (作れない組み合わせは None)
+
+    Args:
+        num_carriers: 搬送波の数
+        top_frequency: 最も高い搬送波の周波数 (fs / k に丸める)
+        spacing: 隣り合う搬送波の最小間隔 (Hz)
+        target_symbol: 1ビットの長さの目安 (サンプル)
+        bandwidth: 受信側のバンドパスフィルタの帯域 (Hz)
+    """
+    if bandwidth > spacing or BITS_PER_CHARACTER % num_carriers != 0:
+        return None
+
+    carriers = []
+    k = max(2, int(round(sample_rate / top_frequency)))
+    while len(carriers) < num_carriers:
+        frequency = sample_rate / k
+        if frequency < MIN_FREQUENCY:
+            return None
+        if not carriers or carriers[-1]["frequency"] - frequency >= spacing:
+            # 1周期 k サンプル x switch_interval 周期 = 1ビット
+            switch_interval = max(1, int(round(target_symbol / k)))
+            carriers.append({
+                "frequency": int(frequency) if frequency.is_integer() else round(frequency, 3),
+                "switch_interval": switch_interval,
+                "bandwidth": bandwidth,
+                "period_samples": k,
+            })
+        k += 1
+    return {"sample_rate": sample_rate, "carriers": carriers}
+
+
+def candidate_plans(sample_rate: int = SAMPLE_RATE) -> List[Dict]:
+    """探索範囲の全組み合わせから候補のプランを作る (重複は除く)"""
+    plans = []
+    seen = set()
+    for params in itertools.product(CARRIER_COUNTS, TOP_FREQUENCIES, SPACINGS, SYMBOL_SAMPLES, BANDWIDTHS):
+        plan = make_plan(*params, sample_rate=sample_rate)
+        if plan is None:
+            continue
+        key = tuple((c["frequency"], c["switch_interval"], c["bandwidth"]) for c in plan["carriers"])
+        if key not in seen:
+            seen.add(key)
+            plans.append(plan)
+    return plans
+
+
+def character_seconds(plan: Dict) -> float:
+    """1文字の送信に必要な時間 (秒)。基準の1区間 + 搬送波あたりのビット数"""
+    sample_rate = plan["sample_rate"]
+    bits = BITS_PER_CHARACTER // len(plan["carriers"])
+    longest = max(symbol_samples(c["frequency"], c["switch_interval"], sample_rate, c.get("period_samples"))
+                  for c in plan["carriers"])
+    return (bits + 1) * longest / sample_rate
+
+
+def evaluate_plan(plan: Dict, text: str, trials: int = 2, snr_db: float = 30.0, rt60: float = 0.2,
+                  clock_skew_ppm: float = 0.0, gap: float = 1.0, seed: int = 0) -> Dict:
+    """
+    1つのプランを音響チャンネルで評価する (ProcessPoolExecutor のワーカーで実行される)
+
+    Args:
+        gap: 文字と文字の間の無音 (1文字の長さに対する比)。受信器は信号の終わりで窓が揃うため無音が必要
+    """
+    # ワーカープロセスで import する (受信器は起動時にプランを読むが、ここでは引数の plan を使う)
+    from channel_plan import receiver_waves, transmitter_carriers
+    from channel_simulator import AcousticChannel, simulate_session
+    from psk_receiver import PSKReceiver
+
+    sample_rate = plan["sample_rate"]
+    char_interval = character_seconds(plan) * (1.0 + gap)
+    bit_errors = []
+    char_accuracies = []
+    for trial in range(trials):
+        channel = AcousticChannel(sample_rate=sample_rate, rt60=rt60, snr_db=snr_db,
+                                  clock_skew_ppm=clock_skew_ppm, max_start_offset=0.1, seed=seed + trial)
+        receiver = PSKReceiver(receiver_waves(plan), sample_rate)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = simulate_session(text, channel, receiver, char_interval=char_interval,
+                                      carriers=transmitter_carriers(plan))
+        bit_errors.append(result["bit_error_rate"])
+        char_accuracies.append(result["char_accuracy"])
+
+    return {
+        "plan": plan,
+        "bits_per_second": BITS_PER_CHARACTER / char_interval,
+        "chars_per_second": 1.0 / char_interval,
+        "bit_error_rate": float(np.mean(bit_errors)),
+        "char_accuracy": float(np.mean(char_accuracies)),
+    }
+
+
+def random_text(length: int, seed: int) -> str:
+    """評価用の文字列 (英数字と空白)"""
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 "
+    rng = np.random.default_rng(seed)
+    return "".join(rng.choice(list(alphabet), size=length))
+
+
+def describe(plan: Dict) -> str:
+    """プランを1行で表示する"""
+    return " ".join(f"{c['frequency']}Hz/{c['switch_interval']}" for c in plan["carriers"]) \
+        + f" bw={plan['carriers'][0]['bandwidth']}"
+
+
+def optimize(plans: List[Dict], text: str, target_ber: float, workers: Optional[int] = None, **kwargs) -> List[Dict]:
+    """
+    全候補を並列に評価し、目標のビット誤り率を満たすものをビットレートの高い順に返す
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(evaluate_plan, plan, text, **kwargs) for plan in plans]
+        results = [future.result() for future in futures]
+
+    accepted = [r for r in results if r["bit_error_rate"] <= target_ber]
+    accepted.sort(key=lambda r: (-r["bits_per_second"], r["bit_error_rate"]))
+    return accepted
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="音響チャンネルのシミュレーションでチャンネルプランを探索する")
+    parser.add_argument("--target-ber", type=float, default=0.01, help="許容するビット誤り率")
+    parser.add_argument("--snr", type=float, default=30.0, help="信号対雑音比 (dB)")
+    parser.add_argument("--rt60", type=float, default=0.2, help="残響時間 (秒)")
+    parser.add_argument("--skew-ppm", type=float, default=0.0, help="サンプリングクロックのずれ (ppm)")
+    parser.add_argument("--gap", type=float, default=1.0, help="文字間の無音 (1文字の長さに対する比)")
+    parser.add_argument("--chars", type=int, default=16, help="1回の評価で送る文字数")
+    parser.add_argument("--trials", type=int, default=2, help="候補ごとの試行回数 (シードを変えて平均)")
+    parser.add_argument("--workers", type=int, default=None, help="並列に評価するプロセス数 (既定はCPU数)")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--top", type=int, default=10, help="表示する上位の候補数")
+    parser.add_argument("--output", default=DEFAULT_PLAN_PATH, help="最良のプランの書き出し先")
+    parser.add_argument("--dry-run", action="store_true", help="結果を表示するだけで書き出さない")
+    args = parser.parse_args(argv)
+
+    plans = candidate_plans()
+    text = random_text(args.chars, args.seed)
+    print(f"{len(plans)} 個の候補を {args.workers or os.cpu_count()} プロセスで評価します")
+
+    accepted = optimize(plans, text, args.target_ber, args.workers, trials=args.trials, snr_db=args.snr,
+                        rt60=args.rt60, clock_skew_ppm=args.skew_ppm, gap=args.gap, seed=args.seed)
+    if not accepted:
+        print(f"ビット誤り率 {args.target_ber * 100:.2f}% 以下を満たす候補がありませんでした")
+        return 1
+
+    print(f"\n{'bps':>8} {'文字/秒':>7} {'BER':>7}  プラン")
+    for result in accepted[:args.top]:
+        print(f"{result['bits_per_second']:8.1f} {result['chars_per_second']:7.2f} "
+              f"{result['bit_error_rate'] * 100:6.2f}%  {describe(result['plan'])}")
+
+    best = accepted[0]
+    if args.dry_run:
+        return 0
+    save_channel_plan(best["plan"], args.output)
+    print(f"\n最良のプランを {args.output} に保存しました")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+文字 ⇔ PSKビット列の変換 (keyboard_psk.py と detector_v3.py で共通)
+
+文字 → 7bit ASCII + パリティビット → 16bit (8bitを2回繰り返し) → 搬送波の数で均等に分割
+(既定のプランでは 4bit x 4チャンネル)
+"""
+from typing import Dict, List, Optional
+
+from channel_plan import load_channel_plan, transmitter_carriers
+
+# 搬送波の設定 (周波数, スイッチ間隔)。channel_plan.json から読み込む
+CARRIERS = transmitter_carriers(load_channel_plan())
+
+# keyboard モジュールの特殊キー名と文字コードの対応
+SPECIAL_KEYS = {"backspace": 8, "delete": 127, "space": 32}
+
+
+def key_name_to_char_code(key_name: str) -> Optional[int]:
+    """キー名を文字コードに変換する (対応しないキーは None)"""
+    if key_name in SPECIAL_KEYS:
+        return SPECIAL_KEYS[key_name]
+    if len(key_name) == 1:
+        return ord(key_name)
+    return None
+
+
+def calculate_parity(binary_str: str) -> str:
+    """8ビットのパリティビットを計算"""
+    count_ones = sum(1 for bit in binary_str if bit == '1')
+    return binary_str + ('0' if count_ones % 2 == 0 else '1')
+
+
+def split_16bit(binary_16bit: str, num_carriers: int) -> List[str]:
+    """16ビットの文字列を搬送波の数で均等に分割"""
+    width = len(binary_16bit) // num_carriers
+    return [binary_16bit[i:i+width] for i in range(0, len(binary_16bit), width)]
+
+
+def char_code_to_bits(char_code: int, num_carriers: int = len(CARRIERS)) -> List[str]:
+    """文字コードを搬送波ごとのビット列に変換する"""
+    binary_7bit = bin(char_code)[2:].zfill(7)
+    binary_8bit = calculate_parity(binary_7bit)
+    binary_16bit = binary_8bit * 2
+    return split_16bit(binary_16bit, num_carriers)
+
+
+def build_waves(carrier_bits: List[str], carriers: List[Dict] = CARRIERS) -> List[Dict]:
+    """搬送波ごとのビット列と搬送波設定から generate_psk_signal_in_memory 用の波形パラメータを作る"""
+    return [
+        {**carrier, "binary_message": bits}
+        for carrier, bits in zip(carriers, carrier_bits)
+    ]
+
+
+def check_parity(bits: List[int]) -> bool:
+    """
+    8ビットのパリティチェックを行う
+    最後のビットはパリティビット
+
+    Args:
+        bits: 8ビットのリスト
+
+    Returns:
+        bool: パリティチェックが正しければTrue
+    """
+    if len(bits) != 8:
+        return False
+
+    # 最後のビットを除いた7ビットの1の数を数える
+    data_bits_sum = sum(bits[:7])
+    # 偶数パリティの場合
+    expected_parity = data_bits_sum % 2
+
+    return bits[7] == expected_parity
+
+
+def bits_to_char_code(bits: List[int]) -> int:
+    """パリティ付き8ビットから文字コード (上位7ビット) を取り出す"""
+    code = 0
+    for bit in bits[:7]:
+        code = (code << 1) | int(bit)
+    return code
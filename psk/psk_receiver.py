@@ -0,0 +1,483 @@
+"""
+マルチチャンネルPSK受信処理 (detector_v3.py から描画部分を切り離したもの)
+
+バンドパスフィルタ → ゲイン自動調整 → 遅延乗算 → ビット判定 → パリティチェック
+をブロック単位で行う。オーディオデバイスやmatplotlibに依存しないため、
+シミュレーションやベンチマークからも直接呼び出せる。
+
+demodulator="coherent" を指定すると、遅延乗算の代わりに複素参照信号への射影 (coherent_demod.py) で
+区間ごとの和を求める。和の形式と大きさは同じなので、ビット判定以降は共通。
+
+検出結果には搬送波ごとのSNR (帯域内とその両脇のガードバンドのエネルギーの比) と
+ビットごとの判定の余裕 (区間和の大きさを正規化したもの) を含める。
+どの搬送波が誤りの原因になっているかを見て、その搬送波を外したプランを試すときに使う。
+
+kernels="numba" を指定すると、ゲイン調整・遅延乗算・区間の積分を receiver_kernels.py の
+JITコンパイルしたカーネルで1回の走査にまとめて行う (結果は NumPy の経路とビット単位で一致する)。
+
+dtype=np.float32 を指定すると、フィルタ (2次セクションの sosfiltfilt) から遅延乗算・区間の和までを float32 で行い、
+ブロックごとに読み書きするバッファの大きさを半分にする。入力は int16 (np.frombuffer でデバイスのバッファを
+そのまま見たもの) でもよく、その場合はフィルタの前に1度だけ dtype に変換する。
+
+metrics (receiver_metrics.ReceiverMetrics) を渡すと、ステージごとの処理時間や搬送波ごとの信号の強さを記録する。
+文字ごとのSNR・判定の余裕・文字数は CharacterAssembler が1文字にまとめたところで記録する。
+"""
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from channel_plan import BITS_PER_CHARACTER, load_channel_plan, receiver_waves, symbol_samples
+from coherent_demod import CoherentDemodulator
+from psk_charcodec import bits_to_char_code, check_parity
+from receiver_kernels import load_kernel
+
+## 波の設定 (channel_plan.json から読み込む)
+WAVES = receiver_waves(load_channel_plan())
+
+## ゲイン
+TARGET_MAX = 0.8  # 目標最大値
+GAIN_INCREASE_RATE = 0.01  # 共通の増加率
+GAIN_DECREASE_RATE = 0.8   # 共通の減少率
+
+## パラメータ
+SAMPLE_RATE = 44100
+BUFFER_SECONDS = 0.5
+DETECT_THRESHOLD = 0.1
+DEMODULATORS = ("delay", "coherent")
+INT16_SCALE = 1.0 / 32768.0
+SNR_WINDOW = 2048  # SNRの推定に使う直近の入力のサンプル数 (44.1kHz で約46ミリ秒、周波数分解能 約21.5Hz)
+
+# 受信処理のサンプルの型 (PSK_SAMPLE_DTYPE): 名前 -> (入力ストリームの型, 受信器で処理する型)
+SAMPLE_DTYPES = {
+    "float64": ("float32", np.float64),  # 従来どおり float32 で受け取り、float64 で処理する
+    "float32": ("float32", np.float32),
+    "int16": ("int16", np.float32),      # int16 のバッファをコピーせずに受け取り、float32 で処理する
+}
+
+
+# scipy.signal は読み込みに0.5秒以上かかるので、import psk_receiver では読み込まず、
+# 最初にフィルタを作るとき (_load_signal) に読み込む (python -m psk decode などの起動時間のため)
+signal = None
+
+
+def _load_signal():
+    """scipy.signal を読み込む (2回目以降は読み込み済みのモジュールを返す)"""
+    global signal
+    if signal is None:
+        from scipy import signal as scipy_signal
+        signal = scipy_signal
+    return signal
+
+
+def create_bandpass_filter(center_freq, bandwidth, sample_rate=SAMPLE_RATE):
+    """中心周波数とバンド幅でバンドパスフィルタを作成する"""
+    _load_signal()
+    nyquist = sample_rate * 0.5
+    low = (center_freq - bandwidth / 2) / nyquist
+    high = (center_freq + bandwidth / 2) / nyquist
+    b, a = signal.butter(6, [low, high], btype='band')
+    return b, a
+
+
+def create_bandpass_sos(center_freq, bandwidth, sample_rate=SAMPLE_RATE, dtype=np.float32):
+    """
+    create_bandpass_filter と同じ特性のフィルタを2次セクション (sos) で作成する
+
+    (b, a) の形の12次のフィルタは帯域が狭いと float32 では係数の丸めで不安定になるので、float32 ではこちらを使う。
+    """
+    _load_signal()
+    nyquist = sample_rate * 0.5
+    low = (center_freq - bandwidth / 2) / nyquist
+    high = (center_freq + bandwidth / 2) / nyquist
+    return signal.butter(6, [low, high], btype='band', output='sos').astype(dtype)
+
+
+def sosfiltfilt_prepared(sos: np.ndarray, zi: np.ndarray, edge: int, data: np.ndarray) -> np.ndarray:
+    """
+    signal.sosfiltfilt(sos, data) (padtype="odd") と同じ計算を、事前に求めた初期状態 zi で行う
+
+    sosfiltfilt は呼び出しのたびに sosfilt_zi (連立方程式) を解き直し、1ブロックの処理時間の半分以上を占めるので、
+    zi = signal.sosfilt_zi(sos) と edge (端の折り返しの長さ) はフィルタを作るときに1度だけ求めておく。
+    """
+    _load_signal()
+    if len(data) <= edge:
+        return signal.sosfiltfilt(sos, data)  # 短すぎる入力は sosfiltfilt と同じエラーにする
+    extended = np.concatenate((2 * data[0] - data[edge:0:-1], data, 2 * data[-1] - data[-2:-(edge + 2):-1]))
+    forward, _ = signal.sosfilt(sos, extended, zi=zi * extended[0])
+    backward, _ = signal.sosfilt(sos, forward[::-1], zi=zi * forward[-1])
+    return backward[::-1][edge:-edge]
+
+
+def sosfiltfilt_edge(sos: np.ndarray) -> int:
+    """sosfiltfilt の padlen の既定値 (3 * タップ数)"""
+    taps = 2 * len(sos) + 1 - min(int(np.sum(sos[:, 2] == 0)), int(np.sum(sos[:, 5] == 0)))
+    return 3 * taps
+
+
+def detect_bits(bit_sums: np.ndarray, num_bits: int = 4) -> List[int]:
+    """
+    和からビットを検出する
+    """
+    threshold = 0
+    bit_data = (bit_sums <= threshold).astype(int)
+    return bit_data[:num_bits].tolist()  # 最初の num_bits ビットのみ返す
+
+
+def decision_margins(bit_sums: np.ndarray, num_bits: int = 4) -> np.ndarray:
+    """
+    ビットごとの判定の余裕: |区間和| / 区間和の絶対値の平均
+
+    全ての区間の位相がはっきりしていれば1前後になり、0に近いほどしきい値 (0) に近い際どい判定。
+    信号の大きさやゲインに依存しないので、搬送波どうしで比べられる。
+    """
+    bit_sums = np.asarray(bit_sums, dtype=np.float64)
+    scale = np.mean(np.abs(bit_sums))
+    if scale <= 0:
+        return np.zeros(num_bits)
+    return np.abs(bit_sums[:num_bits]) / scale
+
+
+def snr_bands(waves: List[Dict], length: int, sample_rate: int = SAMPLE_RATE) -> Dict:
+    """
+    carrier_snr_db で使う窓関数と、搬送波ごとの帯域・ガードバンドのビン (長さ length の入力に対して) を求める
+
+    入力の長さが変わらなければ同じものを使えるので、PSKReceiver は初期化時に1度だけ計算する。
+    """
+    frequencies = np.fft.rfftfreq(length, 1.0 / sample_rate)
+    occupied = np.zeros(len(frequencies), dtype=bool)
+    for wave in waves:
+        occupied |= np.abs(frequencies - wave["frequency"]) <= wave["bandwidth"] / 2
+
+    in_bands, guards = [], []
+    for wave in waves:
+        distance = np.abs(frequencies - wave["frequency"])
+        in_bands.append(np.flatnonzero(distance <= wave["bandwidth"] / 2))
+        guards.append(np.flatnonzero((distance <= wave["bandwidth"]) & ~occupied))
+    return {"length": length, "window": np.hanning(length), "in_bands": in_bands, "guards": guards}
+
+
+def carrier_snr_db(audio: np.ndarray, waves: List[Dict], sample_rate: int = SAMPLE_RATE,
+                   bands: Optional[Dict] = None) -> List[float]:
+    """
+    搬送波ごとのSNR (dB) を、帯域内のエネルギーとガードバンドのエネルギーから推定する
+
+    帯域 (中心 ± bandwidth / 2) の外側で、中心から bandwidth 以内の範囲をガードバンドとし、
+    そこの1ビンあたりの平均を雑音の密度とみなす。ほかの搬送波の帯域に入るビンはガードバンドから除く。
+    ガードバンドのビンが無い場合と、入力が無音の場合は nan を返す (ReceiverMetrics は nan を集計しない)。
+    位相反転によるPSK自身のサイドローブもガードバンドに入るので、雑音が少ない場合は実際より低めに出る (20dB前後で頭打ち)。
+
+    :param bands: snr_bands(waves, len(audio), sample_rate) の結果 (None の場合はここで求める)
+    """
+    if bands is None or bands["length"] != len(audio):
+        bands = snr_bands(waves, len(audio), sample_rate)
+    spectrum = np.abs(np.fft.rfft(audio * bands["window"])) ** 2
+
+    snr = []
+    for in_band, guard in zip(bands["in_bands"], bands["guards"]):
+        if len(guard) == 0:
+            snr.append(float("nan"))
+            continue
+        noise = np.mean(spectrum[guard]) * len(in_band)
+        total = np.sum(spectrum[in_band])
+        if noise <= 0 and total <= 0:
+            snr.append(float("nan"))  # 無音
+            continue
+        signal_power = max(total - noise, 1e-20)
+        snr.append(float(10 * np.log10(signal_power / max(noise, 1e-20))))
+    return snr
+
+
+def detect_sums(target_data: np.ndarray, delay_samples: int, num_bits: int = 4) -> np.ndarray:
+    """
+    入力データから (num_bits + 1) ビット分の和を計算する
+
+    Args:
+        target_data: すでに掛け合わされた入力データ配列
+        delay_samples: 遅延サンプル数
+        num_bits: 1文字あたりに1つの搬送波で送るビット数
+
+    Returns:
+        np.ndarray: (num_bits + 1) ビット分の和の配列
+    """
+    # データ長が足りない場合は空配列を返す
+    if len(target_data) < delay_samples * (num_bits + 1):  # num_bitsビット+1ビット分のバッファ
+        return np.array([])
+
+    # (num_bits + 1) ビット分のデータ範囲ごとの和を計算
+    bit_sums = np.array([
+        np.sum(target_data[j*delay_samples:(j+1)*delay_samples])
+        for j in range(num_bits + 1)
+    ])
+
+    return bit_sums
+
+
+class PSKReceiver:
+    """
+    複数チャンネルのPSK信号をブロック単位で復調する受信器
+
+    1文字の16ビットを搬送波の数で均等に分けて送る (既定のプランでは 4ビット x 4チャンネル)。
+    """
+
+    def __init__(self, waves: List[Dict] = WAVES, sample_rate: int = SAMPLE_RATE,
+                 buffer_seconds: float = BUFFER_SECONDS, demodulator: str = "delay", metrics=None,
+                 kernels: str = "numpy", dtype=np.float64):
+        """
+        :param demodulator: "delay" (遅延乗算) または "coherent" (複素参照信号への射影)
+        :param dtype: 処理に使う型 (np.float64 または np.float32)
+        :param kernels: "numpy" または "numba" (receiver_kernels.py。numba が無い場合は ImportError)
+        :param metrics: 計測値を記録する receiver_metrics.ReceiverMetrics (None の場合は計測しない)
+        """
+        if demodulator not in DEMODULATORS:
+            raise ValueError(f"未対応の復調方式です: {demodulator}")
+        self.waves = waves
+        self.demodulator = demodulator
+        self.sample_rate = sample_rate
+        self.metrics = metrics
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f"未対応の dtype です: {self.dtype}")
+        self.kernel = load_kernel(kernels)
+        self.buffer_size = int(buffer_seconds * sample_rate)
+
+        self.num_bits = BITS_PER_CHARACTER // len(waves)  # 1つの搬送波で送るビット数
+        self.num_intervals = self.num_bits + 1  # 位相の基準となる先頭の1区間を含む
+
+        # フィルタ係数と遅延量はブロックごとに変わらないので事前に計算しておく
+        self.filters = [create_bandpass_filter(wave["frequency"], wave["bandwidth"], sample_rate) for wave in waves]
+        self.sos_filters = None
+        if self.dtype == np.float32:
+            self.sos_filters = []
+            for wave in waves:
+                sos = create_bandpass_sos(wave["frequency"], wave["bandwidth"], sample_rate, self.dtype)
+                self.sos_filters.append((sos, signal.sosfilt_zi(sos), sosfiltfilt_edge(sos)))
+        # 送信側 (pskgenerator.py) と同じ計算で1ビットのサンプル数を求める
+        self.delay_samples = [symbol_samples(wave["frequency"], wave["switch_interval"], sample_rate,
+                                             wave.get("period_samples")) for wave in waves]
+        self.target_data_buffer_sizes = [delay * self.num_intervals for delay in self.delay_samples]
+
+        self.current_gains = [wave["initial_gain"] for wave in waves]
+
+        # 各波形用のバッファを作成
+        self.plotdata_originals = [np.zeros((self.buffer_size), dtype=self.dtype) for _ in waves]
+        self.plotdata_delays = [np.zeros((delay + self.buffer_size), dtype=self.dtype) for delay in self.delay_samples]
+        self.plotdata_multiplies = [np.zeros((self.buffer_size), dtype=self.dtype) for _ in waves]
+        self.target_data_buffers = [np.zeros((size), dtype=self.dtype) for size in self.target_data_buffer_sizes]
+        self.bit_sums_buffers = [np.zeros(self.num_intervals, dtype=self.dtype) for _ in waves]  # 各波形のbit_sums用バッファ
+        # SNRの推定用に、フィルタをかける前の直近の入力を SNR_WINDOW サンプルだけ保持する
+        # (検出のたびに計算するので、判定区間全体ではなく短い窓でFFTする。窓関数とビンは事前に求めておく)
+        self.raw_buffer = np.zeros(SNR_WINDOW, dtype=self.dtype)
+        self.snr_bands = snr_bands(waves, SNR_WINDOW, sample_rate)
+
+        self.coherent = None
+        if demodulator == "coherent":
+            self.coherent = CoherentDemodulator([wave["frequency"] for wave in waves], self.delay_samples,
+                                                self.num_intervals, sample_rate, self.dtype)
+
+    def process_block(self, data: np.ndarray) -> Optional[Dict]:
+        """
+        1ブロック分の入力を処理する
+
+        Args:
+            data: モノラルの入力データ (float, -1.0〜1.0 または int16)
+
+        Returns:
+            全チャンネルで信号を検出した場合は判定結果の辞書、それ以外は None
+            {"bits": [第1グループ8ビット, 第2グループ8ビット],
+             "parity_ok": [bool, bool], "sums": 各波形の和, "char_code": 文字コード or None,
+             "snr_db": 搬送波ごとのSNR, "margins": 搬送波ごとのビットの判定の余裕 (decision_margins)}
+        """
+        metrics = self.metrics
+        clock = time.perf_counter
+        if data.dtype.kind in "iu":
+            # int16 はフィルタの前に1度だけ変換する (以降のステージは self.dtype のまま)
+            data = np.multiply(data, INT16_SCALE, dtype=self.dtype)
+        shift = min(len(data), len(self.raw_buffer))
+        self.raw_buffer = np.roll(self.raw_buffer, -shift)
+        self.raw_buffer[-shift:] = data[-shift:]
+        filter_seconds = agc_seconds = multiply_seconds = 0.0
+        if self.kernel is not None:
+            kernel_sums = [np.zeros(self.num_intervals, dtype=self.dtype) for _ in self.waves]
+            kernel_levels = [0.0] * len(self.waves)
+        for i, wave in enumerate(self.waves):
+            if metrics is not None:
+                t0 = clock()
+            # バンドパスフィルタを適用（周波数ごとのバンド幅を使用）
+            if self.sos_filters is not None:
+                sos, zi, edge = self.sos_filters[i]
+                filtered_data = sosfiltfilt_prepared(sos, zi, edge, data.astype(self.dtype, copy=False))
+            else:
+                b, a = self.filters[i]
+                filtered_data = signal.filtfilt(b, a, data)
+            if metrics is not None:
+                t1 = clock()
+                filter_seconds += t1 - t0
+
+            if self.kernel is not None:
+                # ゲイン調整から区間の和までをカーネルで行う (計測では delay_multiply に含める)
+                self.current_gains[i], kernel_levels[i] = self.kernel(
+                    filtered_data, self.current_gains[i], wave["max_gain"], TARGET_MAX,
+                    GAIN_INCREASE_RATE, GAIN_DECREASE_RATE,
+                    self.plotdata_originals[i], self.plotdata_delays[i], self.plotdata_multiplies[i],
+                    self.buffer_size, self.delay_samples[i], self.num_intervals, kernel_sums[i])
+                if metrics is not None:
+                    multiply_seconds += clock() - t1
+                continue
+
+            # ゲインの自動調整（共通のレート使用）
+            current_max = float(np.max(np.abs(filtered_data)))  # ゲインの計算は dtype によらず float で行う
+            if current_max > 0:
+                target_gain = min(TARGET_MAX / current_max, wave["max_gain"])
+                adjust_rate = GAIN_INCREASE_RATE if target_gain > self.current_gains[i] else GAIN_DECREASE_RATE
+                self.current_gains[i] = self.current_gains[i] * (1 - adjust_rate) + target_gain * adjust_rate
+
+            # ゲインを適用
+            filtered_data = filtered_data * self.current_gains[i]
+            if metrics is not None:
+                t2 = clock()
+                agc_seconds += t2 - t1
+
+            shift = len(data)
+
+            self.plotdata_originals[i] = np.roll(self.plotdata_originals[i], -shift)
+            self.plotdata_originals[i][-shift:] = filtered_data
+
+            self.plotdata_delays[i] = np.roll(self.plotdata_delays[i], -shift)
+            self.plotdata_delays[i][-shift:] = filtered_data
+
+            self.plotdata_multiplies[i] = np.roll(self.plotdata_multiplies[i], -shift)
+            self.plotdata_multiplies[i][-shift:] = filtered_data * self.plotdata_delays[i][self.buffer_size-shift:self.buffer_size] * 4
+            if metrics is not None:
+                multiply_seconds += clock() - t2
+
+        if metrics is not None:
+            metrics.add_stage("filter", filter_seconds)
+            metrics.add_stage("agc", agc_seconds)
+            metrics.add_stage("delay_multiply", multiply_seconds)
+            t3 = clock()
+
+        # 全ての波の閾値をチェック
+        target_data_list = []
+        for i in range(len(self.waves)):
+            delay_samples = self.delay_samples[i]
+            target_data = self.plotdata_multiplies[i][-delay_samples*self.num_intervals:]
+            target_data_list.append(target_data)
+        if self.coherent is not None:
+            # 全搬送波の全区間をまとめて射影する (区間和と信号の強さを同時に求める)
+            coherent_sums, levels = self.coherent.process(self.plotdata_originals)
+        elif self.kernel is not None:
+            levels = kernel_levels
+        else:
+            levels = [np.mean(np.abs(target_data)) for target_data in target_data_list]
+        thresholds = [level > DETECT_THRESHOLD for level in levels]
+
+        if metrics is not None:
+            metrics.record_block(levels, self.current_gains)
+
+        if not all(thresholds):
+            if metrics is not None:
+                metrics.add_stage("sums", clock() - t3)
+            return None
+
+        # 各波形のデータを処理
+        detected_bits_list = []
+        detected_sums_list = []
+        for i in range(len(self.waves)):
+            if self.coherent is not None:
+                detected_sums = coherent_sums[i]
+            elif self.kernel is not None:
+                detected_sums = kernel_sums[i]
+            else:
+                detected_sums = detect_sums(target_data_list[i], self.delay_samples[i], self.num_bits)
+            detected_sums_list.append(detected_sums)
+        if metrics is not None:
+            t4 = clock()
+            metrics.add_stage("sums", t4 - t3)
+
+        for detected_sums in detected_sums_list:
+            detected_bits_list.append(detect_bits(detected_sums, self.num_bits))
+        margins = [decision_margins(detected_sums, self.num_bits) for detected_sums in detected_sums_list]
+        snr_db = carrier_snr_db(self.raw_buffer, self.waves, self.sample_rate, self.snr_bands)
+
+        # 搬送波ごとのビットを16ビットに結合し、前半と後半の8ビットに分ける
+        all_bits = [bit for bits in detected_bits_list for bit in bits]
+        first_8bits = all_bits[:8]
+        second_8bits = all_bits[8:16]
+
+        # パリティチェックを実行
+        first_parity_ok = check_parity(first_8bits)
+        second_parity_ok = check_parity(second_8bits)
+
+        char_code = None
+        if first_parity_ok or second_parity_ok:
+            self.bit_sums_buffers = detected_sums_list
+            self.target_data_buffers = target_data_list
+            char_code = bits_to_char_code(first_8bits if first_parity_ok else second_8bits)
+
+        if metrics is not None:
+            metrics.add_stage("decode", clock() - t4)
+
+        return {
+            "bits": [first_8bits, second_8bits],
+            "parity_ok": [first_parity_ok, second_parity_ok],
+            "sums": detected_sums_list,
+            "char_code": char_code,
+            "snr_db": snr_db,
+            "margins": margins,
+        }
+
+
+def choose_detection(burst: List[Dict]) -> Dict:
+    """
+    1文字分の検出から、窓が区間にそろっていたと考えられるものを選ぶ
+
+    送信側は同じ8ビットを2回送るので、前半と後半が一致しパリティも通るものを候補にし、
+    全搬送波で最も際どいビットの判定の余裕 (decision_margins) が最も大きいものを選ぶ。
+    窓がずれると区間和の一部が0に近づく。パリティを通った検出が無い場合は最後の検出 (char_code が None) を返す。
+    """
+    candidates = [d for d in burst if d["char_code"] is not None and d["bits"][0] == d["bits"][1]]
+    candidates = candidates or [d for d in burst if d["char_code"] is not None]
+    if not candidates:
+        return burst[-1]
+
+    def margin(detection: Dict) -> float:
+        return min(float(np.min(margins)) for margins in detection["margins"])
+
+    return max(candidates, key=margin)
+
+
+class CharacterAssembler:
+    """
+    process_block の結果を1文字ずつにまとめる
+
+    受信器はシンボル同期を持たず、1文字の区間内で窓の位置がずれた検出を何度も返す。
+    検出が続いている間を1文字とみなし、検出が途切れたところで choose_detection で1つを選ぶ。
+    metrics を渡すと、選んだ検出のSNRと判定の余裕、文字数を1文字につき1回だけ記録する
+    (process_block はブロックごとに検出を返すので、そこで記録すると1文字を何度も数えてしまう)。
+    """
+
+    def __init__(self, metrics=None):
+        """
+        :param metrics: 文字ごとの計測値を記録する receiver_metrics.ReceiverMetrics (None の場合は記録しない)
+        """
+        self.burst: List[Dict] = []
+        self.metrics = metrics
+
+    def push(self, result: Optional[Dict]) -> Optional[Dict]:
+        """1ブロック分の結果を追加し、1文字分の検出が終わった場合は選んだ検出を返す"""
+        if result is not None:
+            self.burst.append(result)
+            return None
+        return self.flush()
+
+    def flush(self) -> Optional[Dict]:
+        """途中の検出があれば1文字として選んで返す (入力の終わりで呼ぶ)"""
+        if not self.burst:
+            return None
+        detection = choose_detection(self.burst)
+        self.burst = []
+        if self.metrics is not None and detection["char_code"] is not None:
+            self.metrics.record_decision(detection["snr_db"], detection["margins"])
+            self.metrics.record_character(detection["char_code"])
+        return detection
@@ -3,6 +3,8 @@ from scipy.io import wavfile
 from scipy import signal
 import os
 import sys
+
+from coherent_demod import interval_sums
 # wavファイルを読み込む関数
 def read_wav_file(file_path):
     sample_rate, audio = wavfile.read(file_path)
@@ -49,11 +51,12 @@ def read_wav_file(file_path):
 
 #     return ''.join(map(str, bit_data))
 
-def detect_phase_shifting_sine_multiply(audio, sample_rate, frequency, switch_interval):
+def detect_phase_shifting_sine_multiply(audio, sample_rate, frequency, switch_interval, save_mixed_audio=True):
     """
     位相シフトサイン波からメッセージを復調する関数
 
     :param input_file: 入力WAVファイルの名前
+    :param save_mixed_audio: 乗算後の音声を wav/ に書き出すかどうか (ベンチマーク時はFalse)
     :return: 復調されたメッセージ
     """
 
@@ -76,13 +79,43 @@ def detect_phase_shifting_sine_multiply(audio, sample_rate, frequency, switch_in
     bit_data = (bit_sums <= threshold).astype(int)[1:]
 
     # ディレイ音声データと元の音声データを足した音声データをファイルに出力
-    wavfile.write(f"wav/mixed_audio_{frequency}.wav", sample_rate, mixed_audio)
+    if save_mixed_audio:
+        wavfile.write(f"wav/mixed_audio_{frequency}.wav", sample_rate, mixed_audio)
     # wavfile.write(f"wav/filtered_audio_{frequency}.wav", sample_rate, audio)
     # wavfile.write("delayed_audio.wav", sample_rate, delayed_audio)
 
     return ''.join(map(str, bit_data))
 
 
+def detect_phase_shifting_sine_coherent(audio, sample_rate, frequency, switch_interval):
+    """
+    位相シフトサイン波からメッセージを復調する関数 (コヒーレント検波)
+
+    遅延乗算の代わりに、1ビットの区間ごとに搬送波の複素参照信号へ射影し、隣り合う区間の位相を比べる。
+    全区間の射影は1回の行列積で計算する (coherent_demod.interval_sums)。
+    出力の形式は detect_phase_shifting_sine_multiply と同じ。
+
+    :return: 復調されたメッセージ
+    """
+    # 正規化
+    audio = audio / np.max(audio)
+
+    # 区間1以降の、直前の区間との位相の一致度 (同じ位相なら正)
+    bit_sums = interval_sums(audio, sample_rate, frequency, switch_interval)
+
+    # しきい値を設定して1ビットデータに変換
+    threshold = np.mean([np.max(bit_sums), np.min(bit_sums)])
+    bit_data = (bit_sums <= threshold).astype(int)
+
+    return ''.join(map(str, bit_data))
+
+
+DEMODULATORS = {
+    "multiply": detect_phase_shifting_sine_multiply,
+    "coherent": detect_phase_shifting_sine_coherent,
+}
+
+
 def bandpass_filter(audio, sample_rate, center_freq, guard_band_width):
     """
     帯域通過フィルタを適用し、指定された帯域のみを出力する関数
@@ -110,13 +143,14 @@ def bandpass_filter(audio, sample_rate, center_freq, guard_band_width):
 
     return filtered_audio
 
-def main(input_file, guard_band_width, parameters):
+def main(input_file, guard_band_width, parameters, demodulator="multiply"):
     """
     メイン関数：位相シフトサイン波復調のデモンストレーション
 
     :param input_file: 入力ファイル名
     :param guard_band_width: ガードバンド幅
     :param parameters: 周波数と位相反転間隔のパラメータリスト
+    :param demodulator: 復調方式 ("multiply": 遅延乗算, "coherent": 複素参照信号への射影)
     """
     print(f"入力ファイル: {input_file}")
     print("パラメータ設定:")
@@ -139,16 +173,16 @@ def main(input_file, guard_band_width, parameters):
         wavfile.write(f"wav/filtered_audio_{frequency}.wav", sample_rate, filtered_audio)
 
         # 位相シフトサイン波の復調
-        detected_message = detect_phase_shifting_sine_multiply(filtered_audio, sample_rate, frequency, switch_interval)
+        detected_message = DEMODULATORS[demodulator](filtered_audio, sample_rate, frequency, switch_interval)
 
         print(f"パラメータセット {i} の復調されたメッセージ: {detected_message}")
         result_messages.append(detected_message)
     
     return result_messages
 
-def convert_wave_to_binary(file_path,  frequency, switch_interval):
+def convert_wave_to_binary(file_path,  frequency, switch_interval, demodulator="multiply"):
     sample_rate, audio = read_wav_file(file_path)
-    detected_message = detect_phase_shifting_sine_multiply(audio, sample_rate, frequency, switch_interval)
+    detected_message = DEMODULATORS[demodulator](audio, sample_rate, frequency, switch_interval)
     return detected_message
 
 if __name__ == "__main__":
@@ -1,7 +1,7 @@
 import numpy as np
 from scipy.io import wavfile
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 def save_wav_file(audio: np.ndarray, sample_rate: int, output_file: str) -> None:
     """WAVファイルとして音声データを保存する"""
@@ -27,10 +27,14 @@ def binary_to_bpsk_phase(binary_message: str) -> str:
     return phase_data
 
 def calculate_signal_parameters(frequency: int, sample_rate: int, 
-                             switch_interval: int, phase_mask: str) -> Dict:
-    """信号生成に必要なパラメータを計算する"""
+                             switch_interval: int, phase_mask: str,
+                             period_samples: Optional[int] = None) -> Dict:
+    """信号生成に必要なパラメータを計算する (period_samples があれば1ビットは period_samples * switch_interval)"""
     bits_count = len(phase_mask)
-    samples_per_bit = sample_rate * switch_interval / frequency
+    if period_samples:
+        samples_per_bit = period_samples * switch_interval
+    else:
+        samples_per_bit = sample_rate * switch_interval / frequency
     total_samples = int(samples_per_bit * bits_count)
     duration = total_samples / sample_rate
     
@@ -70,14 +74,15 @@ def normalize_audio(audio: np.ndarray, to_int16: bool = True) -> np.ndarray:
     return normalized
 
 def generate_phase_shifting_sine(frequency: int, sample_rate: int, 
-                               switch_interval: int, binary_message: str) -> np.ndarray:
+                               switch_interval: int, binary_message: str,
+                               period_samples: Optional[int] = None) -> np.ndarray:
     """位相シフトサイン波を生成する"""
     print("\n=== 位相シフトサイン波の生成を開始します ===\n")
     
     # 位相マスクの生成と信号パラメータの計算
     phase_mask = binary_to_bpsk_phase(binary_message)
     print(f"phase_mask: {phase_mask}\n")
-    params = calculate_signal_parameters(frequency, sample_rate, switch_interval, phase_mask)
+    params = calculate_signal_parameters(frequency, sample_rate, switch_interval, phase_mask, period_samples)
     
     # 基本波形の生成と位相シフトの適用
     sine_wave = generate_base_sine_wave(frequency, params['duration'], params['total_samples'])
@@ -135,7 +140,8 @@ def generate_psk_signal(output_file: str, sample_rate: int,
             param['frequency'], 
             sample_rate, 
             param['switch_interval'], 
-            param['binary_message']
+            param['binary_message'],
+            param.get('period_samples')
         ) for param in waves
     ]
     
@@ -159,7 +165,8 @@ def generate_psk_signal_in_memory(sample_rate: int, waves: List[Dict]) -> np.nda
             param['frequency'], 
             sample_rate, 
             param['switch_interval'], 
-            param['binary_message']
+            param['binary_message'],
+            param.get('period_samples')
         ) for param in waves
     ]
     
@@ -2,16 +2,15 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import numpy as np
 from scipy.io import wavfile
-import pygame
 import threading
+import queue
 import random
-from pskgenerator import generate_phase_shifting_sine, combine_audio_signals, output_wav_file
+from pskgenerator import generate_phase_shifting_sine, combine_audio_signals, save_wav_file
 import datetime
 import os
 import math
-import wave
-from pskdetector_pureData import bandpass_filter, detect_phase_shifting_sine_multiply
-import soundcard as sc  # sounddeviceの代わりにsoundcardをインポート
+from streaming_decoder import StreamingPSKDecoder, WavStreamWriter, error_rate
+from audio_backend import SoundDeviceDuplex
 
 class PSKGeneratorGUI:
     def __init__(self, master):
@@ -29,13 +28,16 @@ class PSKGeneratorGUI:
         self.bps_values = []
         self.binary_messages = []  # 新しい属性を追加
         self.recorded_file = None  # 録音されたファイルのパスを保存するための変数を追加
-        self.mic = sc.default_microphone()  # デフォルトマイクを取得
+        self.save_files_var = tk.BooleanVar(value=True)  # 生成した音声と録音をWAVファイルに保存するか
+        self.generated_audio = None  # 生成した音声 (再生はファイルを介さずこの配列から行う)
+        self.player = None  # 再生・録音中のストリーム
+        self.record_queue = queue.SimpleQueue()  # コールバックから録音スレッドへ渡すブロック
         self.recording_thread = None
-        self.recording_data = []
-
-        pygame.mixer.init()
-
-        self.recording = False
+        self.recording_writer = None  # 録音を直接書き込むWAVファイル
+        self.decoders = []  # 録音しながら復調する搬送波ごとのデコーダ
+        self.planned_frames = 0  # 再生する音声の長さ (録音ファイルの事前確保に使う)
+        self.tail_frames = self.sample_rate // 2  # 再生し終わってから録音を続ける長さ (0.5秒)
+        self.skip_frames = 0  # 復調の前に読み飛ばす録音の先頭 (入出力の遅延の分)
 
         self.create_widgets()
 
@@ -52,6 +54,9 @@ class PSKGeneratorGUI:
         # バイナリメッセージ入力
         self.create_binary_message_widgets()
 
+        # WAVファイルに保存するかどうか (再生・録音・分析はファイルを使わずに行う)
+        ttk.Checkbutton(self.master, text="WAVファイルを保存する", variable=self.save_files_var).grid(row=4, column=0, columnspan=2, padx=5, pady=5)
+
         # 生成と再生ボタン
         self.play_button = ttk.Button(self.master, text="生成して再生", command=self.generate_play_and_record)
         self.play_button.grid(row=7, column=0, columnspan=2, padx=5, pady=5)
@@ -139,34 +144,35 @@ class PSKGeneratorGUI:
 
     def generate_play_and_record(self):
         if self.is_playing:
-            pygame.mixer.music.stop()
-            self.is_playing = False
-            self.recording = False
+            if self.player is not None:
+                self.player.stop()  # 再生スレッドの wait() が戻り、録音の停止と分析が行われる
             self.play_button.config(text="生成して再生")
         else:
             self.generate_wav()
-            if self.output_file:
+            if self.generated_audio is not None:
                 self.play_and_record_audio()
 
     def play_and_record_audio(self):
+        self.start_recording()
+        # 再生と録音を1つのストリームで行うので、録音の先頭は再生の先頭と同じサンプル位置になる
+        self.player = SoundDeviceDuplex(self.generated_audio, self.sample_rate,
+                                        on_input=lambda block, position: self.record_queue.put(block),
+                                        tail_frames=self.tail_frames)
+        # 再生と録音のサンプルクロックが同じなので、ずれはデバイスの遅延だけになる。その分を読み飛ばしてビットの区間をそろえる
+        self.skip_frames = self.player.latency_frames
+
         def play_thread():
-            self.recording = True
-            pygame.mixer.music.load(self.output_file)
-
-            self.start_recording()
-            
-            pygame.mixer.music.play()
-            
-            # 再生が終了するまで待機
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
-            
+            self.player.start()
+            # 再生が終了するまで待機 (ポーリングせず、ストリームの終了を待つ)
+            self.player.wait()
+
             # 再生が終了したら自動的に停止
+            self.player.stop()
             self.is_playing = False
-            self.recording = False
             self.stop_recording()
             self.master.after(0, lambda: self.play_button.config(text="生成して再生"))
-            self.master.after(0, lambda: self.play_recorded_button.config(state="normal"))  # 録音ファイル再生ボタンを有効化
+            if self.recorded_file:
+                self.master.after(0, lambda: self.play_recorded_button.config(state="normal"))  # 録音ファイル再生ボタンを有効化
             self.analyze_recorded_audio()
 
         threading.Thread(target=play_thread, daemon=True).start()
@@ -174,7 +180,22 @@ class PSKGeneratorGUI:
         self.play_button.config(text="停止")
 
     def start_recording(self):
-        self.recording_data = []
+        self.recorded_file = None
+        self.recording_writer = None
+        if self.save_files_var.get():
+            current_date = datetime.datetime.now().strftime("%Y%m%d")
+            record_dir = os.path.join(".", "recordings", current_date)
+            os.makedirs(record_dir, exist_ok=True)
+            self.recorded_file = os.path.join(record_dir, f"recorded_{os.path.basename(self.output_file)}")
+            # 再生の長さ + 録音を続ける長さを確保しておき、足りなければ WavStreamWriter が伸ばす
+            self.recording_writer = WavStreamWriter(self.recorded_file, self.sample_rate, self.planned_frames + self.tail_frames)
+        self.decoders = []
+        for freq_var, bps_var in zip(self.frequencies, self.bps_values):
+            frequency = freq_var.get()
+            switch_interval = self.calculate_switch_interval(frequency, int(bps_var.get()))
+            self.decoders.append(StreamingPSKDecoder(frequency, switch_interval, self.sample_rate, 200))
+
+        self.recording = True
         self.recording_thread = threading.Thread(target=self._record_audio, daemon=True)
         self.recording_thread.start()
         print("録音開始...")
@@ -182,57 +203,42 @@ class PSKGeneratorGUI:
     def stop_recording(self):
         self.recording = False
         if self.recording_thread:
+            self.record_queue.put(None)  # キューに残ったブロックを処理し終えたら止まる
             self.recording_thread.join()
+            self.recording_thread = None
         print("録音終了")
-        self.save_recorded_audio()
+        if self.recording_writer is not None:
+            self.recording_writer.close()
+            self.recording_writer = None
 
     def _record_audio(self):
-        while self.recording:
-            data = self.mic.record(samplerate=self.sample_rate, numframes=self.sample_rate // 10)  # 0.1秒ごとに録音
-            self.recording_data.append(data)
-
-    def save_recorded_audio(self):
-        if not self.recording_data:
-            print("録音データがありません。")
-            return
-
-        current_date = datetime.datetime.now().strftime("%Y%m%d")
-        record_dir = os.path.join(".", "recordings", current_date)
-        os.makedirs(record_dir, exist_ok=True)
-        self.recorded_file = os.path.join(record_dir, f"recorded_{os.path.basename(self.output_file)}")
-
-        combined_data = np.concatenate(self.recording_data)
-        with wave.open(self.recorded_file, 'wb') as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)  # float32を16ビット整数に変換
-            wf.setframerate(self.sample_rate)
-            wf.writeframes((combined_data * 32767).astype(np.int16).tobytes())
+        # コールバックはキューに積むだけにして、ファイルへの書き込みと復調はこのスレッドで行う
+        while True:
+            block = self.record_queue.get()
+            if block is None:
+                break
+            if self.recording_writer is not None:
+                self.recording_writer.write(block)
+            if self.skip_frames > 0:
+                skipped = min(self.skip_frames, len(block))
+                self.skip_frames -= skipped
+                block = block[skipped:]
+            for decoder in self.decoders:
+                decoder.push(block)
 
     def analyze_recorded_audio(self):
-        print("録音された音声の分析を開始します...")
-        sample_rate, audio = wavfile.read(self.recorded_file)
-
-        for i, (freq_var, bps_var) in enumerate(zip(self.frequencies, self.bps_values)):
-            frequency = freq_var.get()
-            bps = int(bps_var.get())
-            switch_interval = self.calculate_switch_interval(frequency, bps)
-            
-            filtered_audio = bandpass_filter(audio, sample_rate, frequency, 200)
-            detected_message = detect_phase_shifting_sine_multiply(filtered_audio, sample_rate, frequency, switch_interval)
-            
-            original_message = self.binary_messages[i]
-            error_rate = self.calculate_error_rate(original_message, detected_message)
-            
-            print(f"周波数 {frequency}Hz:")
+        """録音中に復調を済ませているので、判定と誤り率の表示だけを行う"""
+        print("録音された音声の分析結果:")
+        for original_message, decoder in zip(self.binary_messages, self.decoders):
+            detected_message = decoder.bits()[:len(original_message)]
+            print(f"周波数 {decoder.frequency}Hz:")
             print(f"  元のメッセージ: {original_message}")
             print(f"  検出されたメッセージ: {detected_message}")
-            print(f"  誤り率: {error_rate:.2f}%")
+            print(f"  誤り率: {self.calculate_error_rate(original_message, detected_message):.2f}%")
 
     def calculate_error_rate(self, original, detected):
-        if len(original) != len(detected):
-            return 100.0  # 長さが異なる場合は100%エラーとする
-        errors = sum(a != b for a, b in zip(original, detected))
-        return (errors / len(original)) * 100
+        # 録音は再生より長いので、検出したビット列の先頭から比べる (足りない場合は100%)
+        return error_rate(original, detected)
 
     def generate_wav(self):
         audio_signals = []
@@ -250,7 +256,8 @@ class PSKGeneratorGUI:
 
         current_date = datetime.datetime.now().strftime("%Y%m%d")
         default_save_directory = os.path.join(".", "wav", current_date)
-        os.makedirs(default_save_directory, exist_ok=True)
+        if self.save_files_var.get():
+            os.makedirs(default_save_directory, exist_ok=True)
 
         # すべてのパラメーターを含むファイル名を生成
         filename = f"PSK_{'_'.join(filename_parts)}.wav"
@@ -262,15 +269,24 @@ class PSKGeneratorGUI:
 
         self.output_file = os.path.join(default_save_directory, filename)
 
-        combined_audio = combine_audio_signals(*audio_signals)
+        waves = [{"frequency": freq_var.get()} for freq_var in self.frequencies]
+        combined_audio = combine_audio_signals(*audio_signals, waves=waves)
+        self.generated_audio = combined_audio
+        self.planned_frames = len(combined_audio)
+        self.print_binary_messages()  # バイナリメッセージを表示
+        if self.save_files_var.get():
+            # 再生はメモリ上の配列から行うので、ファイルへの保存は待たずに別スレッドで行う
+            threading.Thread(target=self._save_generated_audio, args=(combined_audio, self.output_file), daemon=True).start()
+
+    def _save_generated_audio(self, audio, output_file):
         try:
-            output_wav_file(combined_audio, self.sample_rate, self.output_file)
-            print(f"WAVファイルが生成されました: {self.output_file}")
-            self.print_binary_messages()  # バイナリメッセージを表示
+            save_wav_file(audio, self.sample_rate, output_file)
+            print(f"WAVファイルが生成されました: {output_file}")
         except PermissionError:
-            messagebox.showerror("エラー", f"ファイル {self.output_file} への書き込み権限がありません。")
+            self.master.after(0, lambda: messagebox.showerror("エラー", f"ファイル {output_file} への書き込み権限がありません。"))
         except Exception as e:
-            messagebox.showerror("エラー", f"WAVファイルの生成中にエラーが発生しました: {str(e)}")
+            message = f"WAVファイルの生成中にエラーが発生しました: {str(e)}"
+            self.master.after(0, lambda: messagebox.showerror("エラー", message))
 
     def print_binary_messages(self):
         print("埋め込まれたバイナリメッセージ:")
@@ -278,11 +294,11 @@ class PSKGeneratorGUI:
             print(f"周波数 {i}: {message}")
 
     def play_audio(self):
+        self.player = SoundDeviceDuplex(self.generated_audio, self.sample_rate)
+
         def play_thread():
-            pygame.mixer.music.load(self.output_file)
-            pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
+            with self.player:
+                self.player.wait()
             self.is_playing = False
             self.master.after(0, lambda: self.play_button.config(text="生成して再生"))
 
@@ -296,10 +312,9 @@ class PSKGeneratorGUI:
             return
 
         def play_thread():
-            pygame.mixer.music.load(self.recorded_file)
-            pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
+            sample_rate, audio = wavfile.read(self.recorded_file)
+            with SoundDeviceDuplex(audio, sample_rate) as player:
+                player.wait()
 
         threading.Thread(target=play_thread, daemon=True).start()
 
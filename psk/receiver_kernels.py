@@ -0,0 +1,215 @@
+"""
+PSKReceiver の搬送波ごとの処理 (ゲイン → 遅延乗算 → 区間の積分) を1つにまとめたカーネル
+
+NumPy の経路では1ブロック・1搬送波ごとに
+    filtered_data * gain, np.roll (3回), filtered_data * delayed * 4, np.abs, np.mean, 区間ごとの np.sum
+と配列を何度も走査し、そのたびに一時配列を確保する。
+ここではそれを1つの関数の中のループにまとめ、リングバッファはその場でずらす。
+numba があれば JIT コンパイルして使い (kernels="numba")、無ければ警告を表示して NumPy の経路を使う。
+
+NumPy の経路と結果がビット単位で一致するように、以下をそろえている。
+  - 要素ごとの演算は NumPy と同じ順序 ((filtered * gain) * delayed) * 4 で行う
+  - 和は NumPy の np.sum と同じペアワイズ加算 (pairwise_sum) で求める (8個ずつの部分和、128個を超えたら二分割)
+  - ゲインの更新式は psk_receiver.py と同じ式を同じ順序で計算する
+  - float32 の配列では、NumPy と同じく演算ごとに float32 に丸める (scratch に書いて読み戻す。
+    float32 どうしの四則演算は float64 で計算してから丸めても結果は同じ)
+バンドパスフィルタ (scipy.signal.filtfilt) は前後のパディングを含めて同じ結果を作るのが難しいので、カーネルには含めない。
+
+python receiver_kernels.py で NumPy の経路との一致と速度を確認できる (numba が必要)。
+"""
+import contextlib
+import io
+import sys
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+KERNELS = ("numpy", "numba")
+PAIRWISE_BLOCKSIZE = 128  # NumPy の PW_BLOCKSIZE と同じ
+
+
+def rounded(scratch: np.ndarray, value: float) -> float:
+    """value を scratch の型 (処理している配列の型) に丸める"""
+    scratch[8] = value
+    return scratch[8]
+
+
+def pairwise_sum(values: np.ndarray, start: int, count: int, absolute: bool, scratch: np.ndarray) -> float:
+    """
+    values[start:start + count] の和を np.sum と同じ順序で求める (absolute=True なら絶対値の和)
+
+    NumPy の浮動小数点の add.reduce (loops_utils.h の pairwise_sum) と同じ分け方で足す。
+    scratch は values と同じ型の長さ9の作業用配列 (scratch[:8] が部分和)。
+    """
+    if count < 8:
+        scratch[0] = 0
+        for i in range(start, start + count):
+            scratch[0] += abs(values[i]) if absolute else values[i]
+        return scratch[0]
+    if count <= PAIRWISE_BLOCKSIZE:
+        partial = scratch
+        for j in range(8):
+            partial[j] = abs(values[start + j]) if absolute else values[start + j]
+        i = 8
+        while i < count - count % 8:
+            for j in range(8):
+                partial[j] += abs(values[start + i + j]) if absolute else values[start + i + j]
+            i += 8
+        low = rounded(scratch, rounded(scratch, partial[0] + partial[1]) + rounded(scratch, partial[2] + partial[3]))
+        high = rounded(scratch, rounded(scratch, partial[4] + partial[5]) + rounded(scratch, partial[6] + partial[7]))
+        total = rounded(scratch, low + high)
+        while i < count:
+            total = rounded(scratch, total + (abs(values[start + i]) if absolute else values[start + i]))
+            i += 1
+        return total
+    half = count // 2
+    half -= half % 8
+    first = pairwise_sum(values, start, half, absolute, scratch)
+    second = pairwise_sum(values, start + half, count - half, absolute, scratch)
+    return rounded(scratch, first + second)
+
+
+def carrier_block(filtered: np.ndarray, gain: float, max_gain: float, target_max: float,
+                  increase_rate: float, decrease_rate: float,
+                  original: np.ndarray, delayed: np.ndarray, multiplied: np.ndarray,
+                  buffer_size: int, delay_samples: int, num_intervals: int, sums: np.ndarray):
+    """
+    1搬送波・1ブロック分のゲイン調整、リングバッファの更新、遅延乗算、区間の積分
+
+    original / delayed / multiplied は psk_receiver.PSKReceiver のバッファで、その場で更新する。
+    sums には最新の num_intervals 区間の和を書き込む。filtered とバッファは同じ型 (float32 または float64)。
+
+    :return: (更新後のゲイン, 判定区間の絶対値の平均 (信号の強さ))
+    """
+    n = len(filtered)
+    scratch = np.empty(9, dtype=multiplied.dtype)
+
+    # ゲインの自動調整 (psk_receiver.py と同じ式)
+    current_max = 0.0
+    for k in range(n):
+        value = abs(filtered[k])
+        if value > current_max:
+            current_max = value
+    if current_max > 0:
+        target_gain = min(target_max / current_max, max_gain)
+        adjust_rate = increase_rate if target_gain > gain else decrease_rate
+        gain = gain * (1 - adjust_rate) + target_gain * adjust_rate
+
+    # リングバッファを n サンプルずらし、ゲインをかけた新しいサンプルを末尾に書く
+    # (NumPy と同じく、ゲインは配列の型に丸めてから掛ける)
+    applied_gain = rounded(scratch, gain)
+    four = rounded(scratch, 4)
+    for buffer in (original, delayed):
+        length = len(buffer)
+        for k in range(length - n):
+            buffer[k] = buffer[k + n]
+        for k in range(n):
+            buffer[length - n + k] = filtered[k] * applied_gain
+
+    # delay_samples だけ前のサンプルと掛け合わせる (delayed[buffer_size - n:buffer_size] が遅延したサンプル)
+    length = len(multiplied)
+    for k in range(length - n):
+        multiplied[k] = multiplied[k + n]
+    for k in range(n):
+        multiplied[length - n + k] = rounded(scratch, rounded(scratch, filtered[k] * applied_gain)
+                                            * delayed[buffer_size - n + k]) * four
+
+    # 最新の num_intervals 区間の和と信号の強さ
+    window = delay_samples * num_intervals
+    start = length - window
+    for j in range(num_intervals):
+        sums[j] = pairwise_sum(multiplied, start + j * delay_samples, delay_samples, False, scratch)
+    level = rounded(scratch, pairwise_sum(multiplied, start, window, True, scratch) / window)
+    return gain, level
+
+
+def load_kernel(kernels: str) -> Optional[Callable]:
+    """
+    kernels="numba" のカーネルを返す (kernels="numpy" の場合は None = NumPy の経路)
+
+    numba が無い場合は警告を表示して None を返し、受信器は NumPy の経路で動く。
+    初回の呼び出しでコンパイルされる。cache=True なので2回目以降の起動ではキャッシュを使う。
+    """
+    if kernels not in KERNELS:
+        raise ValueError(f"未対応のカーネルです: {kernels}")
+    if kernels == "numpy":
+        return None
+    if numba is None:
+        print("警告: numba がインストールされていないため、NumPy の経路で受信します (pip install numba)",
+              file=sys.stderr)
+        return None
+    return _compiled_kernel()
+
+
+_compiled = None
+
+
+def _compiled_kernel() -> Callable:
+    global _compiled, rounded, pairwise_sum
+    if _compiled is None:
+        rounded = numba.njit(cache=True)(rounded)
+        pairwise_sum = numba.njit(cache=True)(pairwise_sum)
+        _compiled = numba.njit(cache=True)(carrier_block)
+    return _compiled
+
+
+def main() -> int:
+    """NumPy の経路とカーネルの経路に同じ入力を与え、結果の一致と1ブロックあたりの時間を比べる"""
+    from psk_receiver import PSKReceiver
+    from psk_charcodec import build_waves, char_code_to_bits
+    from pskgenerator import combine_audio_signals, generate_phase_shifting_sine
+
+    if numba is None:
+        print("numba がインストールされていないため、カーネルを確認できません (pip install numba)")
+        return 1
+
+    sample_rate = 44100
+    block_size = 1024
+    waves = build_waves(char_code_to_bits(ord("s")))
+    with contextlib.redirect_stdout(io.StringIO()):
+        signals = [generate_phase_shifting_sine(w["frequency"], sample_rate, w["switch_interval"], w["binary_message"])
+                   for w in waves]
+        audio = combine_audio_signals(*signals, waves=waves).astype(np.float64) / 32768.0
+    rng = np.random.default_rng(0)
+    audio = np.concatenate([np.zeros(block_size * 4), audio, np.zeros(block_size * 4)])
+    audio = audio + rng.normal(0, 0.01, len(audio))
+
+    blocks = [audio[start:start + block_size] for start in range(0, len(audio) - block_size + 1, block_size)]
+    mismatches = 0
+    for dtype in (np.float64, np.float32):
+        receivers = {kernels: PSKReceiver(sample_rate=sample_rate, kernels=kernels, dtype=dtype) for kernels in KERNELS}
+        count = 0
+        for block in blocks:
+            results = {kernels: receiver.process_block(block) for kernels, receiver in receivers.items()}
+            expected, actual = results["numpy"], results["numba"]
+            if (expected is None) != (actual is None):
+                count += 1
+            elif expected is not None and not all(np.array_equal(a, b) for a, b in zip(expected["sums"], actual["sums"])):
+                count += 1
+        for i in range(len(receivers["numpy"].waves)):
+            for name in ("plotdata_originals", "plotdata_multiplies"):
+                if not np.array_equal(getattr(receivers["numpy"], name)[i], getattr(receivers["numba"], name)[i]):
+                    count += 1
+            if receivers["numpy"].current_gains[i] != receivers["numba"].current_gains[i]:
+                count += 1
+        print(f"{np.dtype(dtype).name}: {len(blocks)} ブロック, 不一致 {count} 件")
+        mismatches += count
+
+        for kernels, receiver in receivers.items():
+            start = time.perf_counter()
+            for _ in range(5):
+                for block in blocks:
+                    receiver.process_block(block)
+            elapsed = (time.perf_counter() - start) / (5 * len(blocks))
+            print(f"  {kernels:<6} {elapsed * 1000:8.3f} ms/ブロック")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
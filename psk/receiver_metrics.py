@@ -0,0 +1,303 @@
+"""
+受信処理 (PSKReceiver / detector_v3.py) の計測と出力
+
+コールバックごとに print するだけでは、受信器がブロックの締め切り (blocksize / sample_rate) に
+間に合っているかどうかが分からない。ここでは以下を集計し、一定間隔でまとめて出力する。
+
+  - ステージごとの処理時間: filter / agc / delay_multiply / sums / decode
+  - コールバックの処理時間と締め切りの比 (負荷率)、締め切りを超えた回数
+  - PortAudio の status によるオーバーフローの回数
+  - 搬送波ごとの信号の強さとゲイン
+  - 搬送波ごとのSNRと判定の余裕 (検出時の平均と最小)、最も余裕の小さい搬送波 (limiting_carrier)
+  - 復号した文字数と 文字/秒
+
+出力先は環境変数 PSK_METRICS で指定する (指定しなければ計測自体を行わない)。
+    PSK_METRICS=jsonl:metrics.jsonl   1行1スナップショットのJSON
+    PSK_METRICS=http:9100             http://127.0.0.1:9100/ でテキスト形式 (名前 値) を返す
+    PSK_METRICS_INTERVAL=1.0          集計の間隔 (秒)
+
+オーバーヘッドについて:
+  PSKReceiver は metrics が None のときは time.perf_counter を呼ばない。
+  計測するときも各ステージで perf_counter を2回呼んで足し込むだけで、ロックは取らない。
+  集計値は区間ごとのオブジェクト (_Window) にためておき、出力スレッドが新しいものと差し替えてから読む。
+  差し替えの瞬間に書き込まれた1ブロック分が失われることがあるが、監視用途なので許容する。
+"""
+import http.server
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+STAGES = ("filter", "agc", "delay_multiply", "sums", "decode")
+NEAR_DEADLINE_RATIO = 0.8  # 締め切りのこの割合を超えたコールバックを「締め切り間際」として数える
+
+
+class _Window:
+    """1つの集計区間の値 (コールバックのスレッドだけが書き込む)"""
+
+    def __init__(self, num_carriers: int):
+        self.started = time.perf_counter()
+        self.stage_totals = dict.fromkeys(STAGES, 0.0)
+        self.stage_max = dict.fromkeys(STAGES, 0.0)
+        self.blocks = 0
+        self.callbacks = 0
+        self.callback_total = 0.0
+        self.callback_max = 0.0
+        self.load_max = 0.0
+        self.deadline_misses = 0
+        self.near_deadline = 0
+        self.overflows = 0
+        self.characters = 0
+        self.levels = [0.0] * num_carriers
+        self.gains = [0.0] * num_carriers
+        self.decisions = 0
+        self.snr_totals = [0.0] * num_carriers
+        self.snr_counts = [0] * num_carriers  # nan (推定できなかったSNR) を除いた数
+        self.margin_totals = [0.0] * num_carriers  # 検出ごとの「その搬送波で最も際どいビットの余裕」の和
+        self.margin_min = [float("inf")] * num_carriers
+
+
+class ReceiverMetrics:
+    """受信処理の計測値を集計するクラス"""
+
+    def __init__(self, frequencies: List[float], sample_rate: int):
+        self.frequencies = list(frequencies)
+        self.sample_rate = sample_rate
+        self.window = _Window(len(self.frequencies))
+        self.totals = {"blocks": 0, "characters": 0, "deadline_misses": 0, "overflows": 0}
+        self.latest: Optional[Dict] = None  # 最後に集計したスナップショット
+        self.exporters = []
+        self.thread = None
+        self.running = False
+
+    # ---- コールバックのスレッドから呼ぶ ----
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        window = self.window
+        window.stage_totals[name] += seconds
+        if seconds > window.stage_max[name]:
+            window.stage_max[name] = seconds
+
+    def record_block(self, levels: List[float], gains: List[float]) -> None:
+        """process_block 1回分の搬送波ごとの信号の強さとゲイン"""
+        window = self.window
+        window.blocks += 1
+        # float32 の受信器では np.float32 になるので、JSONに書けるように float にしておく
+        window.levels = [float(level) for level in levels]
+        window.gains = [float(gain) for gain in gains]
+
+    def record_decision(self, snr_db: List[float], margins: List) -> None:
+        """
+        検出1回分の搬送波ごとのSNR (dB) と判定の余裕
+
+        :param margins: 搬送波ごとのビットの判定の余裕 (psk_receiver.decision_margins)
+        """
+        window = self.window
+        window.decisions += 1
+        for i, (snr, carrier_margins) in enumerate(zip(snr_db, margins)):
+            if math.isfinite(snr):
+                window.snr_totals[i] += snr
+                window.snr_counts[i] += 1
+            worst = float(min(carrier_margins)) if len(carrier_margins) else 0.0
+            window.margin_totals[i] += worst
+            if worst < window.margin_min[i]:
+                window.margin_min[i] = worst
+
+    def record_character(self, char_code: int) -> None:
+        self.window.characters += 1
+
+    def record_callback(self, seconds: float, frames: int, status=None) -> None:
+        """
+        コールバック1回分の処理時間
+
+        :param frames: ブロックのフレーム数 (締め切りは frames / sample_rate 秒)
+        :param status: sounddevice の CallbackFlags (input_overflow を数える)
+        """
+        window = self.window
+        deadline = frames / self.sample_rate
+        load = seconds / deadline if deadline > 0 else 0.0
+        window.callbacks += 1
+        window.callback_total += seconds
+        if seconds > window.callback_max:
+            window.callback_max = seconds
+        if load > window.load_max:
+            window.load_max = load
+        if load > 1.0:
+            window.deadline_misses += 1
+        elif load > NEAR_DEADLINE_RATIO:
+            window.near_deadline += 1
+        if status is not None and getattr(status, "input_overflow", False):
+            window.overflows += 1
+
+    # ---- 集計 ----
+
+    def snapshot(self) -> Dict:
+        """今の集計区間を閉じてスナップショットを返す (次の区間は0から数える)"""
+        window = self.window
+        self.window = _Window(len(self.frequencies))
+        # 信号の強さとゲインは、次の区間にブロックが来なくても最後の値を表示する
+        self.window.levels = window.levels
+        self.window.gains = window.gains
+        elapsed = max(time.perf_counter() - window.started, 1e-9)
+
+        self.totals["blocks"] += window.blocks
+        self.totals["characters"] += window.characters
+        self.totals["deadline_misses"] += window.deadline_misses
+        self.totals["overflows"] += window.overflows
+
+        blocks = max(window.blocks, 1)
+        callbacks = max(window.callbacks, 1)
+        carriers = []
+        for i, frequency in enumerate(self.frequencies):
+            carrier = {"frequency": frequency, "level": window.levels[i], "gain": window.gains[i],
+                       "snr_db": None, "mean_margin": None, "min_margin": None}
+            if window.snr_counts[i]:
+                carrier["snr_db"] = window.snr_totals[i] / window.snr_counts[i]
+            if window.decisions:
+                carrier["mean_margin"] = window.margin_totals[i] / window.decisions
+                carrier["min_margin"] = window.margin_min[i]
+            carriers.append(carrier)
+        limiting = None
+        if window.decisions:
+            limiting = min(carriers, key=lambda carrier: carrier["mean_margin"])["frequency"]
+        snapshot = {
+            "time": time.time(),
+            "interval_seconds": elapsed,
+            "blocks": window.blocks,
+            "stages_ms": {
+                name: {"mean": window.stage_totals[name] / blocks * 1000, "max": window.stage_max[name] * 1000}
+                for name in STAGES
+            },
+            "callback": {
+                "count": window.callbacks,
+                "mean_ms": window.callback_total / callbacks * 1000,
+                "max_ms": window.callback_max * 1000,
+                "max_load": window.load_max,
+                "near_deadline": window.near_deadline,
+                "deadline_misses": window.deadline_misses,
+                "overflows": window.overflows,
+            },
+            "carriers": carriers,
+            "decisions": window.decisions,
+            "limiting_carrier": limiting,
+            "characters": window.characters,
+            "chars_per_second": window.characters / elapsed,
+            "totals": dict(self.totals),
+        }
+        self.latest = snapshot
+        return snapshot
+
+    # ---- 出力 ----
+
+    def start(self, interval: float = 1.0) -> None:
+        """interval 秒ごとに集計して exporters に渡すスレッドを開始する"""
+        self.running = True
+        self.window = _Window(len(self.frequencies))
+
+        def run():
+            while self.running:
+                time.sleep(interval)
+                snapshot = self.snapshot()
+                for exporter in self.exporters:
+                    exporter.export(snapshot)
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for exporter in self.exporters:
+            exporter.close()
+
+
+class JsonLinesExporter:
+    """スナップショットを1行ずつJSONで追記する"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def export(self, snapshot: Dict) -> None:
+        self.file.write(json.dumps(snapshot, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def format_text(snapshot: Optional[Dict]) -> str:
+    """スナップショットを「名前 値」の行にする (HTTPで返す形式)"""
+    if snapshot is None:
+        return "# まだ集計されていません\n"
+    lines = [
+        f"psk_blocks {snapshot['blocks']}",
+        f"psk_chars_per_second {snapshot['chars_per_second']:.3f}",
+    ]
+    for name, stats in snapshot["stages_ms"].items():
+        lines.append(f'psk_stage_ms{{stage="{name}",stat="mean"}} {stats["mean"]:.4f}')
+        lines.append(f'psk_stage_ms{{stage="{name}",stat="max"}} {stats["max"]:.4f}')
+    for key, value in snapshot["callback"].items():
+        lines.append(f"psk_callback_{key} {value:.4f}" if isinstance(value, float) else f"psk_callback_{key} {value}")
+    for carrier in snapshot["carriers"]:
+        label = f'{{frequency="{carrier["frequency"]}"}}'
+        lines.append(f"psk_carrier_level{label} {carrier['level']:.5f}")
+        lines.append(f"psk_carrier_gain{label} {carrier['gain']:.3f}")
+        if carrier["snr_db"] is not None:
+            lines.append(f"psk_carrier_snr_db{label} {carrier['snr_db']:.2f}")
+        if carrier["mean_margin"] is not None:
+            lines.append(f"psk_carrier_mean_margin{label} {carrier['mean_margin']:.4f}")
+            lines.append(f"psk_carrier_min_margin{label} {carrier['min_margin']:.4f}")
+    if snapshot["limiting_carrier"] is not None:
+        lines.append(f'psk_limiting_carrier{{frequency="{snapshot["limiting_carrier"]}"}} 1')
+    for key, value in snapshot["totals"].items():
+        lines.append(f"psk_total_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class HttpExporter:
+    """最後のスナップショットを http://127.0.0.1:<port>/ でテキストとして返す"""
+
+    def __init__(self, metrics: ReceiverMetrics, port: int, host: str = "127.0.0.1"):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = format_text(metrics.latest).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # アクセスごとのログは出さない
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def export(self, snapshot: Dict) -> None:
+        pass  # ReceiverMetrics.latest を直接返すので何もしない
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def metrics_from_env(frequencies: List[float], sample_rate: int) -> Optional[ReceiverMetrics]:
+    """PSK_METRICS に従って計測を開始する (未指定なら None)"""
+    target = os.environ.get("PSK_METRICS")
+    if not target:
+        return None
+    kind, _, value = target.partition(":")
+    metrics = ReceiverMetrics(frequencies, sample_rate)
+    if kind == "jsonl":
+        metrics.exporters.append(JsonLinesExporter(value or "receiver_metrics.jsonl"))
+    elif kind == "http":
+        metrics.exporters.append(HttpExporter(metrics, int(value or 9100)))
+    else:
+        raise ValueError(f"PSK_METRICS の形式が不正です (jsonl:<パス> または http:<ポート>): {target}")
+    metrics.start(float(os.environ.get("PSK_METRICS_INTERVAL", "1.0")))
+    return metrics
@@ -0,0 +1,145 @@
+"""
+録音しながらのWAV書き込みと復調 (pskgeneratorGui.py 用)
+
+録音したブロックをリストにためて、再生終了後に 連結 → WAV書き込み → 読み直し → 搬送波ごとに復調
+とする代わりに、ブロックが届くたびに
+  - WavStreamWriter: 事前に大きさを決めたWAVファイルの memmap にそのままコピーする
+  - StreamingPSKDecoder: バンドパスフィルタ (状態を持ち越す sosfilt) と遅延乗算を進め、1ビットの区間ごとの和をためる
+を行う。再生が終わった時点で残っているのは最後の区間の判定だけなので、誤り率はすぐに表示できる。
+
+判定は pskdetector_pureData.detect_phase_shifting_sine_multiply と同じく、
+区間和の最大値と最小値の中間をしきい値にして、最初の区間 (基準) を除いたビット列を返す。
+フィルタは filtfilt (前後2回) ではなく1回だけの因果的なフィルタなので、わずかな群遅延がある。
+"""
+import wave
+from typing import List
+
+import numpy as np
+from scipy import signal
+
+
+class WavStreamWriter:
+    """
+    16ビットモノラルのWAVファイルに、ブロックを追記していく
+
+    ヘッダを書いたあと、データ部分を capacity_frames の大きさで確保して memmap で開く。
+    足りなくなった場合はファイルを2倍に伸ばして開き直す。close() で実際の長さに切り詰めてヘッダを直す。
+    """
+
+    def __init__(self, path: str, sample_rate: int, capacity_frames: int):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.frames_written = 0
+
+        # wave モジュールで正しいヘッダを書き、データ部分の開始位置を知る
+        with wave.open(path, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(sample_rate)
+            wf.writeframes(b"")
+        with open(path, "rb") as f:
+            self.data_offset = len(f.read())
+        self._open(max(1, capacity_frames))
+
+    def _open(self, capacity_frames: int) -> None:
+        with open(self.path, "r+b") as f:
+            f.truncate(self.data_offset + capacity_frames * 2)
+        self.capacity_frames = capacity_frames
+        self.data = np.memmap(self.path, dtype="<i2", mode="r+", offset=self.data_offset, shape=(capacity_frames,))
+
+    def write(self, block: np.ndarray) -> None:
+        """float (-1〜1) または int16 のブロックを追記する"""
+        block = np.asarray(block).reshape(-1)
+        end = self.frames_written + len(block)
+        if end > self.capacity_frames:
+            self.data.flush()
+            del self.data
+            self._open(max(end, self.capacity_frames * 2))
+        target = self.data[self.frames_written:end]
+        if block.dtype.kind == "f":
+            np.clip(block * 32767, -32768, 32767, out=target, casting="unsafe")
+        else:
+            target[:] = block
+        self.frames_written = end
+
+    def close(self) -> None:
+        """実際に書いた長さに切り詰め、ヘッダのサイズを書き直す"""
+        if self.data is None:
+            return
+        self.data.flush()
+        self.data = None
+        data_bytes = self.frames_written * 2
+        with open(self.path, "r+b") as f:
+            f.truncate(self.data_offset + data_bytes)
+            f.seek(4)
+            f.write((self.data_offset + data_bytes - 8).to_bytes(4, "little"))
+            f.seek(self.data_offset - 4)
+            f.write(data_bytes.to_bytes(4, "little"))
+
+
+class StreamingPSKDecoder:
+    """1つの搬送波の遅延乗算復調を、ブロックごとに進める"""
+
+    def __init__(self, frequency: float, switch_interval: int, sample_rate: int, bandwidth: float = 200):
+        """
+        :param bandwidth: バンドパスフィルタの幅 (pskdetector_pureData.bandpass_filter のガードバンド幅と同じ)
+        """
+        self.frequency = frequency
+        self.delay_samples = int(sample_rate * switch_interval / frequency)
+
+        nyquist = 0.5 * sample_rate
+        low = (frequency - bandwidth / 2) / nyquist
+        high = (frequency + bandwidth / 2) / nyquist
+        self.sos = signal.butter(1, [low, high], btype="band", output="sos")
+        self.zi = np.zeros((self.sos.shape[0], 2))
+
+        # 直前の1ビット分のフィルタ出力 (遅延乗算の相手)。録音の先頭より前は0とみなす
+        self.previous = np.zeros(self.delay_samples)
+        self.position = 0  # 処理したサンプル数
+        self.current_sum = 0.0  # 途中の区間の和
+        self.sums: List[float] = []  # 完成した区間の和
+
+    def push(self, block: np.ndarray) -> None:
+        """録音したブロックを処理する"""
+        block = np.asarray(block, dtype=np.float64).reshape(-1)
+        if len(block) == 0:
+            return
+        filtered, self.zi = signal.sosfilt(self.sos, block, zi=self.zi)
+        delay = self.delay_samples
+        # filtered[n] * filtered[n - delay] を、直前の delay サンプルとつなげて計算する
+        history = np.concatenate([self.previous, filtered])
+        products = filtered * history[:len(filtered)]
+        self.previous = history[-delay:]
+
+        # 区間の境界で区切って和をためる
+        start = 0
+        while start < len(products):
+            boundary = delay - (self.position % delay)
+            end = min(len(products), start + boundary)
+            self.current_sum += float(np.sum(products[start:end]))
+            self.position += end - start
+            if self.position % delay == 0:
+                self.sums.append(self.current_sum)
+                self.current_sum = 0.0
+            start = end
+
+    def bits(self) -> str:
+        """ここまでに完成した区間からビット列を判定する (最初の区間は基準なので除く)"""
+        if len(self.sums) < 2:
+            return ""
+        bit_sums = np.array(self.sums)
+        threshold = np.mean([np.max(bit_sums), np.min(bit_sums)])
+        return "".join(map(str, (bit_sums <= threshold).astype(int)[1:]))
+
+
+def error_rate(original: str, detected: str) -> float:
+    """
+    ビット誤り率 (%)
+
+    録音は再生より長くなることがあるので、検出したビット列の先頭 len(original) ビットだけを比べる。
+    検出したビットが足りない場合は100%とする。
+    """
+    if not original or len(detected) < len(original):
+        return 100.0
+    errors = sum(a != b for a, b in zip(original, detected))
+    return errors / len(original) * 100
@@ -0,0 +1,253 @@
+"""
+ライブ入力の録音 (セッションファイル) と再生
+
+ビジュアライザや受信器に入ってきた音声を、ブロックごとのタイムスタンプ付きでそのまま保存し、
+あとで同じ順番・同じ間隔で流し直せるようにする。マイク無しでGUIのプロファイルや調整ができる。
+
+ファイル形式 (追記のみ、numpy.memmap でそのまま読める):
+
+    ヘッダ (64バイト): MAGIC(8) sample_rate(uint32) channels(uint32) dtype(8, ASCII) 予約
+    レコード: timestamp(float64, 録音開始からの秒) frames(uint32) 予約(uint32) PCM(frames * channels)
+
+書き込みが途中で止まっても、最後の不完全なレコードを無視すれば読み出せる。
+
+再生 (ReplaySource) は audio_capture.AudioCapture と同じ drain() / stats() を持ち、
+  - speed=1.0: 録音時と同じ速さ
+  - speed=N:   N倍速
+  - speed=0:   待ち時間なし (drain() のたびに blocks_per_drain ブロックずつ返す)
+で流す。psk/audio_backend.py の "replay" バックエンドからも使う。
+
+使い方:
+    SESSION_RECORD=field.session python spectrogram.py      # 録音しながら表示
+    SESSION_REPLAY=field.session python spectrogram.py      # 録音を再生して表示
+    SESSION_REPLAY=field.session SESSION_REPLAY_SPEED=0 python code_detector.py
+"""
+import os
+import struct
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"SESSION1"
+HEADER_SIZE = 64
+RECORD_HEADER = struct.Struct("<dII")  # timestamp, frames, 予約
+
+
+class SessionRecorder:
+    """入力ブロックをタイムスタンプ付きで追記する"""
+
+    def __init__(self, path: str, sample_rate: int, channels: int = 1, dtype: str = "int16"):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.start_time = time.perf_counter()
+        self.frames_written = 0
+
+        self.file = open(path, "wb", buffering=1 << 20)
+        header = MAGIC + struct.pack("<II", sample_rate, channels) + self.dtype.str.encode("ascii").ljust(8, b"\0")
+        self.file.write(header.ljust(HEADER_SIZE, b"\0"))
+
+    def write(self, block: np.ndarray, timestamp: Optional[float] = None) -> None:
+        """
+        1ブロックを追記する
+
+        Args:
+            block: (frames,) または (frames, channels) の配列
+            timestamp: 録音開始からの秒 (None の場合は現在時刻から求める)
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter() - self.start_time
+        data = np.ascontiguousarray(block, dtype=self.dtype)
+        frames = data.size // self.channels
+        self.file.write(RECORD_HEADER.pack(timestamp, frames, 0))
+        self.file.write(data.tobytes())
+        self.frames_written += frames
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionReader:
+    """セッションファイルを memmap で開き、ブロックの一覧を作る"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        header = bytes(self.data[:HEADER_SIZE])
+        if header[:8] != MAGIC:
+            raise ValueError(f"セッションファイルではありません: {path}")
+        self.sample_rate, self.channels = struct.unpack("<II", header[8:16])
+        self.dtype = np.dtype(header[16:24].rstrip(b"\0").decode("ascii"))
+
+        # レコードのヘッダだけをたどって、タイムスタンプとPCMの位置を集める
+        timestamps, offsets, frames = [], [], []
+        position = HEADER_SIZE
+        frame_bytes = self.channels * self.dtype.itemsize
+        while position + RECORD_HEADER.size <= len(self.data):
+            timestamp, count, _ = RECORD_HEADER.unpack(bytes(self.data[position:position + RECORD_HEADER.size]))
+            start = position + RECORD_HEADER.size
+            end = start + count * frame_bytes
+            if end > len(self.data):
+                break  # 書き込み途中のレコード
+            timestamps.append(timestamp)
+            offsets.append(start)
+            frames.append(count)
+            position = end
+        self.timestamps = np.array(timestamps, dtype=np.float64)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.frames = np.array(frames, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def total_frames(self) -> int:
+        return int(self.frames.sum())
+
+    @property
+    def duration(self) -> float:
+        return self.total_frames / self.sample_rate
+
+    def block(self, index: int) -> np.ndarray:
+        """index 番目のブロック (memmap のビュー、コピーしない)"""
+        start = int(self.offsets[index])
+        count = int(self.frames[index]) * self.channels
+        pcm = self.data[start:start + count * self.dtype.itemsize].view(self.dtype)
+        return pcm if self.channels == 1 else pcm.reshape(-1, self.channels)
+
+    def blocks(self) -> Iterator[Tuple[float, np.ndarray]]:
+        """(タイムスタンプ, ブロック) を順に返す"""
+        for index in range(len(self)):
+            yield float(self.timestamps[index]), self.block(index)
+
+    def samples(self) -> np.ndarray:
+        """全ブロックを1本につなげる"""
+        if len(self) == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.concatenate([self.block(i) for i in range(len(self))])
+
+    def close(self) -> None:
+        # memmap は参照が無くなった時点で閉じられる
+        self.data = None
+
+
+class ReplaySource:
+    """
+    セッションファイルを録音時のタイミングで流し直す入力
+
+    audio_capture.AudioCapture の代わりに使えるよう、同じ start() / drain() / stats() / close() を持つ。
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = False, blocks_per_drain: int = 16):
+        """
+        :param speed: 再生速度 (1.0 = 録音時と同じ、0 = 待ち時間なし)
+        :param loop: 最後まで再生したら最初に戻る
+        :param blocks_per_drain: speed=0 のときに drain() 1回で返すブロック数
+        """
+        self.reader = SessionReader(path)
+        self.speed = speed
+        self.loop = loop
+        self.blocks_per_drain = blocks_per_drain
+        self.rate = self.reader.sample_rate
+        self.channels = self.reader.channels
+        self.next_block = 0
+        self.start_time = None
+        self.received_frames = 0
+        # 再生では取りこぼしは起きないが、AudioCapture と同じ表示に使う
+        self.dropped_frames = 0
+        self.overflow_count = 0
+
+    def start(self) -> None:
+        self.start_time = time.perf_counter()
+        self.next_block = 0
+
+    @property
+    def finished(self) -> bool:
+        return not self.loop and self.next_block >= len(self.reader)
+
+    def _due_blocks(self) -> int:
+        """現在までに「届いている」べきブロックの番号 (この番号の手前まで)"""
+        if self.speed <= 0:
+            return self.next_block + self.blocks_per_drain
+        elapsed = (time.perf_counter() - self.start_time) * self.speed
+        # 録音上の経過時間が elapsed 以下のブロックまで
+        return int(np.searchsorted(self.reader.timestamps - self.reader.timestamps[0], elapsed, side="right"))
+
+    def drain(self) -> np.ndarray:
+        """前回から「届いた」サンプルをまとめて返す"""
+        if self.start_time is None:
+            self.start()
+        if len(self.reader) == 0:
+            return np.zeros(0, dtype=self.reader.dtype)
+        end = min(self._due_blocks(), len(self.reader))
+        blocks = [self.reader.block(i) for i in range(self.next_block, end)]
+        self.next_block = max(self.next_block, end)
+        if self.loop and self.next_block >= len(self.reader):
+            self.start()
+        if not blocks:
+            return np.zeros(0, dtype=self.reader.dtype)
+        samples = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+        self.received_frames += len(samples)
+        return samples
+
+    def iter_blocks(self, blocksize: int) -> Iterator[Tuple[float, np.ndarray]]:
+        """
+        録音を blocksize フレームごとに区切り直し、(録音上の時刻, ブロック) を順に返す (待ち時間なし)
+
+        コールバック方式の受信器 (psk/audio_backend.py) 用。端数のブロックは捨てる。
+        録音全体をメモリに読み込まないよう、memmap のブロックを順にたどり、
+        ブロックの境界をまたぐ分だけを carry にためてつなげる。
+        """
+        carry = None  # 前のブロックの使い残し (blocksize 未満)
+        position = 0
+        for _, block in self.reader.blocks():
+            if carry is not None:
+                needed = blocksize - len(carry)
+                if len(block) < needed:
+                    carry = np.concatenate([carry, block])
+                    continue
+                yield position / self.rate, np.concatenate([carry, block[:needed]])
+                position += blocksize
+                block = block[needed:]
+                carry = None
+            # ブロック内で区切れる分は memmap のビューのまま返す
+            usable = len(block) - len(block) % blocksize
+            for start in range(0, usable, blocksize):
+                yield position / self.rate, block[start:start + blocksize]
+                position += blocksize
+            if usable < len(block):
+                carry = np.array(block[usable:])
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "received_frames": self.received_frames,
+            "dropped_frames": 0,
+            "overflow_count": 0,
+            "queued_blocks": len(self.reader) - self.next_block,
+        }
+
+    def drops_changed(self) -> bool:
+        return False
+
+    def status_text(self) -> str:
+        return f"再生 {self.received_frames / self.rate:.1f} / {self.reader.duration:.1f} 秒"
+
+    def close(self) -> None:
+        self.reader.close()
+
+
+def replay_speed_from_env() -> float:
+    """環境変数 SESSION_REPLAY_SPEED (既定 1.0、0 で待ち時間なし)"""
+    return float(os.environ.get("SESSION_REPLAY_SPEED", "1.0"))
@@ -3,29 +3,31 @@ import numpy as np
 import pyqtgraph as pg
 from PyQt5 import QtWidgets, QtCore
 
+from audio_capture import open_capture
+from spectrogram_history import SpectrogramHistory
+from stft_engine import STFTEngine
+
 class AudioStreamVisualizer:
     """リアルタイムで音声データのスペクトログラムをグラフィカルに表示するクラスです。"""
 
-    def __init__(self, chunk=2048, format=pyaudio.paInt16, channels=1, rate=16000, history_length=100):
+    def __init__(self, chunk=2048, format=pyaudio.paInt16, channels=1, rate=16000, history_length=100, hop=None, display_rows=None):
         self.CHUNK = chunk
+        self.HOP = hop or chunk  # chunkより小さくするとフレームが重なり、表示の時間分解能が上がる
         self.FORMAT = format
         self.CHANNELS = channels
         self.RATE = rate
         self.HISTORY_LENGTH = history_length
+        self.DISPLAY_ROWS = display_rows  # 履歴が長い場合に描画する最大行数 (None は全行)
+        self.stft = STFTEngine(self.CHUNK, self.RATE, hop=self.HOP, window=None)
         self.init_audio_stream()
         self.setup_gui()
         self.setup_timer()
 
     def init_audio_stream(self):
         """オーディオストリームを初期化します。"""
-        self.p = pyaudio.PyAudio()
-        self.stream = self.p.open(
-            format=self.FORMAT,
-            channels=self.CHANNELS,
-            rate=self.RATE,
-            input=True,
-            frames_per_buffer=self.CHUNK
-        )
+        # 録音はPortAudioのスレッドで行い、GUIスレッドはキューから取り出すだけにする
+        # (環境変数 SESSION_RECORD / SESSION_REPLAY でセッションの録音・再生に切り替わる)
+        self.capture = open_capture(self.RATE, self.CHANNELS, frames_per_buffer=self.HOP)
 
     def setup_gui(self):
         """グラフィカルユーザーインターフェースをセットアップ"""
@@ -34,8 +36,8 @@ class AudioStreamVisualizer:
         self.plot_spectrogram = self.win.addPlot(title="リアルタイムスペクトログラム")
         self.spectrogram = pg.ImageItem()
         self.plot_spectrogram.addItem(self.spectrogram)
-        self.spectrogram_data = np.zeros((self.HISTORY_LENGTH, self.CHUNK // 2 + 1))
-        self.spectrogram.setImage(self.spectrogram_data)
+        self.history = SpectrogramHistory(self.HISTORY_LENGTH, self.stft.num_bins)
+        self.spectrogram.setImage(self.history.view(self.DISPLAY_ROWS))
         self.spectrogram.setRect(pg.QtCore.QRectF(0, 0, self.HISTORY_LENGTH, self.RATE / 2))
         self.plot_spectrogram.setLabel('left', 'Frequency (Hz)')
         self.plot_spectrogram.setLabel('bottom', 'Time (Samples)')
@@ -51,25 +53,32 @@ class AudioStreamVisualizer:
     def update(self):
         """ストリームからデータを読み込み、スペクトログラムを更新"""
         try:
-            data = self.stream.read(self.CHUNK, exception_on_overflow=False)
-            fft_data = self.compute_fft(data)
-            self.update_spectrogram(fft_data)
+            self.report_drops()
+            samples = self.capture.drain()
+            if len(samples) == 0:
+                return
+            for fft_data in self.stft.push(samples):
+                self.update_spectrogram(fft_data)
+            self.draw_spectrogram()
         except Exception as e:
             print(f"エラーが発生しました: {str(e)}")
 
     def compute_fft(self, data):
-        """FFTを計算して正規化"""
-        numpydata = np.frombuffer(data, dtype=np.int16)
-        fft_data = np.fft.rfft(numpydata)
-        fft_magnitude = np.abs(fft_data) / self.CHUNK
-        fft_magnitude = 20 * np.log10(fft_magnitude + 1e-10)
-        return fft_magnitude
+        """FFTを計算して正規化 (1フレーム分)"""
+        return self.stft.spectrum(np.frombuffer(data, dtype=np.int16))
 
     def update_spectrogram(self, fft_data):
-        """スペクトログラムデータを更新"""
-        self.spectrogram_data = np.roll(self.spectrogram_data, 1, axis=0)
-        self.spectrogram_data[0, :] = fft_data
-        self.spectrogram.setImage(self.spectrogram_data, autoLevels=False, levels=(10, 40))
+        """スペクトログラムデータを更新 (履歴に1行書き込むだけで、描画は draw_spectrogram で行う)"""
+        self.history.append(fft_data)
+
+    def draw_spectrogram(self):
+        """履歴をコピーせずに画像として表示"""
+        self.spectrogram.setImage(self.history.view(self.DISPLAY_ROWS), autoLevels=False, levels=(10, 40))
+
+    def report_drops(self):
+        """取りこぼしが増えたらウィンドウのタイトルに表示"""
+        if self.capture.drops_changed():
+            self.win.setWindowTitle(f"リアルタイムスペクトログラム ({self.capture.status_text()})")
 
     def start(self):
         """イベントループを開始"""
@@ -77,8 +86,7 @@ class AudioStreamVisualizer:
 
     def close(self):
         """ストリームとPyAudioをクリーンアップ"""
-        self.stream.stop_stream()
-        self.stream.close()
+        self.capture.close()
 
 if __name__ == '__main__':
     visualizer = AudioStreamVisualizer()
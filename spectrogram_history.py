@@ -0,0 +1,61 @@
+"""
+スペクトログラム表示用の履歴バッファ
+
+np.roll で画像全体をずらす代わりに、行を循環位置に1行だけ書き込む。
+バッファは履歴の長さの2倍確保し、同じ行を2か所に書く (ダブルライト) ことで、
+新しい順に並んだ履歴をコピー無しの連続したビューとして取り出せる。
+1フレームあたりのコストは周波数ビン数に比例し、履歴の長さには依存しない。
+
+使い方:
+    history = SpectrogramHistory(history_length=2000, num_bins=1025)
+    history.append(spectrum)                      # フレームごと (1行書き込むだけ)
+    image_item.setImage(history.view(max_rows=500), autoLevels=False)  # 描画のタイミングで1回
+"""
+from typing import Optional
+
+import numpy as np
+
+
+class SpectrogramHistory:
+    """新しいフレームが0行目に来る循環バッファ"""
+
+    def __init__(self, history_length: int, num_bins: int, dtype=np.float32, fill_value: float = 0.0):
+        """
+        :param history_length: 保持するフレーム数
+        :param num_bins: 1フレームの周波数ビン数
+        :param dtype: バッファの型
+        :param fill_value: 初期値 (まだ書き込まれていない行の値)
+        """
+        self.history_length = history_length
+        self.num_bins = num_bins
+        self.data = np.full((2 * history_length, num_bins), fill_value, dtype=dtype)
+        self.position = 0  # 最新の行の位置 (0 <= position < history_length)
+        self.frames_written = 0
+
+    def append(self, row: np.ndarray) -> None:
+        """1フレーム分を書き込む (古い行は上書きされる)"""
+        # 書き込み位置を1つ戻すことで、position から history_length 行が新しい順に並ぶ
+        self.position = (self.position - 1) % self.history_length
+        self.data[self.position] = row
+        self.data[self.position + self.history_length] = row
+        self.frames_written += 1
+
+    def view(self, max_rows: Optional[int] = None) -> np.ndarray:
+        """
+        新しい順に並んだ履歴 (0行目が最新) をコピー無しで返す
+
+        Args:
+            max_rows: 表示する最大行数。履歴がこれより長い場合は行を間引いたビューを返す
+
+        Returns:
+            np.ndarray: (行数, num_bins) のビュー。次の append() で内容が変わる
+        """
+        ordered = self.data[self.position:self.position + self.history_length]
+        if max_rows is not None and self.history_length > max_rows:
+            step = -(-self.history_length // max_rows)  # 切り上げ
+            return ordered[::step]
+        return ordered
+
+    def latest(self) -> np.ndarray:
+        """最新のフレーム"""
+        return self.data[self.position]
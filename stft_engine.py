@@ -0,0 +1,172 @@
+"""
+スペクトログラム表示用の共通STFTエンジン
+
+spectrogram.py / code_detector.py / frequency_graph.py / comfortable_tone/code_detector.py で共通に使う。
+窓関数・ゼロ詰め用バッファ・出力バッファを最初に1度だけ確保し、フレームごとの計算は
+すべて float32 の事前確保済みバッファ上で行う (フレームごとのメモリ確保をしない)。
+
+  - hop (フレームの移動量) を frame_length より小さくすると、重なりのあるSTFTになる
+  - band=(下限Hz, 上限Hz) を指定すると、その帯域のビンだけを出力する
+  - さらに zoom_bins を指定すると、全帯域のFFTの代わりにチャープZ変換 (scipy.signal.ZoomFFT) で
+    帯域内だけを zoom_bins 点の細かい間隔で計算する (ビンの間隔 = 帯域幅 / (zoom_bins - 1))
+  - output="db" で 20*log10(振幅)、"magnitude" で振幅をそのまま返す
+  - batch() で録音全体を (フレーム数, ビン数) の行列としてまとめて計算できる
+
+使い方:
+    stft = STFTEngine(frame_length=2048, sample_rate=16000, hop=512)
+    for spectrum in stft.push(np.frombuffer(data, dtype=np.int16)):
+        ...  # spectrum は次の計算で上書きされるので、保存する場合はコピーする
+"""
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class STFTEngine:
+    """事前確保したバッファで短時間フーリエ変換を行うクラス"""
+
+    def __init__(self, frame_length: int, sample_rate: int, nfft: Optional[int] = None,
+                 hop: Optional[int] = None, window: Optional[str] = "hann",
+                 band: Optional[Tuple[float, float]] = None, output: str = "db", floor: float = 1e-10,
+                 zoom_bins: Optional[int] = None):
+        """
+        :param frame_length: 1フレームのサンプル数
+        :param sample_rate: サンプリングレート
+        :param nfft: FFTのポイント数 (frame_length より大きい場合はゼロ詰めする)
+        :param hop: フレームの移動量 (None の場合は frame_length = 重なりなし)
+        :param window: "hann" または None (矩形窓)
+        :param band: 出力する周波数帯域 (下限Hz, 上限Hz)。None の場合は全帯域
+        :param output: "db" または "magnitude"
+        :param floor: log10 の前に加える値 (無音で -inf にならないように)
+        :param zoom_bins: band 内を何点で計算するか (チャープZ変換を使う。None の場合は通常のFFTのビン)
+        """
+        self.frame_length = frame_length
+        self.sample_rate = sample_rate
+        self.nfft = nfft or frame_length
+        self.hop = hop or frame_length
+        self.output = output
+        self.floor = np.float32(floor)
+        if self.nfft < frame_length:
+            raise ValueError("nfft は frame_length 以上にしてください")
+        if not 0 < self.hop <= frame_length:
+            raise ValueError("hop は 1 以上 frame_length 以下にしてください")
+        if output not in ("db", "magnitude"):
+            raise ValueError(f"未対応の output です: {output}")
+
+        # 窓関数と振幅の正規化 (従来の compute_fft と同じく frame_length で割る) をまとめておく
+        if window == "hann":
+            self.window = np.hanning(frame_length).astype(np.float32)
+        elif window is None:
+            self.window = np.ones(frame_length, dtype=np.float32)
+        else:
+            raise ValueError(f"未対応の窓関数です: {window}")
+        self.scale = np.float32(1.0 / frame_length)
+
+        # 出力するビンの範囲
+        all_frequencies = np.fft.rfftfreq(self.nfft, 1.0 / sample_rate)
+        self.zoom = None
+        if zoom_bins is not None:
+            if band is None:
+                raise ValueError("zoom_bins を使う場合は band を指定してください")
+            from scipy.signal import ZoomFFT
+
+            low, high = band
+            # 帯域の両端を含めて zoom_bins 点。ゼロ詰めしなくても任意の間隔で計算できるので nfft は使わない
+            self.zoom = ZoomFFT(frame_length, (low, high), zoom_bins, fs=sample_rate, endpoint=True)
+            all_frequencies = np.linspace(low, high, zoom_bins)
+            self.bin_slice = slice(0, zoom_bins)
+        elif band is None:
+            self.bin_slice = slice(0, len(all_frequencies))
+        else:
+            low, high = band
+            self.bin_slice = slice(int(np.searchsorted(all_frequencies, low, side="left")),
+                                   int(np.searchsorted(all_frequencies, high, side="right")))
+        self.frequencies = all_frequencies[self.bin_slice]
+        self.num_bins = len(self.frequencies)
+
+        # 作業用バッファ (ゼロ詰め部分は最初に0で確保したまま書き換えない)
+        self.work = np.zeros(self.nfft, dtype=np.float32)
+        self.out = np.zeros(self.num_bins, dtype=np.float32)
+        # push() 用の入力バッファ (直近 frame_length サンプル + 未処理の入力)
+        self.pending = np.zeros(frame_length, dtype=np.float32)
+        self.pending_fill = 0
+
+    def spectrum(self, frame: np.ndarray) -> np.ndarray:
+        """
+        1フレーム分のスペクトルを計算する
+
+        Args:
+            frame: frame_length サンプルの入力 (int16 / float どちらでもよい)
+
+        Returns:
+            np.ndarray: 帯域内のスペクトル (float32)。次の呼び出しで上書きされるビュー
+        """
+        n = min(len(frame), self.frame_length)
+        np.multiply(frame[:n], self.window[:n], out=self.work[:n], casting="unsafe")
+        if n < self.frame_length:
+            self.work[n:self.frame_length] = 0
+        if self.zoom is not None:
+            spectrum = self.zoom(self.work[:self.frame_length])
+        else:
+            spectrum = np.fft.rfft(self.work)[self.bin_slice]
+
+        out = self.out
+        np.abs(spectrum, out=out, casting="unsafe")
+        out *= self.scale
+        if self.output == "db":
+            out += self.floor
+            np.log10(out, out=out)
+            out *= np.float32(20.0)
+        return out
+
+    def push(self, samples: np.ndarray) -> Iterator[np.ndarray]:
+        """
+        入力を追加し、hop ごとに完成したフレームのスペクトルを順に返す
+
+        最初のフレームは frame_length サンプルたまってから返す。
+        返すスペクトルは spectrum() と同じく次の計算で上書きされる。
+        """
+        pending = self.pending
+        position = 0
+        while position < len(samples):
+            take = min(self.frame_length - self.pending_fill, len(samples) - position)
+            pending[self.pending_fill:self.pending_fill + take] = samples[position:position + take]
+            self.pending_fill += take
+            position += take
+            if self.pending_fill == self.frame_length:
+                yield self.spectrum(pending)
+                # hop 分だけ古いサンプルを捨てる (重なり部分は残す)
+                keep = self.frame_length - self.hop
+                if keep > 0:
+                    pending[:keep] = pending[self.hop:]
+                self.pending_fill = keep
+
+    def batch(self, signal: np.ndarray) -> np.ndarray:
+        """
+        録音全体 (またはその一部) を hop ごとのフレームに分け、まとめてスペクトルを計算する
+
+        push() と違って入力はためず、signal の中で完結するフレームだけを計算する。
+        次のブロックを続けて処理する場合は、(フレーム数 * hop) サンプル目から渡す。
+
+        Returns:
+            np.ndarray: (フレーム数, num_bins) の float32。新しく確保した配列
+        """
+        if len(signal) < self.frame_length:
+            return np.zeros((0, self.num_bins), dtype=np.float32)
+        frames = sliding_window_view(signal, self.frame_length)[::self.hop]
+        windowed = frames * self.window  # (フレーム数, frame_length) の float32
+        if self.zoom is not None:
+            spectra = np.abs(self.zoom(windowed, axis=1)).astype(np.float32)
+        else:
+            spectra = np.abs(np.fft.rfft(windowed, n=self.nfft, axis=1)[:, self.bin_slice]).astype(np.float32)
+        spectra *= self.scale
+        if self.output == "db":
+            spectra += self.floor
+            np.log10(spectra, out=spectra)
+            spectra *= np.float32(20.0)
+        return spectra
+
+    def reset(self) -> None:
+        """push() 用にためた入力を捨てる"""
+        self.pending_fill = 0